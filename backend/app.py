@@ -1,13 +1,29 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from typing import Dict, List, Optional
 import os
+import json
+import time
 import uuid
+import asyncio
 import logging
 from .models.whisper_service import WhisperService
-from .utils.file_handler import FileHandler
+from .models.audio import MEDIA_EXTENSIONS, SAMPLE_RATE
+from .models.streaming import StreamingTranscriber, FFmpegStreamDecoder, serve_stream
+from .models.engines import MODEL_INFO, LANGUAGE_CODES, available_engines, default_engine, get_engine
+from .utils.file_handler import FileHandler, FileTooLargeError, UploadOffsetError, UploadRangeError
+from .utils.job_queue import (
+    TranscriptionScheduler, TranscriptionJob, QueueFullError, SchedulerUnavailableError, PRIORITY_CLASSES, DEADLINE_ACTIONS
+)
+from .utils.shared_queue import SharedQueueScheduler, create_shared_queue
+from .utils.batch_manager import BatchManager, BatchPathError
+from .utils.janitor import StorageJanitor
+from .utils.formats import OUTPUT_FORMATS
+from .utils.metrics import metrics, REQUEST_LATENCY, monitor_event_loop_lag
+from .utils.tracing import tracer
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
@@ -29,33 +45,128 @@ app.add_middleware(
 )
 
 # 服務實例
-whisper_service = WhisperService()
 file_handler = FileHandler()
+whisper_service = WhisperService(file_handler)
+
+def fit_deadline(job: TranscriptionJob, seconds_left: float):
+    """期限內來不及完成時改用的模型"""
+    return whisper_service.fit_model(job.duration, job.model_size, job.kwargs.get("engine"), seconds_left)
+
+async def expire_job(job: TranscriptionJob):
+    if await cancel_job(job.file_id, "已超過期限") is None:
+        # 排隊中的工作已由排程器移出佇列
+        await file_handler.update_processing_status(job.file_id, "cancelled", 0, "已取消", "已超過期限")
+
+# JOB_QUEUE=sqlite 時工作加入共用佇列，由推論節點（python -m backend.worker）執行，本行程不載入模型；
+# 可同時執行多個 API 節點，狀態與結果從共用的工作儲存讀取
+shared_queue = create_shared_queue(file_handler.upload_dir)
+if shared_queue is not None:
+    scheduler = SharedQueueScheduler(shared_queue)
+else:
+    scheduler = TranscriptionScheduler(
+        whisper_service.run_job,
+        num_workers=whisper_service.num_workers,
+        short_job_slots=whisper_service.batcher.max_batch_size if whisper_service.batcher.enabled else 0,
+        short_job_seconds=whisper_service.batch_max_seconds,
+        fit_deadline=fit_deadline,
+        on_expired=expire_job
+    )
+    # 排隊越多，每個工作分到的推論執行緒越少
+    whisper_service.queue_depth = lambda: scheduler.queue_depth
+
+janitor = StorageJanitor(file_handler, scheduler.is_active)
+
+# 與應用同生命週期的背景工作（事件迴圈延遲監測等）
+background_tasks = set()
+
+# 即時串流：同時連線數上限與閒置逾時；輸入格式對應的 ffmpeg demuxer
+stream_max_connections = int(os.getenv("STREAM_MAX_CONNECTIONS", 4))
+stream_idle_timeout = float(os.getenv("STREAM_IDLE_TIMEOUT_SECONDS", 30))
+stream_connections = set()
+STREAM_ENCODINGS = {"pcm_s16le": "s16le", "webm": "matroska", "ogg": "ogg"}
 
 # Pydantic 模型
 class TranscribeRequest(BaseModel):
     file_id: str
+    # auto 時依語言選擇模型大小（MODEL_ROUTING）
+    model_size: str = "base"
+    # auto 時先以小模型偵測語言（LANGUAGE_DETECTION_MODEL）
+    language: str = "auto"
+    include_timestamps: bool = False
+    # 推論引擎（torch / ctranslate2 / onnx），未指定時使用 WHISPER_ENGINE
+    engine: Optional[str] = None
+    # 先以語音活動偵測略過靜音，只將語音區間送入模型
+    vad: bool = False
+    # 句段附帶逐字時間戳記（下載 format=words 時需要）
+    word_timestamps: bool = False
+    # 排程優先等級：interactive（預設）或 batch；等待越久優先等級越高
+    priority: str = "interactive"
+    # 從送出起算的完成期限（秒），超過時依 deadline_action 取消（drop）或開始前改用較小的模型（downgrade）
+    deadline_seconds: Optional[float] = None
+    deadline_action: str = "downgrade"
+
+class BatchRequest(BaseModel):
+    # 相對於 BATCH_INPUT_DIR 的檔案或目錄（目錄會遞迴列出支援格式的檔案）
+    paths: List[str]
     model_size: str = "base"
     language: str = "auto"
     include_timestamps: bool = False
+    engine: Optional[str] = None
+    vad: bool = False
+    word_timestamps: bool = False
+    priority: str = "batch"
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    total: int
+    files: List[Dict[str, str]]
 
 class HealthResponse(BaseModel):
     status: str
     service: str
+    ready: bool = True
+    checks: dict = {}
+    warm_up: str = "ready"
+    queue_depth: int = 0
 
 class ModelInfo(BaseModel):
     id: str
     name: str
     size: str
+    engines: list[str] = []
+    downloaded: list[str] = []
+
+class EngineInfo(BaseModel):
+    name: str
+    default: bool
+    capabilities: dict
 
 class ModelsResponse(BaseModel):
     models: list[ModelInfo]
+    engines: list[EngineInfo] = []
+    languages: list[str] = []
+    # model_size 為 auto 時各語言使用的模型大小（* 為其他語言）
+    routing: dict = {}
 
 class UploadResponse(BaseModel):
     file_id: str
     filename: str
     size: int
+    # 預估處理時間（分鐘，以 base 模型與預設引擎估算）
     estimated_time: float
+    estimated_seconds: float
+    duration: Optional[float] = None
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+
+class UploadSessionResponse(BaseModel):
+    session_id: str
+    filename: str
+    size: int
+    offset: int
+    chunk_size: int
 
 class TranscribeResponse(BaseModel):
     success: bool
@@ -64,58 +175,353 @@ class TranscribeResponse(BaseModel):
     word_count: int
     char_count: int
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """依路由樣板記錄請求延遲（串流回應記錄到送出標頭為止）"""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            route=getattr(route, "path", None) or ("static" if route else "unmatched"),
+            method=request.method,
+            status=status_code
+        )
+
+def collect_service_metrics():
+    """抓取時計算的佇列、模型快取、結果快取與批次推論指標"""
+    yield ("transcription_queue_depth", "gauge", "排隊中的轉換工作數", [({}, scheduler.queue_depth)])
+    yield ("transcription_active_jobs", "gauge", "執行中的轉換工作數（依模型）",
+           [({"model": model}, count) for model, count in scheduler.active_per_model().items()])
+    
+    model_cache = whisper_service.model_cache_stats()
+    yield ("model_cache_events_total", "counter", "模型快取命中、未命中、淘汰與載入次數",
+           [({"event": event}, count) for event, count in model_cache["totals"].items()])
+    yield ("model_load_seconds", "gauge", "各工作者最近一次載入模型的耗時",
+           [({"worker": pid, "model": model}, seconds)
+            for pid, stats in model_cache["workers"].items()
+            for model, seconds in stats.get("load_seconds", {}).items()])
+    yield ("model_memory_used_bytes", "gauge", "各工作者常駐模型佔用的記憶體",
+           [({"worker": pid}, stats.get("memory_used_mb", 0) * 1024 * 1024) for pid, stats in model_cache["workers"].items()])
+    
+    yield ("transcript_cache_events_total", "counter", "轉換結果快取命中、未命中與淘汰次數",
+           [({"event": event}, count) for event, count in file_handler.transcript_cache.stats().items()])
+    batching = whisper_service.batcher.stats()
+    yield ("inference_batches_total", "counter", "批次推論次數", [({}, batching["batches"])])
+    yield ("inference_batched_items_total", "counter", "以批次推論處理的音訊數", [({}, batching["batched_items"])])
+    yield ("sse_subscribers", "gauge", "目前的 SSE 訂閱數", [({}, file_handler.events.subscriber_count)])
+    yield ("stream_connections", "gauge", "目前的即時串流連線數", [({}, len(stream_connections))])
+    if shared_queue is not None:
+        yield ("queue_workers", "gauge", "共用佇列中存活的推論節點數", [({}, len(scheduler.workers))])
+    
+    storage = janitor.stats()
+    yield ("storage_usage_bytes", "gauge", "上傳與結果目錄最近一次清理時的用量（不含結果快取）", [({}, storage["usage_bytes"])])
+    yield ("storage_quota_bytes", "gauge", "儲存空間配額（0 表示不限制）", [({}, storage["quota_bytes"])])
+    yield ("storage_cleanup_total", "counter", "定期清理刪除的工作、來源檔與殘留檔案數",
+           [({"kind": kind}, storage[kind]) for kind in ("deleted_jobs", "released_sources", "removed_files")])
+    yield ("storage_cleanup_freed_bytes_total", "counter", "定期清理釋放的位元組數", [({}, storage["freed_bytes"])])
+
+metrics.register_collector(collect_service_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 格式的指標"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/health", response_model=HealthResponse)
 async def health_check():
-    """健康檢查端點"""
-    return HealthResponse(status="healthy", service="whisper-transcriber")
+    """健康檢查端點：排程器運作中、預載入模型已就緒（共用佇列時為至少一個推論節點存活）且佇列未滿時才回報就緒，否則返回 503"""
+    checks = {
+        "scheduler_running": scheduler.running,
+        "model_loaded": bool(scheduler.workers) if shared_queue is not None else whisper_service.is_model_loaded(),
+        "queue_available": not scheduler.saturated,
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "healthy" if ready else "unavailable",
+            "service": "whisper-transcriber",
+            "ready": ready,
+            "checks": checks,
+            "warm_up": whisper_service.warm_up_state,
+            "queue_depth": scheduler.queue_depth,
+        }
+    )
+
+@app.get("/api/traces")
+async def get_traces():
+    """最近工作的各階段時間區段（需設定 TRACING=1）"""
+    return JSONResponse(content={"enabled": tracer.enabled, "traces": tracer.dump()})
+
+@app.get("/api/traces/{file_id}")
+async def get_trace(file_id: str):
+    """單一工作的各階段時間區段"""
+    spans = tracer.get(file_id)
+    if spans is None:
+        raise HTTPException(status_code=404, detail="沒有此工作的追蹤紀錄" if tracer.enabled else "追蹤未啟用（TRACING=1）")
+    return JSONResponse(content={"file_id": file_id, "spans": spans})
 
 @app.get("/api/models", response_model=ModelsResponse)
 async def get_available_models():
-    """獲取可用的 Whisper 模型列表"""
+    """獲取已安裝推論引擎可用的 Whisper 模型列表"""
+    engines = [get_engine(name) for name in available_engines()]
+    if not engines:
+        return ModelsResponse(models=[], languages=list(LANGUAGE_CODES))
+    
     models = [
-        ModelInfo(id="tiny", name="Tiny - 最快速", size="39 MB"),
-        ModelInfo(id="base", name="Base - 平衡（推薦）", size="74 MB"),
-        ModelInfo(id="small", name="Small - 較準確", size="244 MB"),
-        ModelInfo(id="medium", name="Medium - 很準確", size="769 MB"),
-        ModelInfo(id="large", name="Large - 最準確", size="1550 MB")
+        ModelInfo(
+            id=model_size,
+            name=info["name"],
+            size=info["size"],
+            engines=[engine.name for engine in engines],
+            downloaded=[engine.name for engine in engines if engine.is_downloaded(model_size)]
+        )
+        for model_size, info in MODEL_INFO.items()
     ]
-    return ModelsResponse(models=models)
+    return ModelsResponse(
+        models=models,
+        engines=[
+            EngineInfo(name=engine.name, default=engine.name == default_engine(), capabilities=engine.capabilities)
+            for engine in engines
+        ],
+        languages=list(LANGUAGE_CODES),
+        routing=whisper_service.model_routing
+    )
 
-@app.post("/api/upload", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...)):
-    """上傳音頻檔案"""
-    
-    # 檢查檔案類型
-    allowed_extensions = {'.mp3', '.wav', '.m4a', '.flac', '.mp4', '.avi', '.mov', '.mkv', '.webm'}
-    file_extension = os.path.splitext(file.filename)[1].lower()
+@app.get("/api/models/cache")
+async def get_model_cache_stats():
+    """模型快取命中、未命中與淘汰統計（用於調整 WHISPER_MODEL_MEMORY_MB）"""
+    return JSONResponse(content={
+        **whisper_service.model_cache_stats(),
+        "batching": whisper_service.batcher.stats(),
+        "processing_rtf": whisper_service.estimator.stats(),
+        "transcript_cache": file_handler.transcript_cache.stats()
+    })
+
+# 支援的檔案類型
+allowed_extensions = set(MEDIA_EXTENSIONS)
+
+def validate_extension(filename: str):
+    """檢查檔案類型"""
+    file_extension = os.path.splitext(filename)[1].lower()
     
     if file_extension not in allowed_extensions:
         raise HTTPException(
             status_code=400, 
             detail=f"不支援的檔案格式: {file_extension}. 支援格式: {', '.join(allowed_extensions)}"
         )
+
+async def build_upload_response(file_id: str) -> UploadResponse:
+    file_info = await file_handler.get_file_info(file_id)
+    estimate = await whisper_service.estimate(file_id, "base")
+    
+    return UploadResponse(
+        file_id=file_id,
+        filename=file_info["filename"],
+        size=file_info["size"],
+        estimated_time=max(0.1, round(estimate["estimated_seconds"] / 60, 1)),
+        estimated_seconds=estimate["estimated_seconds"],
+        duration=estimate["duration"]
+    )
+
+@app.post("/api/upload", response_model=UploadResponse)
+async def upload_file(request: Request, file: UploadFile = File(...)):
+    """上傳音頻檔案"""
     
-    # 檢查檔案大小 (限制 500MB)
-    file_content = await file.read()
-    if len(file_content) > 500 * 1024 * 1024:  # 500MB
-        raise HTTPException(status_code=400, detail="檔案大小超過 500MB 限制")
+    validate_extension(file.filename)
+    
+    # 依 Content-Length 先行拒絕明顯超過限制的請求
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > file_handler.max_file_size + 64 * 1024:
+        raise HTTPException(status_code=400, detail=f"檔案大小超過 {file_handler.max_file_size // (1024 * 1024)}MB 限制")
     
     try:
-        # 儲存檔案並返回檔案 ID
-        file_id = await file_handler.save_upload(file, file_content)
-        file_info = await file_handler.get_file_info(file_id)
-        
-        return UploadResponse(
-            file_id=file_id,
-            filename=file_info["filename"],
-            size=file_info["size"],
-            estimated_time=file_info["estimated_processing_time"]
-        )
+        # 串流儲存檔案並返回檔案 ID，大小限制於寫入時檢查
+        file_id = await file_handler.save_upload(file)
+        # 背景預先解碼音軌，轉換時不必再解碼
+        whisper_service.preprocessor.schedule(file_id)
+        return await build_upload_response(file_id)
         
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"檔案上傳失敗: {e}")
         raise HTTPException(status_code=500, detail=f"檔案上傳失敗: {str(e)}")
 
+@app.post("/api/upload/sessions", response_model=UploadSessionResponse)
+async def create_upload_session(request: UploadSessionRequest):
+    """建立可續傳的分段上傳工作階段"""
+    
+    validate_extension(request.filename)
+    
+    try:
+        session = await file_handler.create_upload_session(request.filename, request.size)
+        return UploadSessionResponse(
+            session_id=session["session_id"],
+            filename=session["original_filename"],
+            size=session["file_size"],
+            offset=session["offset"],
+            chunk_size=file_handler.chunk_size
+        )
+        
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/upload/sessions/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session(session_id: str):
+    """查詢工作階段已接收的位元組數（斷線後據此續傳）"""
+    
+    session = await file_handler.get_upload_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="上傳工作階段不存在")
+    
+    return UploadSessionResponse(
+        session_id=session_id,
+        filename=session["original_filename"],
+        size=session["file_size"],
+        offset=session["offset"],
+        chunk_size=file_handler.chunk_size
+    )
+
+@app.put("/api/upload/sessions/{session_id}", response_model=UploadSessionResponse)
+async def upload_session_chunk(session_id: str, request: Request):
+    """上傳一段位元組區段，需帶 Content-Range: bytes start-end/total"""
+    
+    content_range = request.headers.get("content-range", "")
+    try:
+        unit, byte_range = content_range.split(" ", 1)
+        span, total = byte_range.split("/", 1)
+        start, end = (int(value) for value in span.split("-", 1))
+        total = int(total)
+        if unit != "bytes":
+            raise ValueError(unit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="缺少或無效的 Content-Range 標頭")
+    
+    try:
+        session = await file_handler.append_upload_chunk(session_id, start, end, total, request.stream())
+        
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="上傳工作階段不存在")
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.expected_offset})
+    except (FileTooLargeError, UploadRangeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return UploadSessionResponse(
+        session_id=session_id,
+        filename=session["original_filename"],
+        size=session["file_size"],
+        offset=session["offset"],
+        chunk_size=file_handler.chunk_size
+    )
+
+@app.post("/api/upload/sessions/{session_id}/complete", response_model=UploadResponse)
+async def complete_upload_session(session_id: str):
+    """完成分段上傳並返回檔案 ID"""
+    
+    try:
+        file_id = await file_handler.complete_upload_session(session_id)
+        whisper_service.preprocessor.schedule(file_id)
+        return await build_upload_response(file_id)
+        
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="上傳工作階段不存在")
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail={"message": "檔案尚未上傳完成", "offset": e.received_offset})
+
+def validate_transcription_options(model_size: str, language: str, engine: Optional[str], word_timestamps: bool = False) -> str:
+    """驗證推論引擎、模型大小與語言代碼，返回實際使用的引擎"""
+    engine = engine or default_engine()
+    if engine not in available_engines():
+        raise HTTPException(status_code=400, detail=f"推論引擎未安裝: {engine}")
+    if word_timestamps and not get_engine(engine).capabilities.get("word_timestamps"):
+        raise HTTPException(status_code=400, detail=f"推論引擎不支援逐字時間戳記: {engine}")
+    
+    if model_size != "auto" and model_size not in MODEL_INFO:
+        raise HTTPException(status_code=400, detail=f"無效的模型大小: {model_size}")
+    
+    valid_languages = {"auto", *LANGUAGE_CODES}
+    if language not in valid_languages:
+        raise HTTPException(status_code=400, detail=f"無效的語言代碼: {language}")
+    return engine
+
+def validate_scheduling_options(priority: str, deadline_seconds: Optional[float] = None, deadline_action: str = "downgrade"):
+    """驗證優先等級與期限設定"""
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"無效的優先等級: {priority}（可用: {', '.join(PRIORITY_CLASSES)}）")
+    if deadline_seconds is not None and deadline_seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds 必須大於 0")
+    if deadline_action not in DEADLINE_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"無效的期限處理方式: {deadline_action}（可用: {', '.join(DEADLINE_ACTIONS)}）")
+
+async def start_transcription(file_id: str, options: Dict) -> Dict:
+    """使用快取結果或將轉換加入佇列（佇列已滿時拋出 QueueFullError）"""
+    
+    # model_size 為 auto 時只在已偵測過語言時立即選擇模型；否則以 auto 排隊，由工作開始時偵測語言
+    # （需要解碼與推論，不在請求中進行）
+    if options["model_size"] == "auto":
+        language = await whisper_service.known_language(file_id, options["language"])
+        if language != "auto":
+            options = {**options, "model_size": whisper_service.route_model("auto", language)}
+    
+    # 相同內容與參數已轉換過時直接返回快取結果
+    if not scheduler.is_active(file_id) and await file_handler.restore_cached_result(
+        file_id, options["model_size"], options["language"], options["include_timestamps"], options["engine"], options["vad"],
+        options.get("word_timestamps", False)
+    ):
+        await file_handler.update_processing_status(
+            file_id, "completed", 100, "完成", "使用快取結果", 0.0
+        )
+        return {"cached": True, "model_size": options["model_size"]}
+    
+    # 加入轉換佇列，由排程器的工作者依序處理（預估時間較短的工作優先）
+    # 尚未選定模型時以未知語言的路由（MODEL_ROUTING 的 *）預估
+    estimate = await whisper_service.estimate(file_id, whisper_service.route_model(options["model_size"], ""), options["engine"])
+    deadline_seconds = options.get("deadline_seconds")
+    position = await scheduler.submit(TranscriptionJob(
+        file_id=file_id,
+        model_size=options["model_size"],
+        language=options["language"],
+        include_timestamps=options["include_timestamps"],
+        duration=estimate["duration"],
+        estimated_seconds=estimate["estimated_seconds"],
+        kwargs={"engine": options["engine"], "vad": options["vad"], "word_timestamps": options.get("word_timestamps", False)},
+        priority=options.get("priority", "interactive"),
+        deadline=time.monotonic() + deadline_seconds if deadline_seconds else None,
+        deadline_action=options.get("deadline_action", "downgrade")
+    ))
+    await file_handler.update_processing_status(
+        file_id, "queued", 5, f"排隊中（第 {position} 位）"
+    )
+    return {
+        "cached": False,
+        "model_size": options["model_size"],
+        "queue_position": position,
+        "estimated_seconds": round(scheduler.estimate_remaining(file_id) or estimate["estimated_seconds"], 1)
+    }
+
+async def cancel_job(file_id: str, reason: str = "使用者取消") -> Optional[str]:
+    """取消排隊或執行中的工作，返回取消時的狀態（queued / running），不在佇列中時返回 None
+
+    排隊中的工作立即移除；執行中的工作在下一個解碼窗口之前停止並釋放工作者，狀態由轉換本身改為 cancelled。
+    """
+    state = await scheduler.cancel(file_id, reason)
+    if state == "queued":
+        await file_handler.update_processing_status(file_id, "cancelled", 0, "已取消", reason)
+    elif state == "running" and shared_queue is None:
+        whisper_service.cancel(file_id, reason)
+    return state
+
+# 批次中的檔案依佇列空間逐一送入排程器；伺服器端檔案匯入後即在背景解碼
+batch_manager = BatchManager(file_handler, start_transcription, on_import=whisper_service.preprocessor.schedule)
+
 @app.post("/api/transcribe")
 async def transcribe_audio(request: TranscribeRequest):
     """啟動語音轉文字處理（異步）"""
@@ -124,36 +530,151 @@ async def transcribe_audio(request: TranscribeRequest):
     if not await file_handler.file_exists(request.file_id):
         raise HTTPException(status_code=404, detail="檔案不存在")
     
-    # 驗證模型大小
-    valid_models = {"tiny", "base", "small", "medium", "large"}
-    if request.model_size not in valid_models:
-        raise HTTPException(status_code=400, detail=f"無效的模型大小: {request.model_size}")
-    
-    # 驗證語言代碼
-    valid_languages = {"auto", "zh", "en", "ja", "ko"}
-    if request.language not in valid_languages:
-        raise HTTPException(status_code=400, detail=f"無效的語言代碼: {request.language}")
+    engine = validate_transcription_options(request.model_size, request.language, request.engine, request.word_timestamps)
+    validate_scheduling_options(request.priority, request.deadline_seconds, request.deadline_action)
+    options = {
+        "model_size": request.model_size,
+        "language": request.language,
+        "include_timestamps": request.include_timestamps,
+        "engine": engine,
+        "vad": request.vad,
+        "word_timestamps": request.word_timestamps,
+        "priority": request.priority,
+        "deadline_seconds": request.deadline_seconds,
+        "deadline_action": request.deadline_action,
+    }
     
     try:
-        # 啟動背景任務
-        import asyncio
-        asyncio.create_task(whisper_service.transcribe(
-            file_id=request.file_id,
-            model_size=request.model_size,
-            language=request.language,
-            include_timestamps=request.include_timestamps
-        ))
-        
-        # 立即返回成功響應
-        return JSONResponse(content={
-            "success": True,
-            "message": "轉換已開始",
-            "file_id": request.file_id
-        })
-        
+        started = await start_transcription(request.file_id, options)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except SchedulerUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"啟動轉換失敗: {e}")
         raise HTTPException(status_code=500, detail=f"啟動轉換失敗: {str(e)}")
+    
+    if started["cached"]:
+        return JSONResponse(content={
+            "success": True,
+            "message": "轉換完成（快取）",
+            "file_id": request.file_id,
+            "model_size": started["model_size"],
+            "cached": True
+        })
+    
+    # 立即返回成功響應
+    return JSONResponse(content={
+        "success": True,
+        "message": "轉換已加入佇列",
+        "file_id": request.file_id,
+        "model_size": started["model_size"],
+        "priority": request.priority,
+        "queue_position": started["queue_position"],
+        "estimated_seconds": started["estimated_seconds"]
+    })
+
+@app.delete("/api/jobs/{file_id}")
+async def cancel_transcription(file_id: str):
+    """取消轉換：排隊中的工作立即移除（200），執行中的工作在下一個解碼窗口之前停止並釋放工作者（202）"""
+    
+    state = await cancel_job(file_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="沒有排隊或處理中的工作")
+    
+    return JSONResponse(
+        status_code=200 if state == "queued" else 202,
+        content={
+            "success": True,
+            "file_id": file_id,
+            "state": state,
+            "message": "已取消" if state == "queued" else "正在停止轉換"
+        }
+    )
+
+@app.post("/api/batch", response_model=BatchResponse)
+async def create_batch(request: BatchRequest):
+    """以伺服器端路徑（BATCH_INPUT_DIR 下的檔案或目錄）建立批次轉換"""
+    
+    engine = validate_transcription_options(request.model_size, request.language, request.engine, request.word_timestamps)
+    validate_scheduling_options(request.priority)
+    try:
+        paths = batch_manager.resolve_paths(request.paths, allowed_extensions)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except BatchPathError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not paths:
+        raise HTTPException(status_code=400, detail="沒有找到支援格式的檔案")
+    
+    record = await batch_manager.create(
+        [{"filename": os.path.relpath(path, batch_manager.input_dir), "path": path} for path in paths],
+        {
+            "model_size": request.model_size,
+            "language": request.language,
+            "include_timestamps": request.include_timestamps,
+            "engine": engine,
+            "vad": request.vad,
+            "word_timestamps": request.word_timestamps,
+            "priority": request.priority,
+        }
+    )
+    return build_batch_response(record)
+
+@app.post("/api/batch/upload", response_model=BatchResponse)
+async def create_upload_batch(
+    files: List[UploadFile] = File(...),
+    model_size: str = Form("base"),
+    language: str = Form("auto"),
+    include_timestamps: bool = Form(False),
+    engine: Optional[str] = Form(None),
+    vad: bool = Form(False),
+    word_timestamps: bool = Form(False),
+    priority: str = Form("batch")
+):
+    """一次上傳多個檔案並建立批次轉換"""
+    
+    engine = validate_transcription_options(model_size, language, engine, word_timestamps)
+    validate_scheduling_options(priority)
+    for file in files:
+        validate_extension(file.filename)
+    
+    sources = []
+    try:
+        for file in files:
+            file_id = await file_handler.save_upload(file)
+            whisper_service.preprocessor.schedule(file_id)
+            sources.append({"file_id": file_id, "filename": file.filename})
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+    
+    record = await batch_manager.create(sources, {
+        "model_size": model_size,
+        "language": language,
+        "include_timestamps": include_timestamps,
+        "engine": engine,
+        "vad": vad,
+        "word_timestamps": word_timestamps,
+        "priority": priority,
+    })
+    return build_batch_response(record)
+
+def build_batch_response(record: Dict) -> BatchResponse:
+    return BatchResponse(
+        batch_id=record["batch_id"],
+        total=len(record["files"]),
+        files=[{"file_id": item["file_id"], "filename": item["filename"]} for item in record["files"]]
+    )
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """查詢批次內各檔案的處理狀態"""
+    batch = await batch_manager.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return JSONResponse(content=batch)
 
 @app.get("/api/status/{file_id}")
 async def get_processing_status(file_id: str):
@@ -161,12 +682,73 @@ async def get_processing_status(file_id: str):
     
     try:
         status = await file_handler.get_processing_status(file_id)
+        
+        position = scheduler.get_position(file_id)
+        if position:
+            status["queue_position"] = position
+            status["stage"] = f"排隊中（第 {position} 位）"
+        
+        remaining = scheduler.estimate_remaining(file_id)
+        if remaining is not None:
+            status["estimated_remaining"] = round(remaining, 1)
+        
         return JSONResponse(content=status)
         
     except Exception as e:
         logger.error(f"獲取狀態失敗: {e}")
         raise HTTPException(status_code=500, detail=f"獲取狀態失敗: {str(e)}")
 
+@app.get("/api/events/{file_id}")
+async def stream_processing_events(file_id: str, request: Request):
+    """以 Server-Sent Events 推送處理狀態（輪詢 /api/status 仍可作為備援）"""
+    
+    async def event_stream():
+        queue = file_handler.events.subscribe(file_id)
+        try:
+            # 先送出目前狀態，之後只在狀態更新時推送；使用共用佇列時狀態由其他節點寫入，
+            # 本行程收不到事件，改為每秒從工作儲存讀取
+            shared = shared_queue is not None
+            poll_interval = 1.0 if shared else 15.0
+            status = (not shared and file_handler.events.latest(file_id)) or await file_handler.get_processing_status(file_id)
+            while True:
+                position = scheduler.get_position(file_id)
+                if position:
+                    status = {**status, "queue_position": position, "stage": f"排隊中（第 {position} 位）"}
+                remaining = scheduler.estimate_remaining(file_id)
+                if remaining is not None:
+                    status = {**status, "estimated_remaining": round(remaining, 1)}
+                yield f"data: {json.dumps(status, ensure_ascii=False)}\n\n"
+                
+                if status.get("status") in ("completed", "error", "cancelled", "file_not_found"):
+                    break
+                
+                idle = 0.0
+                while True:
+                    try:
+                        status = await asyncio.wait_for(queue.get(), timeout=poll_interval)
+                        break
+                    except asyncio.TimeoutError:
+                        if await request.is_disconnected():
+                            return
+                        if shared:
+                            latest = await file_handler.get_processing_status(file_id)
+                            if latest.get("timestamp") != status.get("timestamp"):
+                                status = latest
+                                break
+                        idle += poll_interval
+                        if idle >= 15:
+                            # 保持連線，避免代理伺服器逾時
+                            idle = 0.0
+                            yield ": keep-alive\n\n"
+        finally:
+            file_handler.events.unsubscribe(file_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/result/{file_id}")
 async def get_result(file_id: str):
     """獲取轉換結果內容"""
@@ -178,59 +760,177 @@ async def get_result(file_id: str):
         if status["status"] != "completed":
             raise HTTPException(status_code=400, detail="轉換尚未完成")
         
-        # 嘗試讀取結果檔案
-        result_path = os.path.join(file_handler.result_dir, f"{file_id}_text.txt")
-        if os.path.exists(result_path):
-            with open(result_path, 'r', encoding='utf-8') as f:
-                text_content = f.read()
-                
-            return JSONResponse(content={
-                "result": {
-                    "text": text_content,
-                    "processing_time": status.get("processing_time", 0)
-                },
-                "word_count": len([c for c in text_content if c.strip() and not c.isspace()]),
-                "char_count": len(text_content),
-                "processing_time": status.get("processing_time", 0)
-            })
-        else:
+        try:
+            text_content = await file_handler.read_result(file_id)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="結果檔案不存在")
         
+        # 字數統計於寫入時計算，這裡直接使用
+        stats = await file_handler.get_result_stats(file_id)
+        return JSONResponse(content={
+            "result": {
+                "text": text_content,
+                "processing_time": status.get("processing_time", 0)
+            },
+            "word_count": stats.get("word_count", 0),
+            "char_count": stats.get("char_count", len(text_content)),
+            "processing_time": status.get("processing_time", 0),
+            "timings": stats.get("timings", {}),
+            "vad": stats.get("vad"),
+            "language": stats.get("language"),
+            "formats": [
+                output_format for output_format in OUTPUT_FORMATS
+                if output_format == "txt" or stats.get("segment_count") and (output_format != "words" or stats.get("word_timestamps"))
+            ]
+        })
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"獲取結果失敗: {e}")
         raise HTTPException(status_code=500, detail=f"獲取結果失敗: {str(e)}")
 
+@app.get("/api/result/{file_id}/segments")
+async def get_result_segments(file_id: str, after: int = 0):
+    """增量獲取句段：轉換進行中即可讀取，以 after 指定已取得的句段數"""
+    
+    status = await file_handler.get_processing_status(file_id)
+    if status["status"] == "file_not_found":
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    
+    segments = await file_handler.get_segments(file_id, max(0, after))
+    stats = await file_handler.get_result_stats(file_id)
+    
+    return JSONResponse(content={
+        "segments": segments,
+        "next": max(0, after) + len(segments),
+        "status": status["status"],
+        "complete": status["status"] == "completed",
+        "word_count": stats.get("word_count", 0),
+        "char_count": stats.get("char_count", 0)
+    })
+
 @app.get("/api/download/{file_id}")
-async def download_result(file_id: str):
-    """下載轉換結果檔案"""
+async def download_result(file_id: str, format: str = "txt"):
+    """下載轉換結果檔案
+
+    以 FileResponse 傳送：支援 Range 續傳，伺服器支援 pathsend 擴充時由伺服器直接送出檔案
+    （零複製），否則在執行緒中分塊讀取，不阻塞事件迴圈。
+
+    format 可為 txt、srt、vtt、tsv、json 或 words（逐字時間戳記），
+    txt 以外的格式由保存的句段產生，第一次下載後保存供之後使用。
+    """
+    if format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的輸出格式: {format}（可用: {', '.join(OUTPUT_FORMATS)}）")
+    if format != "txt":
+        status = await file_handler.get_processing_status(file_id)
+        if status["status"] not in ("completed", "file_not_found"):
+            raise HTTPException(status_code=409, detail="轉換尚未完成")
     
     try:
-        file_path = await file_handler.get_result_file(file_id)
-        
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="結果檔案不存在")
-        
-        return FileResponse(
-            path=file_path,
-            filename=f"transcript_{file_id}.txt",
-            media_type="text/plain"
-        )
+        file_path = await file_handler.get_output_file(file_id, format)
+        stat_result = await file_handler.stat_file(file_path)
         
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="結果檔案不存在")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    media_type, extension = OUTPUT_FORMATS[format]
+    return FileResponse(
+        file_path,
+        media_type=media_type,
+        filename=f"transcript_{file_id}.{extension}",
+        stat_result=stat_result
+    )
+
+@app.websocket("/api/stream")
+async def stream_transcription(
+    websocket: WebSocket,
+    model_size: str = "base",
+    language: str = "auto",
+    engine: Optional[str] = None,
+    encoding: str = "pcm_s16le",
+    sample_rate: int = SAMPLE_RATE
+):
+    """即時串流轉換（WebSocket）
+
+    客戶端以二進位訊息傳送音訊：encoding=pcm_s16le（單聲道 int16，取樣率 sample_rate）、
+    webm 或 ogg（如瀏覽器 MediaRecorder 的 Opus），傳送 {"type": "stop"} 結束。
+    伺服器送出 {"type": "partial", "text", ...}（可能再變動）與 {"type": "final", "segment", "latency"}，
+    結束時送出 {"type": "done", ...}。使用推論工作池中已載入的模型，不經過轉換佇列。
+    """
+    await websocket.accept()
+    try:
+        engine = validate_transcription_options(model_size, language, engine)
+        model_size = whisper_service.route_model(model_size, language)
+        if encoding not in STREAM_ENCODINGS:
+            raise HTTPException(status_code=400, detail=f"不支援的音訊編碼: {encoding}（可用: {', '.join(STREAM_ENCODINGS)}）")
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "message": e.detail})
+        await websocket.close(code=1008)
+        return
+    if len(stream_connections) >= stream_max_connections:
+        await websocket.send_json({"type": "error", "message": "即時串流連線數已達上限，請稍後再試"})
+        await websocket.close(code=1013)
+        return
+    
+    async def decode(audio, prompt, window_language):
+        return await whisper_service.transcribe_window(audio, model_size, window_language, engine, prompt)
+    
+    transcriber = StreamingTranscriber(decode, language)
+    decoder = None
+    if encoding != "pcm_s16le" or sample_rate != SAMPLE_RATE:
+        decoder = FFmpegStreamDecoder(STREAM_ENCODINGS[encoding], sample_rate if encoding == "pcm_s16le" else None)
+    
+    stream_connections.add(websocket)
+    try:
+        await websocket.send_json({
+            "type": "ready",
+            "model_size": model_size,
+            "engine": engine,
+            "sample_rate": SAMPLE_RATE,
+            "window_seconds": transcriber.window_seconds,
+            "step_seconds": transcriber.step_seconds
+        })
+        await serve_stream(websocket, transcriber, decoder, stream_idle_timeout)
     except Exception as e:
-        logger.error(f"下載失敗: {e}")
-        raise HTTPException(status_code=500, detail=f"下載失敗: {str(e)}")
+        logger.error(f"即時串流轉換失敗: {e}")
+        try:
+            await websocket.send_json({"type": "error", "message": f"轉換失敗: {str(e)}"})
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        stream_connections.discard(websocket)
 
 @app.on_event("startup")
 async def startup_event():
     """應用啟動時的初始化"""
     logger.info("Whisper 語音轉文字服務啟動中...")
-    # 預載入 base 模型（可選）
-    try:
-        logger.info("預載入 base 模型...")
-        await whisper_service.load_model("base")
-        logger.info("✅ Base 模型預載入完成")
-    except Exception as e:
-        logger.warning(f"模型預載入失敗: {e}")
+    await whisper_service.load_estimator()
+    await scheduler.start()
+    background_tasks.add(asyncio.create_task(monitor_event_loop_lag()))
+    janitor.start()
+    if shared_queue is not None:
+        # 轉換由推論節點執行；本行程只在即時串流時才建立推論工作池
+        logger.info(f"使用共用轉換佇列（JOB_QUEUE），目前有 {len(scheduler.workers)} 個推論節點")
+        return
+    # 在背景預載入模型（WHISPER_PRELOAD_MODELS，預設 base），服務立即開始接受請求；
+    # 完成前健康檢查回報尚未就緒，期間送出的轉換會在工作者載入模型後開始
+    logger.info(f"背景預載入模型: {', '.join(whisper_service.preload_models)}...")
+    background_tasks.add(asyncio.create_task(whisper_service.warm_up()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """應用關閉時停止排程器與推論工作池"""
+    for task in background_tasks:
+        task.cancel()
+    await batch_manager.shutdown()
+    await janitor.stop()
+    await scheduler.stop()
+    whisper_service.shutdown()
+    await file_handler.close()
 
 # 靜態檔案服務 (前端) - 必須放在所有 API 路由之後
 # 使用絕對路徑來避免路徑問題
@@ -0,0 +1,293 @@
+"""批次轉換整個目錄
+
+不經過 API，直接以行程池轉換目錄下（含子目錄）所有支援格式的媒體檔。每個工作行程只載入一次模型，
+之後的檔案都重用同一份；每完成一個檔案即寫出結果並附加到檢查點（manifest.jsonl），
+中斷後重新執行會略過已完成且未修改的檔案。
+
+    python -m backend.batch /data/recordings -o /data/transcripts --model small --language zh
+    python -m backend.batch /data/recordings -o /data/transcripts --workers 4 --threads 2 --vad
+    python -m backend.batch /data/recordings -o /data/subtitles --formats srt,vtt,words --words
+    python -m backend.batch /data/recordings -o /data/transcripts --model auto   # 依偵測到的語言選擇模型（MODEL_ROUTING）
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+from .models.audio import (
+    MEDIA_EXTENSIONS, SAMPLE_RATE, SpeechTimeline, decode_to_pcm, open_pcm, detect_speech, compact_speech, stitch_segments
+)
+from .models.cpu_placement import CPUPlacement, available_cpus
+from .models.engines import get_engine, model_key
+from .models.preprocess import chunk_seconds_setting, vad_options
+from .models.whisper_service import (
+    format_result, init_worker, parse_model_routing, plan_pcm_chunks, route_model, run_language_detection, run_transcription
+)
+from .utils.batch_manager import walk_media_files
+from .utils.formats import OUTPUT_FORMATS, render
+
+
+def resolve_options(pcm_path: str, model_size: str, language: str, engine: str):
+    """language 為 auto 時先以 LANGUAGE_DETECTION_MODEL 偵測語言（整個檔案只偵測一次，各區段使用相同語言），
+    model_size 為 auto 時依 MODEL_ROUTING 選擇模型，返回 (模型大小, 語言)"""
+    detection_model = os.getenv("LANGUAGE_DETECTION_MODEL", "tiny")
+    if language == "auto" and detection_model and get_engine(engine).capabilities.get("language_detection"):
+        detection = run_language_detection(pcm_path, detection_model, engine)
+        if detection["probability"] >= float(os.getenv("LANGUAGE_DETECTION_MIN_PROBABILITY", 0.5)):
+            language = detection["language"]
+    return route_model(parse_model_routing(os.getenv("MODEL_ROUTING", "")), model_size, language), language
+
+
+def transcribe_path(path: str, model_size: str, language: str, engine: str, include_timestamps: bool, vad: bool, word_timestamps: bool = False) -> Dict:
+    """在工作行程中轉換單一檔案（解碼到暫存 PCM，長音訊依序切段轉換以限制記憶體）"""
+    started = time.perf_counter()
+    segment_min_seconds = float(os.getenv("SEGMENT_MIN_SECONDS", 600))
+    chunk_seconds = chunk_seconds_setting()
+    chunk_overlap = float(os.getenv("CHUNK_OVERLAP_SECONDS", 1.0))
+
+    with tempfile.TemporaryDirectory(prefix="whisper-batch-") as tmp_dir:
+        pcm_path = os.path.join(tmp_dir, "audio.pcm")
+        duration = decode_to_pcm(path, pcm_path)
+        if duration:
+            model_size, language = resolve_options(pcm_path, model_size, language, engine)
+        timeline = None
+        if vad:
+            regions = detect_speech(open_pcm(pcm_path), SAMPLE_RATE, **vad_options())
+            timeline = SpeechTimeline(regions)
+            if regions:
+                speech_path = os.path.join(tmp_dir, "speech.pcm")
+                compact_speech(pcm_path, speech_path, regions)
+                pcm_path = speech_path
+        speech_seconds = timeline.speech_seconds if timeline else duration
+
+        if not speech_seconds:
+            result = {"text": "", "language": None, "segments": []}
+        elif speech_seconds > segment_min_seconds:
+            chunk_results = []
+            for chunk in plan_pcm_chunks(pcm_path, chunk_seconds, chunk_overlap):
+                chunk_results.append((chunk, run_transcription(
+                    path, pcm_path, model_size, language, chunk["decode_start"], chunk["decode_duration"], engine, word_timestamps
+                )))
+            result = stitch_segments(chunk_results)
+        else:
+            result = run_transcription(path, pcm_path, model_size, language, 0.0, None, engine, word_timestamps)
+
+    segments = timeline.remap_segments(result["segments"]) if timeline else result["segments"]
+    result = {"text": result["text"], "language": result.get("language"), "segments": segments}
+    return {
+        "text": format_result(result, include_timestamps),
+        "language": result["language"],
+        "model_size": model_size,
+        "segments": segments,
+        "duration": round(duration, 3),
+        "speech_seconds": round(speech_seconds, 3),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class Manifest:
+    """JSON Lines 檢查點：每完成（或失敗）一個檔案即附加一行並寫入磁碟
+
+    重新執行時，路徑、大小與修改時間都相同且結果檔仍在的已完成檔案會被略過；失敗的檔案會重試。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Dict[str, Dict] = {}
+        if not os.path.exists(path):
+            return
+
+        with open(path, "rb+") as f:
+            content = f.read()
+            # 上次在寫入途中中斷時去掉不完整的最後一行
+            if content and not content.endswith(b"\n"):
+                f.truncate(content.rfind(b"\n") + 1)
+        for line in content.decode("utf-8", errors="ignore").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("status") == "completed":
+                self.completed[entry["path"]] = entry
+            else:
+                self.completed.pop(entry.get("path"), None)
+
+    def is_done(self, relative_path: str, stat: os.stat_result) -> bool:
+        entry = self.completed.get(relative_path)
+        return bool(
+            entry
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+            and os.path.exists(entry["output"])
+        )
+
+    def append(self, entry: Dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_atomic(path: str, content):
+    """寫入字串或逐段產生的內容（先寫暫存檔再替換）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines([content] if isinstance(content, str) else content)
+    os.replace(tmp_path, path)
+
+
+def write_outputs(base_path: str, result: Dict, formats) -> str:
+    """寫出各格式的結果檔，返回第一個檔案的路徑"""
+    paths = []
+    for output_format in formats:
+        path = f"{base_path}.{OUTPUT_FORMATS[output_format][1]}"
+        if output_format == "txt":
+            write_atomic(path, result["text"])
+        elif output_format == "json":
+            write_atomic(path, json.dumps({
+                "language": result["language"],
+                "duration": result["duration"],
+                "segments": result["segments"],
+            }, ensure_ascii=False))
+        else:
+            write_atomic(path, render(output_format, result["segments"], result["language"]))
+        paths.append(path)
+    return paths[0]
+
+
+def parse_args(argv=None):
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="批次轉換整個目錄的媒體檔")
+    parser.add_argument("input", help="輸入目錄（遞迴）")
+    parser.add_argument("-o", "--output", required=True, help="輸出目錄（結果檔依輸入的相對路徑存放）")
+    parser.add_argument("--model", default="base", help="模型大小（預設 base；auto 依偵測到的語言與 MODEL_ROUTING 選擇）")
+    parser.add_argument("--engine", default=None, help="推論引擎（預設 WHISPER_ENGINE）")
+    parser.add_argument("--language", default="auto")
+    parser.add_argument("--timestamps", action="store_true", help="結果文字含時間戳記")
+    parser.add_argument("--vad", action="store_true", help="以語音活動偵測略過靜音")
+    parser.add_argument("--words", action="store_true", help="句段附帶逐字時間戳記（words 格式需要）")
+    parser.add_argument(
+        "--formats", default="txt,json", type=lambda v: [f for f in v.split(",") if f],
+        help=f"輸出格式，逗號分隔（{', '.join(OUTPUT_FORMATS)}；預設 txt,json）"
+    )
+    parser.add_argument("--workers", type=int, default=None, help=f"工作行程數（預設 CPU 核心數 / 4，目前 {max(1, cpu_count // 4)}）")
+    parser.add_argument("--threads", type=int, default=None, help="每個工作行程的推論執行緒數（預設平分 CPU 核心）")
+    parser.add_argument("--manifest", default=None, help="檢查點檔案（預設 {輸出目錄}/manifest.jsonl）")
+    parser.add_argument(
+        "--extensions", default=",".join(MEDIA_EXTENSIONS),
+        type=lambda v: [e if e.startswith(".") else f".{e}" for e in v.split(",") if e],
+        help="要轉換的副檔名，逗號分隔"
+    )
+    args = parser.parse_args(argv)
+    unknown = [f for f in args.formats if f not in OUTPUT_FORMATS]
+    if unknown or not args.formats:
+        parser.error(f"不支援的輸出格式: {', '.join(unknown) or '（未指定）'}")
+    if "words" in args.formats and not args.words:
+        parser.error("words 格式需要 --words")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    cpu_count = os.cpu_count() or 1
+    workers = args.workers or max(1, cpu_count // 4)
+    threads = args.threads or max(1, cpu_count // workers)
+    # 工作行程由此繼承，避免每個行程的推論執行緒都佔滿所有核心
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    os.environ.setdefault("CT2_CPU_THREADS", str(threads))
+    # 每個工作行程綁定各自的 threads 個核心（同一 NUMA 節點）
+    placement = None
+    if os.getenv("CPU_PLACEMENT", "auto") != "off" and len(available_cpus()) > 1:
+        placement = CPUPlacement(workers, threads_per_job=threads)
+    engine = get_engine(args.engine).name
+
+    input_dir = os.path.abspath(args.input)
+    output_dir = os.path.abspath(args.output)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(args.manifest or os.path.join(output_dir, "manifest.jsonl"))
+
+    files = walk_media_files(input_dir, args.extensions)
+    todo = []
+    for path in files:
+        if not manifest.is_done(os.path.relpath(path, input_dir), os.stat(path)):
+            todo.append(path)
+    print(f"共 {len(files)} 個檔案，{len(files) - len(todo)} 個已完成，"
+          f"以 {workers} 個工作行程 × {threads} 執行緒轉換 {len(todo)} 個", file=sys.stderr)
+    if not todo:
+        return 0
+
+    started = time.perf_counter()
+    completed = failed = 0
+    audio_seconds = 0.0
+    queue = iter(todo)
+    futures = {}
+    pool = ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker,
+        initargs=(() if args.model == "auto" else (model_key(engine, args.model),), None, None, placement)
+    )
+
+    def submit_next() -> Optional[str]:
+        path = next(queue, None)
+        if path is not None:
+            future = pool.submit(
+                transcribe_path, path, args.model, args.language, engine, args.timestamps, args.vad, args.words
+            )
+            futures[future] = path
+        return path
+
+    try:
+        # 只預先送出少量工作，中斷時不會留下大量已排程的工作
+        for _ in range(workers * 2):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = futures.pop(future)
+                relative_path = os.path.relpath(path, input_dir)
+                stat = os.stat(path)
+                entry = {"path": relative_path, "size": stat.st_size, "mtime": stat.st_mtime}
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    failed += 1
+                    # ffmpeg 的錯誤訊息只保留最後一行
+                    error = (str(e).strip().splitlines() or [repr(e)])[-1]
+                    manifest.append({**entry, "status": "failed", "error": error})
+                    print(f"[{completed + failed}/{len(todo)}] ✗ {relative_path}: {error}", file=sys.stderr)
+                else:
+                    output_path = write_outputs(os.path.join(output_dir, relative_path), result, args.formats)
+                    completed += 1
+                    audio_seconds += result["duration"]
+                    manifest.append({
+                        **entry, "status": "completed", "output": output_path, "language": result["language"],
+                        "model_size": result["model_size"], "duration": result["duration"], "seconds": result["seconds"],
+                    })
+                    print(f"[{completed + failed}/{len(todo)}] ✓ {relative_path} "
+                          f"({result['duration']:.0f}s 音訊，{result['seconds']:.1f}s)", file=sys.stderr)
+                submit_next()
+    except KeyboardInterrupt:
+        print("已中斷，重新執行會從檢查點繼續", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    except BrokenProcessPool as e:
+        print(f"工作行程異常結束（可能是記憶體不足）: {e}", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 1
+    pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(f"完成 {completed} 個、失敗 {failed} 個，{audio_seconds / 60:.1f} 分鐘音訊，"
+          f"耗時 {elapsed:.1f}s（即時率 {elapsed / audio_seconds if audio_seconds else 0:.3f}）", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,553 @@
+"""轉換效能基準測試
+
+在行程內啟動 FastAPI 應用，以合成音訊走完 上傳 → 轉換 → 取得結果 的流程，
+報告各階段延遲、即時率（RTF）、p50/p95/p99、峰值 RSS 與不同並行客戶端數下的每秒工作數。
+
+    python -m backend.benchmark --model tiny --durations 10,60 --formats wav,mp3 --clients 1,4
+    python -m backend.benchmark --output new.json --baseline old.json
+
+--io-result-mb 另外量測檔案 I/O 與事件迴圈的隔離：有多個客戶端下載大型結果時，
+狀態查詢的延遲是否維持與閒置時相同（--io-only 只執行此項，不需載入模型）。
+
+    python -m backend.benchmark --io-only --io-result-mb 64 --io-downloaders 8
+
+--stream-seconds 以即時速度將合成音訊送入 /api/stream，報告每個確定句段的延遲（--stream-only 只執行此項）。
+
+    python -m backend.benchmark --stream-only --stream-seconds 60 --model tiny
+"""
+import os
+import sys
+import json
+import math
+import time
+import wave
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from typing import Dict, List, Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+STAGES = ("upload", "queue_wait", "preprocess", "model_load", "encode", "decode", "inference", "write", "total")
+
+
+def synth_speech(duration: float, seed: int = 0) -> np.ndarray:
+    """產生類似語音的訊號：帶諧波的基頻隨音節起伏，中間穿插停頓與背景雜訊"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.3 * t) + rng.normal(0, 5)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    # 約每秒 4 個音節，每 3~6 秒停頓一次
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    pauses = np.ones_like(t)
+    position = 0.0
+    while position < duration:
+        position += rng.uniform(3, 6)
+        start = int(position * SAMPLE_RATE)
+        pauses[start:start + int(rng.uniform(0.4, 1.0) * SAMPLE_RATE)] = 0
+    signal = 0.3 * voiced * syllables * pauses + rng.normal(0, 0.01, len(t))
+    return np.clip(signal, -1, 1).astype(np.float32)
+
+
+def write_fixture(path: str, audio: np.ndarray):
+    """寫入 wav，其他格式以 ffmpeg 轉換"""
+    wav_path = path if path.endswith(".wav") else f"{path}.wav"
+    with wave.open(wav_path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((audio * 32767).astype("<i2").tobytes())
+    if wav_path != path:
+        subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", wav_path, path],
+            check=True
+        )
+        os.remove(wav_path)
+
+
+def make_fixtures(fixture_dir: str, durations: List[float], formats: List[str]) -> Dict:
+    """{(長度, 格式): 檔案路徑}"""
+    fixtures = {}
+    for duration in durations:
+        audio = synth_speech(duration, seed=int(duration))
+        for fmt in formats:
+            path = os.path.join(fixture_dir, f"synthetic_{int(duration)}s.{fmt}")
+            write_fixture(path, audio)
+            fixtures[(duration, fmt)] = path
+    return fixtures
+
+
+def percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+    return {
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": round(rank(50), 4),
+        "p95": round(rank(95), 4),
+        "p99": round(rank(99), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RSSSampler:
+    """定期取樣本行程與推論工作行程的 RSS 總和，記錄峰值"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> int:
+        pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children()]
+        total = sum(_rss_bytes(pid) for pid in pids)
+        if not total:
+            # 沒有 /proc 時退回 getrusage 的最大常駐量
+            scale = 1 if sys.platform == "darwin" else 1024
+            total = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                     + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+        self.peak = max(self.peak, total)
+        return total
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = 0
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self.sample()
+        return self.peak
+
+
+async def run_job(client, path: str, args, job_index: int) -> Dict:
+    """執行一次完整流程並返回各階段耗時"""
+    with open(path, "rb") as f:
+        data = f.read()
+    # 附加不同的尾端位元組讓每個工作的內容雜湊不同，避免命中去重與結果快取
+    data += job_index.to_bytes(8, "little") + os.urandom(8)
+
+    started = time.perf_counter()
+    response = await client.post("/api/upload", files={"file": (os.path.basename(path), data)})
+    response.raise_for_status()
+    file_id = response.json()["file_id"]
+    uploaded = time.perf_counter()
+
+    payload = {"file_id": file_id, "model_size": args.model, "language": args.language}
+    if args.engine:
+        payload["engine"] = args.engine
+    response = await client.post("/api/transcribe", json=payload)
+    response.raise_for_status()
+    submitted = time.perf_counter()
+
+    while True:
+        status = (await client.get(f"/api/status/{file_id}")).json()
+        if status["status"] in ("completed", "error"):
+            break
+        await asyncio.sleep(args.poll_interval)
+    if status["status"] == "error":
+        raise RuntimeError(status.get("message", "轉換失敗"))
+
+    result = (await client.get(f"/api/result/{file_id}")).json()
+    finished = time.perf_counter()
+
+    stages = {"upload": uploaded - started, **result.get("timings", {})}
+    stages["queue_wait"] = max(0.0, (finished - submitted) - status.get("processing_time", 0))
+    stages["total"] = finished - started
+    return stages
+
+
+async def run_level(app, fixture: str, duration: float, clients: int, args) -> Dict:
+    """以 clients 個並行客戶端執行 args.jobs 個工作"""
+    import httpx
+
+    jobs: asyncio.Queue = asyncio.Queue()
+    for index in range(args.jobs):
+        jobs.put_nowait(index)
+    samples: List[Dict] = []
+    errors: List[str] = []
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        async def worker():
+            while True:
+                try:
+                    index = jobs.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    samples.append(await run_job(client, fixture, args, index))
+                except Exception as e:
+                    errors.append(str(e))
+
+        sampler = RSSSampler()
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        wall = time.perf_counter() - started
+        peak_rss = await sampler.stop()
+
+    latency = {stage: percentiles([s[stage] for s in samples if stage in s]) for stage in STAGES}
+    return {
+        "clients": clients,
+        "jobs": len(samples),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "jobs_per_sec": round(len(samples) / wall, 4) if wall else 0,
+        "latency": {stage: values for stage, values in latency.items() if values},
+        # 即時率：處理時間 / 音訊長度，小於 1 代表比即時快
+        "rtf": {
+            "inference": percentiles([s["inference"] / duration for s in samples if "inference" in s]),
+            "end_to_end": percentiles([s["total"] / duration for s in samples]),
+        },
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+async def poll_status(client, file_id: str, count: int, interval: float) -> List[float]:
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = await client.get(f"/api/status/{file_id}")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run_io_contention(app, fixture: str, args) -> Dict:
+    """比較閒置時與大型結果下載進行中的狀態查詢延遲"""
+    import httpx
+    from .app import file_handler
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        with open(fixture, "rb") as f:
+            response = await client.post("/api/upload", files={"file": (os.path.basename(fixture), f.read())})
+        response.raise_for_status()
+        file_id = response.json()["file_id"]
+        # 直接寫入大型結果，不需執行轉換
+        line = "benchmark transcript line for download contention\n"
+        await file_handler.save_result(file_id, line * (args.io_result_mb * 1024 * 1024 // len(line)))
+        await file_handler.update_processing_status(file_id, "completed", 100, "完成", "轉換完成")
+
+        idle = await poll_status(client, file_id, args.io_polls, args.poll_interval)
+
+        downloaded = 0
+        stop = asyncio.Event()
+
+        async def downloader():
+            nonlocal downloaded
+            while not stop.is_set():
+                async with client.stream("GET", f"/api/download/{file_id}") as response:
+                    async for chunk in response.aiter_bytes():
+                        downloaded += len(chunk)
+
+        downloaders = [asyncio.ensure_future(downloader()) for _ in range(args.io_downloaders)]
+        started = time.perf_counter()
+        try:
+            busy = await poll_status(client, file_id, args.io_polls, args.poll_interval)
+        finally:
+            stop.set()
+            await asyncio.gather(*downloaders, return_exceptions=True)
+        wall = time.perf_counter() - started
+
+    return {
+        "result_mb": args.io_result_mb,
+        "downloaders": args.io_downloaders,
+        "status_latency_idle": percentiles(idle),
+        "status_latency_during_downloads": percentiles(busy),
+        "download_mb_per_sec": round(downloaded / (1024 * 1024) / wall, 1) if wall else 0,
+    }
+
+
+class ASGIWebSocket:
+    """直接呼叫 ASGI 應用的 WebSocket 客戶端，行程內量測不需啟動伺服器"""
+
+    def __init__(self, app, path: str, query: str = ""):
+        self._incoming: asyncio.Queue = asyncio.Queue()
+        self._outgoing: asyncio.Queue = asyncio.Queue()
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": query.encode(), "headers": [(b"host", b"benchmark")],
+            "client": ("127.0.0.1", 0), "server": ("benchmark", 80), "subprotocols": [],
+        }
+        self._task = asyncio.ensure_future(app(scope, self._incoming.get, self._outgoing.put))
+
+    async def connect(self):
+        await self._incoming.put({"type": "websocket.connect"})
+        message = await self._outgoing.get()
+        if message["type"] != "websocket.accept":
+            raise RuntimeError(f"WebSocket 連線被拒絕: {message}")
+
+    async def send_bytes(self, data: bytes):
+        await self._incoming.put({"type": "websocket.receive", "bytes": data})
+
+    async def send_json(self, data: Dict):
+        await self._incoming.put({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def receive_json(self) -> Dict:
+        message = await self._outgoing.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError(f"WebSocket 已關閉: {message.get('code')}")
+        return json.loads(message["text"])
+
+    async def close(self):
+        await self._incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def run_stream(app, audio: np.ndarray, args) -> Dict:
+    """以 args.stream_speed 倍的即時速度分框送入音訊，記錄 partial 與 final 事件"""
+    query = f"model_size={args.model}&language={args.language}" + (f"&engine={args.engine}" if args.engine else "")
+    websocket = ASGIWebSocket(app, "/api/stream", query)
+    await websocket.connect()
+    ready = await websocket.receive_json()
+    if ready["type"] != "ready":
+        raise RuntimeError(ready.get("message", "串流連線失敗"))
+
+    events: List[Dict] = []
+    done: Dict = {}
+    started = time.perf_counter()
+
+    async def receiver():
+        while True:
+            event = await websocket.receive_json()
+            event["at"] = time.perf_counter() - started
+            if event["type"] in ("done", "error"):
+                done.update(event)
+                return
+            events.append(event)
+
+    receiving = asyncio.ensure_future(receiver())
+    pcm = (audio * 32767).astype("<i2").tobytes()
+    frame_bytes = int(SAMPLE_RATE * args.stream_frame_ms / 1000) * 2
+    for index, position in enumerate(range(0, len(pcm), frame_bytes)):
+        await websocket.send_bytes(pcm[position:position + frame_bytes])
+        # 依送出的音訊長度控制節奏，不累積 sleep 的誤差
+        target = (index + 1) * args.stream_frame_ms / 1000 / args.stream_speed
+        await asyncio.sleep(max(0.0, target - (time.perf_counter() - started)))
+    sent = time.perf_counter() - started
+    await websocket.send_json({"type": "stop"})
+    await receiving
+    await websocket.close()
+    if done.get("type") == "error":
+        raise RuntimeError(done.get("message"))
+
+    finals = [event for event in events if event["type"] == "final"]
+    partials = [event for event in events if event["type"] == "partial"]
+    return {
+        "audio_seconds": round(len(audio) / SAMPLE_RATE, 2),
+        "speed": args.stream_speed,
+        "frame_ms": args.stream_frame_ms,
+        "segments": len(finals),
+        "partials": len(partials),
+        "final_latency": percentiles([event["latency"] for event in finals]),
+        "first_partial_seconds": round(partials[0]["at"], 3) if partials else None,
+        # 送出 stop 到收到最後結果的時間
+        "flush_seconds": round(done["at"] - sent, 3),
+        "dropped_seconds": done.get("dropped_seconds", 0),
+    }
+
+
+async def run_benchmark(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix="whisper-benchmark-")
+    # 需在匯入應用前設定，讓上傳、結果與狀態都寫在暫存目錄
+    os.environ["UPLOAD_DIR"] = os.path.join(work_dir, "uploads")
+    os.environ["RESULT_DIR"] = os.path.join(work_dir, "results")
+    if not args.io_only:
+        os.environ.setdefault("WHISPER_PRELOAD_MODELS", args.model)
+    jobs_enabled = not (args.io_only or args.stream_only)
+
+    try:
+        if not jobs_enabled:
+            fixtures = make_fixtures(work_dir, [1.0], ["wav"])
+        else:
+            fixtures = make_fixtures(work_dir, args.durations, args.formats)
+        from .app import app
+
+        results = []
+        io_report = stream_report = None
+        async with app.router.lifespan_context(app):
+            if args.warmup and jobs_enabled:
+                # 先跑一次讓模型載入，不計入結果
+                await run_level(app, next(iter(fixtures.values())), args.durations[0], 1,
+                                argparse.Namespace(**{**vars(args), "jobs": 1}))
+            for (duration, fmt), fixture in (fixtures.items() if jobs_enabled else []):
+                for clients in args.clients:
+                    level = await run_level(app, fixture, duration, clients, args)
+                    results.append({"duration": duration, "format": fmt, **level})
+                    print(
+                        f"{duration:>6.0f}s {fmt:<4} clients={clients:<3} "
+                        f"jobs/s={level['jobs_per_sec']:<8} "
+                        f"p50={level['latency'].get('total', {}).get('p50', '-')}s "
+                        f"rtf={level['rtf']['end_to_end'].get('p50', '-')} "
+                        f"rss={level['peak_rss_mb']}MB errors={len(level['errors'])}",
+                        file=sys.stderr
+                    )
+            if args.io_result_mb:
+                io_report = await run_io_contention(app, next(iter(fixtures.values())), args)
+                print(
+                    f"io result={args.io_result_mb}MB downloaders={args.io_downloaders} "
+                    f"status p99 idle={io_report['status_latency_idle'].get('p99')}s "
+                    f"busy={io_report['status_latency_during_downloads'].get('p99')}s "
+                    f"download={io_report['download_mb_per_sec']}MB/s",
+                    file=sys.stderr
+                )
+            if args.stream_seconds:
+                if args.warmup:
+                    # 短暫連線讓工作者載入模型，不計入結果
+                    await run_stream(app, synth_speech(2.0), argparse.Namespace(**{**vars(args), "stream_speed": 10.0}))
+                stream_report = await run_stream(app, synth_speech(args.stream_seconds, seed=1), args)
+                print(
+                    f"stream {args.stream_seconds:.0f}s speed={args.stream_speed} segments={stream_report['segments']} "
+                    f"final p50={stream_report['final_latency'].get('p50', '-')}s "
+                    f"p95={stream_report['final_latency'].get('p95', '-')}s "
+                    f"flush={stream_report['flush_seconds']}s dropped={stream_report['dropped_seconds']}s",
+                    file=sys.stderr
+                )
+
+        from .models.engines import default_engine
+        return {
+            "config": {
+                "model": args.model,
+                "engine": args.engine or default_engine(),
+                "language": args.language,
+                "jobs": args.jobs,
+                "durations": args.durations,
+                "formats": args.formats,
+                "clients": args.clients,
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "env": {k: v for k, v in os.environ.items() if k.startswith(("WHISPER_", "JOB_", "BATCH_", "CT2_", "ONNX_", "FILE_IO_", "STAT_CACHE_", "STREAM_", "CPU_"))},
+            },
+            "timestamp": time.time(),
+            "results": results,
+            "io": io_report,
+            "stream": stream_report,
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(report: Dict, baseline: Dict) -> List[str]:
+    """與基準結果比較 p50/p95 延遲與每秒工作數，返回變化百分比"""
+    def key(result):
+        return (result["duration"], result["format"], result["clients"])
+
+    previous = {key(r): r for r in baseline.get("results", [])}
+    lines = []
+    for result in report["results"]:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        changes = []
+        for metric in ("p50", "p95"):
+            new_value = result["latency"].get("total", {}).get(metric)
+            old_value = old["latency"].get("total", {}).get(metric)
+            if new_value and old_value:
+                changes.append(f"total {metric} {100 * (new_value - old_value) / old_value:+.1f}%")
+        if old["jobs_per_sec"]:
+            changes.append(f"jobs/s {100 * (result['jobs_per_sec'] - old['jobs_per_sec']) / old['jobs_per_sec']:+.1f}%")
+        lines.append(f"{result['duration']:.0f}s {result['format']} clients={result['clients']}: " + ", ".join(changes))
+
+    old_io, new_io = baseline.get("io") or {}, report.get("io") or {}
+    old_p99 = old_io.get("status_latency_during_downloads", {}).get("p99")
+    new_p99 = new_io.get("status_latency_during_downloads", {}).get("p99")
+    if old_p99 and new_p99:
+        lines.append(f"io status p99 during downloads {100 * (new_p99 - old_p99) / old_p99:+.1f}%")
+
+    for metric in ("p50", "p95"):
+        old_value = ((baseline.get("stream") or {}).get("final_latency") or {}).get(metric)
+        new_value = ((report.get("stream") or {}).get("final_latency") or {}).get(metric)
+        if old_value and new_value:
+            lines.append(f"stream final latency {metric} {100 * (new_value - old_value) / old_value:+.1f}%")
+    return lines
+
+
+def parse_args(argv=None):
+    def float_list(value):
+        return [float(v) for v in value.split(",") if v]
+
+    def int_list(value):
+        return [int(v) for v in value.split(",") if v]
+
+    parser = argparse.ArgumentParser(description="Whisper 轉換效能基準測試")
+    parser.add_argument("--model", default="tiny", help="模型大小（預設 tiny）")
+    parser.add_argument("--engine", default=None, help="推論引擎（預設 WHISPER_ENGINE）")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--durations", type=float_list, default=[10.0, 60.0], help="音訊長度（秒），逗號分隔")
+    parser.add_argument("--formats", default=["wav", "mp3"], type=lambda v: [f for f in v.split(",") if f])
+    parser.add_argument("--clients", type=int_list, default=[1, 4], help="並行客戶端數，逗號分隔")
+    parser.add_argument("--jobs", type=int, default=8, help="每個組合執行的工作數")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="不先執行暖身工作")
+    parser.add_argument("--output", help="將 JSON 結果寫入檔案（預設輸出到 stdout）")
+    parser.add_argument("--baseline", help="與先前的 JSON 結果比較")
+    parser.add_argument("--keep", action="store_true", help="保留合成音訊與暫存資料")
+    parser.add_argument("--io-result-mb", type=int, default=0, help="量測下載此大小的結果時的狀態查詢延遲（0 表示不量測）")
+    parser.add_argument("--io-downloaders", type=int, default=8, help="同時下載結果的客戶端數")
+    parser.add_argument("--io-polls", type=int, default=200, help="閒置與下載中各查詢狀態的次數")
+    parser.add_argument("--io-only", action="store_true", help="只執行檔案 I/O 量測，不執行轉換")
+    parser.add_argument("--stream-seconds", type=float, default=0, help="即時串流量測的音訊長度（0 表示不量測）")
+    parser.add_argument("--stream-speed", type=float, default=1.0, help="送入音訊的速度（1 為即時）")
+    parser.add_argument("--stream-frame-ms", type=int, default=100, help="每個 WebSocket 訊息的音訊長度（毫秒）")
+    parser.add_argument("--stream-only", action="store_true", help="只執行即時串流量測，不執行轉換")
+    args = parser.parse_args(argv)
+    if args.io_only and not args.io_result_mb:
+        args.io_result_mb = 64
+    if args.stream_only and not args.stream_seconds:
+        args.stream_seconds = 60.0
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            for line in compare(report, json.load(f)):
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""找出本機最佳的推論配置（工作行程數 × 每個工作的執行緒數）
+
+以合成語音在每種配置下讓所有工作行程同時轉換，量測吞吐量（每秒處理的音訊秒數）與單一工作的延遲，
+輸出建議的 WHISPER_WORKERS 與 CPU_THREADS_PER_JOB。每個工作行程依 CPU_PLACEMENT 綁定各自的核心。
+
+    python -m backend.calibrate --model base
+    python -m backend.calibrate --model small --duration 60 --layouts 1x16,2x8,4x4,8x2 --output layout.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+from .benchmark import synth_speech
+from .models.cpu_placement import CPUPlacement, available_cpus, numa_nodes
+from .models.engines import get_engine, model_key
+from .models.whisper_service import init_worker, load_and_report, run_transcription
+
+
+def default_layouts(cpu_count: int) -> List[Tuple[int, int]]:
+    """工作行程數為 1、2、4…（不超過核心數），核心平分給各工作行程"""
+    layouts = []
+    workers = 1
+    while workers <= cpu_count:
+        layouts.append((workers, cpu_count // workers))
+        workers *= 2
+    if layouts[-1][0] != cpu_count:
+        layouts.append((cpu_count, 1))
+    return layouts
+
+
+def parse_layouts(value: str) -> List[Tuple[int, int]]:
+    """解析 "1x16,2x8" 格式（工作行程數x執行緒數）"""
+    layouts = []
+    for item in value.split(","):
+        if item:
+            workers, _, threads = item.partition("x")
+            layouts.append((int(workers), int(threads)))
+    return layouts
+
+
+def run_layout(pcm_path: str, duration: float, args, workers: int, threads: int) -> Dict:
+    """以 workers 個工作行程、每個工作 threads 個執行緒同時轉換 rounds × workers 個工作"""
+    placement = None
+    if os.getenv("CPU_PLACEMENT", "auto") != "off" and len(available_cpus()) > 1:
+        placement = CPUPlacement(workers, threads_per_job=threads)
+    # 未綁定核心時，工作行程繼承此執行緒數
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["CT2_CPU_THREADS"] = str(threads)
+    pool = ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker,
+        initargs=((model_key(args.engine, args.model),), None, None, placement)
+    )
+    try:
+        # 暖身：每個工作行程載入模型並各轉換一次
+        wait([pool.submit(load_and_report, args.model, args.engine) for _ in range(workers)])
+        wait([pool.submit(run_transcription, "warmup", pcm_path, args.model, args.language, 0.0, None, args.engine)
+              for _ in range(workers)])
+
+        jobs = args.rounds * workers
+        started = time.perf_counter()
+        futures = [
+            pool.submit(run_transcription, f"calibrate:{i}", pcm_path, args.model, args.language, 0.0, None, args.engine)
+            for i in range(jobs)
+        ]
+        results = [future.result() for future in futures]
+        wall = time.perf_counter() - started
+    finally:
+        pool.shutdown(wait=True)
+
+    latencies = sorted(result["timings"]["inference"] for result in results)
+    return {
+        "workers": workers,
+        "threads": threads,
+        "jobs": jobs,
+        "wall_seconds": round(wall, 3),
+        "throughput": round(jobs * duration / wall, 3),
+        "latency_p50": round(latencies[len(latencies) // 2], 3),
+        "latency_max": round(latencies[-1], 3),
+    }
+
+
+def recommend(results: List[Dict], tolerance: float) -> Dict:
+    """吞吐量在最佳值 tolerance 以內的配置中，選擇延遲最低的"""
+    best = max(result["throughput"] for result in results)
+    candidates = [result for result in results if result["throughput"] >= best * (1 - tolerance)]
+    return min(candidates, key=lambda result: (result["latency_p50"], -result["throughput"]))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="找出本機最佳的工作行程數與每個工作的執行緒數")
+    parser.add_argument("--model", default="base", help="模型大小（預設 base）")
+    parser.add_argument("--engine", default=None, help="推論引擎（預設 WHISPER_ENGINE）")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--duration", type=float, default=30.0, help="每個工作的合成音訊長度（秒）")
+    parser.add_argument("--rounds", type=int, default=2, help="每種配置讓每個工作行程轉換幾個工作")
+    parser.add_argument("--layouts", type=parse_layouts, default=None, help="要測試的配置，如 1x16,2x8,4x4（預設依核心數產生）")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="吞吐量與最佳值相差此比例內時，選擇延遲較低的配置")
+    parser.add_argument("--output", help="將 JSON 結果寫入檔案（預設輸出到 stdout）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    args.engine = get_engine(args.engine).name
+    cpu_count = len(available_cpus())
+    layouts = args.layouts or default_layouts(cpu_count)
+
+    work_dir = tempfile.mkdtemp(prefix="whisper-calibrate-")
+    try:
+        pcm_path = os.path.join(work_dir, "speech.pcm")
+        (synth_speech(args.duration) * 32767).astype("<i2").tofile(pcm_path)
+
+        results = []
+        for workers, threads in layouts:
+            result = run_layout(pcm_path, args.duration, args, workers, threads)
+            results.append(result)
+            print(
+                f"{workers} 個工作行程 × {threads} 執行緒: 吞吐量 {result['throughput']} 音訊秒/秒, "
+                f"延遲 p50 {result['latency_p50']}s, 最長 {result['latency_max']}s",
+                file=sys.stderr
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    best = recommend(results, args.tolerance)
+    print(
+        f"建議配置: WHISPER_WORKERS={best['workers']} CPU_THREADS_PER_JOB={best['threads']}"
+        f"（吞吐量 {best['throughput']} 音訊秒/秒）",
+        file=sys.stderr
+    )
+    report = {
+        "config": {"model": args.model, "engine": args.engine, "language": args.language, "duration": args.duration, "rounds": args.rounds},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": cpu_count,
+            "numa_nodes": [len(node) for node in numa_nodes()],
+        },
+        "timestamp": time.time(),
+        "results": results,
+        "recommended": {"WHISPER_WORKERS": best["workers"], "CPU_THREADS_PER_JOB": best["threads"]},
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
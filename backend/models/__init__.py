@@ -0,0 +1 @@
+# AI 模型服務
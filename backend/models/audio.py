@@ -0,0 +1,295 @@
+import os
+import uuid
+import bisect
+import subprocess
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+
+SAMPLE_RATE = 16000
+# 可由 ffmpeg 解碼、接受轉換的媒體副檔名
+MEDIA_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.mp4', '.avi', '.mov', '.mkv', '.webm')
+# find_split_points 在每個目標切點前後搜尋靜音的範圍（秒）
+SPLIT_SEARCH_SECONDS = 30.0
+
+
+def decode_to_pcm(file_path: str, pcm_path: str, sr: int = SAMPLE_RATE) -> float:
+    """以 ffmpeg 將媒體檔的音軌解碼為 16 kHz 單聲道 int16 原始 PCM 檔，返回長度（秒）
+
+    ffmpeg 直接寫入檔案，解碼過程不經過 Python 記憶體；完成後才改名，避免讀到半個檔案。
+    """
+    tmp_path = f"{pcm_path}.{os.getpid()}.tmp"
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-y", "-i", file_path, "-vn",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), tmp_path,
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(f"音訊解碼失敗: {e.stderr.decode(errors='ignore')}") from e
+
+    os.replace(tmp_path, pcm_path)
+    return pcm_duration(pcm_path, sr)
+
+
+def pcm_duration(pcm_path: str, sr: int = SAMPLE_RATE) -> float:
+    return os.path.getsize(pcm_path) / (2 * sr)
+
+
+def open_pcm(pcm_path: str) -> np.ndarray:
+    """以記憶體映射開啟 int16 PCM 檔，只有實際存取的部分會被讀入"""
+    if os.path.getsize(pcm_path) == 0:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(pcm_path, dtype=np.int16, mode="r")
+
+
+def load_pcm(pcm_path: str, start: float = 0.0, duration: float = None, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """從 PCM 快取讀取 start 起 duration 秒並轉為 whisper 需要的 float32"""
+    pcm = open_pcm(pcm_path)
+    begin = int(start * sr)
+    end = len(pcm) if duration is None else min(len(pcm), begin + int(duration * sr))
+    return pcm[begin:end].astype(np.float32) / 32768.0
+
+
+def probe_duration(file_path: str) -> float:
+    """以 ffprobe 讀取媒體長度（秒），無法取得時返回 0"""
+    cmd = [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", file_path,
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True, text=True).stdout
+        return float(out.strip())
+    except (subprocess.CalledProcessError, ValueError, FileNotFoundError):
+        return 0.0
+
+
+def frame_energy(audio: np.ndarray, sr: int = SAMPLE_RATE, frame_seconds: float = 0.03) -> np.ndarray:
+    """以不重疊的音框計算 RMS 能量（向量化）"""
+    frame_length = int(sr * frame_seconds)
+    num_frames = len(audio) // frame_length
+    if num_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:num_frames * frame_length].reshape(num_frames, frame_length)
+    return np.sqrt(np.mean(frames ** 2, axis=1))
+
+
+def detect_speech(
+    audio: np.ndarray,
+    sr: int = SAMPLE_RATE,
+    frame_seconds: float = 0.03,
+    margin_db: float = 15.0,
+    max_threshold_db: float = -35.0,
+    min_threshold_db: float = -60.0,
+    min_speech: float = 0.25,
+    min_silence: float = 1.0,
+    padding: float = 0.3,
+    block_seconds: float = 600.0,
+) -> List[Tuple[float, float]]:
+    """以音框能量偵測語音區間，返回補邊並合併後的 [(start, end), ...]（秒）
+
+    能量以區塊為單位向量化計算，audio 可為記憶體映射的 int16 PCM。門檻為背景噪音
+    （能量第 10 百分位）加 margin_db，並限制在 [min_threshold_db, max_threshold_db] dBFS 內，
+    避免整段都是語音時門檻被抬得過高。
+    """
+    scale = 32768.0 if np.issubdtype(audio.dtype, np.integer) else 1.0
+    frame_length = int(sr * frame_seconds)
+    block = frame_length * max(1, int(block_seconds / frame_seconds))
+    energy = np.concatenate([np.zeros(0, dtype=np.float32)] + [
+        frame_energy(np.asarray(audio[i:i + block], dtype=np.float32) / scale, sr, frame_seconds)
+        for i in range(0, len(audio), block)
+    ])
+    if len(energy) == 0:
+        return []
+
+    db = 20 * np.log10(energy + 1e-10)
+    threshold = min(max(np.percentile(db, 10) + margin_db, min_threshold_db), max_threshold_db)
+    # 連續語音音框的起訖位置
+    edges = np.diff(np.concatenate(([0], (db > threshold).astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame_seconds
+    ends = np.flatnonzero(edges == -1) * frame_seconds
+    # 短於 min_speech 的能量突波（敲擊、雜訊）不視為語音
+    long_enough = ends - starts >= min_speech
+    starts, ends = starts[long_enough], ends[long_enough]
+    if len(starts) == 0:
+        return []
+
+    # 前後補邊後，合併間隔短於 min_silence 的區間（補邊相同，起訖仍為遞增）
+    duration = len(audio) / sr
+    starts = np.maximum(0.0, starts - padding)
+    ends = np.minimum(duration, ends + padding)
+    keep = starts[1:] - ends[:-1] >= min_silence
+    starts = starts[np.concatenate(([True], keep))]
+    ends = ends[np.concatenate((keep, [True]))]
+    return [(round(float(start), 3), round(float(end), 3)) for start, end in zip(starts, ends)]
+
+
+def compact_speech(pcm_path: str, out_path: str, regions: List[Tuple[float, float]], sr: int = SAMPLE_RATE) -> float:
+    """將 PCM 快取中的語音區間依序串接寫成新的 PCM 檔，返回長度（秒）"""
+    pcm = open_pcm(pcm_path)
+    # 相同內容的工作可能同時寫入，暫存檔名需唯一
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        for start, end in regions:
+            f.write(np.ascontiguousarray(pcm[int(start * sr):int(end * sr)]).tobytes())
+    os.replace(tmp_path, out_path)
+    return pcm_duration(out_path, sr)
+
+
+def shift_segment(segment: Dict, to_time: Callable[[float], float]) -> Dict:
+    """以 to_time 轉換句段（與逐字時間戳記）的時間"""
+    shifted = {**segment, "start": round(to_time(segment["start"]), 2), "end": round(to_time(segment["end"]), 2)}
+    if "words" in segment:
+        shifted["words"] = [
+            {**word, "start": round(to_time(word["start"]), 2), "end": round(to_time(word["end"]), 2)}
+            for word in segment["words"]
+        ]
+    return shifted
+
+
+class SpeechTimeline:
+    """串接後的語音音訊與原始時間軸的對應，用於將句段時間還原到原始音訊上"""
+
+    def __init__(self, regions: List[Tuple[float, float]]):
+        self.regions = list(regions)
+        self._offsets = []
+        offset = 0.0
+        for start, end in self.regions:
+            self._offsets.append(offset)
+            offset += end - start
+        self.speech_seconds = offset
+
+    def to_original(self, t: float) -> float:
+        if not self.regions:
+            return t
+        index = max(0, bisect.bisect_right(self._offsets, t) - 1)
+        start, end = self.regions[index]
+        return min(end, start + t - self._offsets[index])
+
+    def remap_segments(self, segments: List[Dict]) -> List[Dict]:
+        return [shift_segment(segment, self.to_original) for segment in segments]
+
+
+def find_split_points(
+    audio: np.ndarray,
+    sr: int = SAMPLE_RATE,
+    chunk_seconds: float = 300.0,
+    search_seconds: float = SPLIT_SEARCH_SECONDS,
+    frame_seconds: float = 0.03,
+) -> List[float]:
+    """在每個目標切點前後 search_seconds 內找最安靜的位置作為切點（秒）
+
+    只讀取搜尋範圍內的樣本，audio 可為記憶體映射的 int16 PCM（能量只比較相對大小）。
+    """
+    duration = len(audio) / sr
+    # 以 0.5 秒移動平均平滑能量，避免切在字與字之間的短暫停頓
+    window = max(1, int(0.5 / frame_seconds))
+    # 搜尋範圍不超過半個區段，確保不會越過上一個切點
+    search_seconds = min(search_seconds, chunk_seconds / 2)
+
+    splits = []
+    target = chunk_seconds
+    while target < duration - search_seconds:
+        lo = max(0.0, target - search_seconds)
+        hi = min(target + search_seconds, duration)
+        samples = np.asarray(audio[int(lo * sr):int(hi * sr)], dtype=np.float32)
+        energy = frame_energy(samples, sr, frame_seconds)
+        # 先以邊界值填補再平滑，避免零填補讓搜尋範圍兩端的能量偏低而總是切在邊界
+        padded = np.pad(energy, (window // 2, window - 1 - window // 2), mode="edge")
+        smoothed = np.convolve(padded, np.ones(window) / window, mode="valid")
+        split = lo + int(np.argmin(smoothed)) * frame_seconds
+        splits.append(round(split, 2))
+        target = split + chunk_seconds
+    return splits
+
+
+def plan_chunks(duration: float, splits: List[float], overlap: float = 1.0) -> List[Dict]:
+    """依切點建立區段；每段解碼範圍前後各多 overlap 秒，拼接時再去除重疊"""
+    bounds = [0.0] + list(splits) + [duration]
+    chunks = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        decode_start = max(0.0, start - overlap)
+        decode_end = min(duration, end + overlap)
+        chunks.append({
+            "start": start,
+            "end": end,
+            "decode_start": decode_start,
+            "decode_duration": decode_end - decode_start,
+        })
+    return chunks
+
+
+def place_segments(chunk: Dict, segments: List[Dict], last_end: float) -> List[Dict]:
+    """將區段內的句段時間加上解碼起點位移，只保留中點落在該區段 [start, end) 內者"""
+    offset = chunk["decode_start"]
+    placed = []
+    for segment in segments:
+        start = segment["start"] + offset
+        end = segment["end"] + offset
+        midpoint = (start + end) / 2
+        if midpoint < chunk["start"] or (midpoint >= chunk["end"] and chunk["end"] < last_end):
+            continue
+        placed.append(shift_segment(segment, lambda t: t + offset))
+    return placed
+
+
+def stitch_segments(chunk_results: List[Tuple[Dict, Dict]]) -> Dict:
+    """將各區段結果依時間順序拼接
+
+    chunk_results 為 (chunk, result) 列表，重疊範圍的句段依 place_segments 的規則去除。
+    """
+    segments = []
+    languages = []
+    last_end = max(chunk["end"] for chunk, _ in chunk_results)
+    for chunk, result in sorted(chunk_results, key=lambda item: item[0]["start"]):
+        segments.extend(place_segments(chunk, result["segments"], last_end))
+        if result.get("language"):
+            languages.append(result["language"])
+
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "language": max(set(languages), key=languages.count) if languages else None,
+        "segments": segments,
+    }
+
+
+class SegmentSequencer:
+    """依時間順序釋出各區段即時產生的句段
+
+    後面區段先產生的句段會暫存，直到前面的區段完成；最終結果與 stitch_segments 一致。
+    """
+
+    def __init__(self, chunks: List[Dict]):
+        self.chunks = chunks
+        self.last_end = max(chunk["end"] for chunk in chunks)
+        self._pending: List[List[Dict]] = [[] for _ in chunks]
+        self._released = [0] * len(chunks)
+        self._finished = [False] * len(chunks)
+        self._next = 0
+
+    def add(self, index: int, segments: List[Dict]) -> List[Dict]:
+        """加入區段 index 新產生的句段，返回可依序釋出的句段"""
+        if self._finished[index]:
+            return []
+        self._pending[index].extend(place_segments(self.chunks[index], segments, self.last_end))
+        return self._release()
+
+    def finish(self, index: int, segments: List[Dict]) -> List[Dict]:
+        """以區段的最終結果補齊尚未收到的句段並標記完成"""
+        placed = place_segments(self.chunks[index], segments, self.last_end)
+        self._pending[index] = placed[self._released[index]:]
+        self._finished[index] = True
+        return self._release()
+
+    def _release(self) -> List[Dict]:
+        released = []
+        while self._next < len(self.chunks):
+            pending = self._pending[self._next]
+            released.extend(pending)
+            self._released[self._next] += len(pending)
+            self._pending[self._next] = []
+            if not self._finished[self._next]:
+                break
+            self._next += 1
+        return released
@@ -0,0 +1,85 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BatchCollector:
+    """收集同一引擎、模型與語言的短音訊，在 max_wait 秒內湊成一批後一次推論，再將結果分送回各工作
+
+    run_batch(pcm_paths, model_size, language, engine) 需返回與 pcm_paths 順序相同的結果列表。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[str], str, str, str], Awaitable[List[Dict]]],
+        max_batch_size: Optional[int] = None,
+        max_wait: Optional[float] = None,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size or int(os.getenv("BATCH_MAX_SIZE", 8))
+        self.max_wait = max_wait if max_wait is not None else int(os.getenv("BATCH_MAX_WAIT_MS", 50)) / 1000
+        self._pending: Dict[Tuple[str, str, str], List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[Tuple[str, str, str], asyncio.TimerHandle] = {}
+        self._inflight = set()
+        self.batches = 0
+        self.batched_items = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    async def submit(self, pcm_path: str, model_size: str, language: str, engine: str) -> Dict:
+        """加入批次並等待此音訊的結果"""
+        key = (model_size, language, engine)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((pcm_path, future))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.max_wait, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Tuple[str, str, str]):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        # 已取消的請求不佔用批次
+        batch = [(path, future) for path, future in batch if not future.done()]
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run(key, batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, key: Tuple[str, str, str], batch: List[Tuple[str, asyncio.Future]]):
+        model_size, language, engine = key
+        self.batches += 1
+        self.batched_items += len(batch)
+        logger.info(f"批次推論 {engine}:{model_size}/{language}: {len(batch)} 個音訊")
+
+        try:
+            results = await self.run_batch([path for path, _ in batch], model_size, language, engine)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "average_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0,
+        }
@@ -0,0 +1,185 @@
+import os
+import sys
+import glob
+import logging
+import multiprocessing
+from typing import Dict, List, Optional
+from ..utils.job_queue import parse_model_limits
+
+logger = logging.getLogger(__name__)
+
+# 各模型每個工作的推論執行緒上限：小模型的矩陣太小，超過此數後加速有限，多餘的核心留給其他工作
+MODEL_THREAD_LIMITS = {"tiny": 4, "base": 4, "small": 8, "medium": 16, "large": 32}
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """解析 "0-3,8-11" 格式的 CPU 清單"""
+    cpus = []
+    for item in text.strip().split(","):
+        if not item:
+            continue
+        first, _, last = item.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    """本行程可使用的 CPU（受容器或 taskset 限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """依 NUMA 節點分組的可用 CPU；無法讀取拓撲（非 Linux）時視為單一節點"""
+    cpus = cpus if cpus is not None else available_cpus()
+    usable = set(cpus)
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"), key=lambda p: int(p.split("node")[-1].split("/")[0])):
+        try:
+            with open(path) as f:
+                node = [cpu for cpu in parse_cpu_list(f.read()) if cpu in usable]
+        except (OSError, ValueError):
+            continue
+        if node:
+            nodes.append(node)
+    covered = {cpu for node in nodes for cpu in node}
+    if not nodes or covered != usable:
+        return [sorted(usable)]
+    return nodes
+
+
+def pin_threads(cpus: List[int], threads: int):
+    """將本行程所有執行緒綁定到 cpus，並設定 torch 的推論執行緒數
+
+    之後建立的執行緒（如 OpenMP 執行緒池）繼承主執行緒的綁定；torch 尚未載入時只設定綁定，
+    由 OMP_NUM_THREADS 決定第一次載入時的執行緒數。
+    """
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            tids = [int(tid) for tid in os.listdir("/proc/self/task")]
+        except OSError:
+            tids = [0]
+        for tid in tids:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except OSError:
+                # 執行緒已結束
+                pass
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+
+
+def configure_torch(threads: int):
+    """工作行程啟動時設定 torch 的執行緒數；interop 執行緒數只能在第一次平行運算前設定"""
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(int(os.getenv("TORCH_INTEROP_THREADS", 1)))
+    except RuntimeError as e:
+        logger.warning(f"無法設定 torch interop 執行緒數: {e}")
+
+
+class CPUPlacement:
+    """在推論工作行程之間分配 CPU 核心
+
+    每個工作行程啟動時分配一個主要 NUMA 節點（輪流），模型權重在綁定後載入，記憶體配置在該節點上。
+    每次推論開始時依模型大小與目前的需求（執行中 + 排隊中的工作數）決定執行緒數，從主要節點取負載最低的
+    核心綁定，主要節點已滿時才使用其他節點；結束時歸還。執行中的工作不會因為之後的工作而縮減執行緒，
+    新工作分到負載最低的核心。
+
+    計數放在共享記憶體中，由主行程建立後以 ProcessPoolExecutor 的 initargs 傳給工作行程。
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        nodes: Optional[List[List[int]]] = None,
+        numa: Optional[bool] = None,
+        threads_per_job: Optional[int] = None,
+        thread_limits: Optional[Dict[str, int]] = None,
+    ):
+        numa = numa if numa is not None else os.getenv("CPU_NUMA", "auto") != "off"
+        nodes = nodes or numa_nodes()
+        self.nodes = nodes if numa else [sorted(cpu for node in nodes for cpu in node)]
+        self.cpus = sorted(cpu for node in self.nodes for cpu in node)
+        self.num_workers = num_workers
+        # 固定每個工作的執行緒數（0 為依模型與需求自動決定），通常來自 python -m backend.calibrate 的建議
+        self.threads_per_job = threads_per_job if threads_per_job is not None else int(os.getenv("CPU_THREADS_PER_JOB", 0))
+        self.thread_limits = {**MODEL_THREAD_LIMITS, **(thread_limits or parse_model_limits(os.getenv("MODEL_CPU_THREADS", "")))}
+        # 各核心上執行中的工作數（以 CPU 編號為索引）、執行中的推論數、排隊中的工作數、下一個主要節點
+        self._load = multiprocessing.Array("i", max(self.cpus) + 1)
+        self._active = multiprocessing.Value("i", 0, lock=False)
+        self._queued = multiprocessing.Value("i", 0, lock=False)
+        self._next_node = multiprocessing.Value("i", 0, lock=False)
+
+    def describe(self) -> Dict:
+        return {
+            "cpus": len(self.cpus),
+            "numa_nodes": [len(node) for node in self.nodes],
+            "threads_per_job": self.threads_per_job or "auto",
+        }
+
+    def set_queue_depth(self, queued: int):
+        self._queued.value = max(0, queued)
+
+    def assign_node(self) -> int:
+        """工作行程啟動時取得主要 NUMA 節點"""
+        with self._load.get_lock():
+            node = self._next_node.value % len(self.nodes)
+            self._next_node.value += 1
+        return node
+
+    def threads_for(self, model_size: str, active: int, queued: int) -> int:
+        """執行中 active 個、排隊中 queued 個工作時，新工作的執行緒數
+
+        預期同時執行的工作（不超過工作行程數）平分所有核心，再以模型的執行緒上限截斷；
+        佇列為空時單一工作可使用整台機器（不超過上限），佇列很深時每個工作只分到 核心數 / 工作行程數。
+        """
+        if self.threads_per_job:
+            return max(1, min(self.threads_per_job, len(self.cpus)))
+        concurrent = max(1, min(self.num_workers, active + 1 + queued))
+        share = max(1, len(self.cpus) // concurrent)
+        return max(1, min(share, self.thread_limits.get(model_size, len(self.cpus))))
+
+    def acquire(self, model_size: str, home_node: int = 0) -> List[int]:
+        """取得一次推論要綁定的核心：主要節點的核心足夠時只用主要節點，否則使用閒置核心最多的節點"""
+        with self._load.get_lock():
+            threads = self.threads_for(model_size, self._active.value, self._queued.value)
+            order = [home_node % len(self.nodes)] + [i for i in range(len(self.nodes)) if i != home_node % len(self.nodes)]
+
+            def idle(node: List[int]) -> int:
+                return sum(1 for cpu in node if self._load[cpu] == 0)
+
+            node = next((self.nodes[i] for i in order if idle(self.nodes[i]) >= threads), None)
+            if node is None:
+                node = max((self.nodes[i] for i in order), key=idle)
+            # 同負載時依編號，讓同一節點上的工作分到相鄰的核心
+            cpus = sorted(sorted(node, key=lambda cpu: (self._load[cpu], cpu))[:threads])
+            for cpu in cpus:
+                self._load[cpu] += 1
+            self._active.value += 1
+        return cpus
+
+    def release(self, cpus: List[int]):
+        with self._load.get_lock():
+            for cpu in cpus:
+                self._load[cpu] = max(0, self._load[cpu] - 1)
+            self._active.value = max(0, self._active.value - 1)
+
+
+def create_cpu_placement(num_workers: int, worker_mode: str) -> Optional[CPUPlacement]:
+    """依 CPU_PLACEMENT 建立核心配置：auto（預設）在行程模式且有多個核心時啟用，off 停用
+
+    執行緒模式下所有工作共用一個行程，無法分別綁定核心，不啟用。
+    """
+    setting = os.getenv("CPU_PLACEMENT", "auto")
+    if setting == "off" or worker_mode != "process":
+        return None
+    if setting == "auto" and len(available_cpus()) < 2:
+        return None
+    placement = CPUPlacement(num_workers)
+    logger.info(f"推論核心配置: {placement.describe()}")
+    return placement
@@ -0,0 +1,481 @@
+import os
+import sys
+import glob
+import importlib
+import importlib.util
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .audio import SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+# 模型大小、顯示名稱與參數量（與推論引擎無關）
+MODEL_INFO = {
+    "tiny": {"name": "Tiny - 最快速", "size": "39 MB"},
+    "base": {"name": "Base - 平衡（推薦）", "size": "74 MB"},
+    "small": {"name": "Small - 較準確", "size": "244 MB"},
+    "medium": {"name": "Medium - 很準確", "size": "769 MB"},
+    "large": {"name": "Large - 最準確", "size": "1550 MB"},
+}
+
+# Whisper 支援的語言代碼（與 whisper.tokenizer.LANGUAGES 相同，API 行程中驗證時不需匯入 whisper）
+LANGUAGE_CODES = (
+    "en", "zh", "de", "es", "ru", "ko", "fr", "ja", "pt", "tr", "pl", "ca", "nl", "ar", "sv", "it", "id", "hi", "fi", "vi",
+    "he", "uk", "el", "ms", "cs", "ro", "da", "hu", "ta", "no", "th", "ur", "hr", "bg", "lt", "la", "mi", "ml", "cy", "sk",
+    "te", "fa", "lv", "bn", "sr", "az", "sl", "kn", "et", "mk", "br", "eu", "is", "hy", "ne", "mn", "bs", "kk", "sq", "sw",
+    "gl", "mr", "pa", "si", "km", "sn", "yo", "so", "af", "oc", "ka", "be", "tg", "sd", "gu", "am", "yi", "lo", "uz", "fo",
+    "ht", "ps", "tk", "nn", "mt", "sa", "lb", "my", "bo", "tl", "mg", "as", "tt", "haw", "ln", "ha", "ba", "jw", "su", "yue",
+)
+
+# 進度回報函式 report(已處理音框數, 總音框數, 新句段)，每個推論執行緒各自設定
+ProgressCallback = Callable[[int, int, List[Dict]], None]
+_progress_local = threading.local()
+
+
+def segment_fields(segment: Dict) -> Dict:
+    fields = {"start": segment["start"], "end": segment["end"], "text": segment["text"]}
+    if segment.get("words"):
+        fields["words"] = [
+            {"start": round(word["start"], 2), "end": round(word["end"], 2), "word": word["word"]}
+            for word in segment["words"]
+        ]
+    return fields
+
+
+class InferenceEngine:
+    """推論引擎介面：負責載入權重並將 16 kHz float32 音訊轉為文字與句段
+
+    capabilities 說明引擎支援的功能：
+    batching（跨請求批次推論）、progress（逐窗口回報進度與句段）、thread_safe（同一模型可並行推論）、
+    word_timestamps（句段可附帶逐字時間戳記）、prompt（可接受前文 initial_prompt）、
+    language_detection（可只偵測語言，不轉換）。
+    """
+
+    name = ""
+    package = ""
+    capabilities: Dict = {}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            return importlib.util.find_spec(cls.package) is not None
+        except ModuleNotFoundError:
+            # 子模組的上層套件未安裝
+            return False
+
+    def describe(self) -> Dict:
+        return {"name": self.name, "capabilities": dict(self.capabilities)}
+
+    def is_downloaded(self, model_size: str) -> bool:
+        """權重是否已在本機（未下載的模型會在第一次使用時下載）"""
+        return False
+
+    def load(self, model_size: str):
+        raise NotImplementedError
+
+    def transcribe(self, model, audio: np.ndarray, language: Optional[str], report: Optional[ProgressCallback] = None,
+                   word_timestamps: bool = False, initial_prompt: Optional[str] = None) -> Dict:
+        """返回 {"text", "language", "segments"}，language 為 None 時自動偵測
+
+        initial_prompt 為前文（即時串流時接續上一段已確定的文字），capabilities["prompt"] 為 False 的引擎會忽略；
+        可另外返回 "timings"（如 {"encode": 秒數}）供效能分析。
+        """
+        raise NotImplementedError
+
+    def transcribe_batch(self, model, audios: List[np.ndarray], language: Optional[str]) -> List[Dict]:
+        raise NotImplementedError(f"{self.name} 引擎不支援批次推論")
+
+    def detect_language(self, model, audio: np.ndarray) -> Dict:
+        """以音訊的第一個 30 秒窗口偵測語言，返回 {"language", "probability"}"""
+        raise NotImplementedError(f"{self.name} 引擎不支援單獨偵測語言")
+
+
+# requirements.txt 固定的 openai-whisper 版本：其 transcribe() 每解碼完一個窗口，先把句段加入區域變數
+# all_segments 再更新 tqdm 進度條，即時句段依賴此行為
+WHISPER_PINNED_VERSION = "20240930"
+# 結構相容時為 whisper.transcribe.transcribe 的 code object，否則為 None（只回報進度）
+_live_segments_code = None
+
+
+class _ProgressBar:
+    """取代 whisper 內部的 tqdm 進度條，每解碼完一個窗口就回報已處理的音框數與新產生的句段"""
+
+    def __init__(self, total=None, **kwargs):
+        self.total = total
+        self.n = 0
+        self._reported_segments = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, n=1):
+        self.n += n
+        report = getattr(_progress_local, "report", None)
+        if report is None:
+            return
+
+        # 只在呼叫端確定是已檢查過的 whisper transcribe() 時讀取其 all_segments；
+        # 其他版本只回報進度，句段在轉換結束後由返回的結果一次寫入
+        new_segments = []
+        caller = sys._getframe(1)
+        if _live_segments_code is not None and caller.f_code is _live_segments_code:
+            all_segments = caller.f_locals.get("all_segments") or []
+            new_segments = [segment_fields(s) for s in all_segments[self._reported_segments:]]
+            self._reported_segments = len(all_segments)
+        report(self.n, self.total, new_segments)
+
+
+def _install_progress_hook():
+    """只替換 whisper.transcribe 模組內引用的 tqdm，不影響其他程式"""
+    global _live_segments_code
+    whisper_transcribe = importlib.import_module("whisper.transcribe")
+    progress_module = getattr(whisper_transcribe, "tqdm", None)
+    if progress_module is None:
+        if not getattr(_install_progress_hook, "warned", False):
+            _install_progress_hook.warned = True
+            logger.warning("此版本的 whisper 不使用 tqdm，轉換中無法回報進度、句段與取消")
+        return
+    if getattr(progress_module, "tqdm", None) is _ProgressBar:
+        return
+
+    code = whisper_transcribe.transcribe.__code__
+    version = getattr(sys.modules.get("whisper.version"), "__version__", None)
+    if "all_segments" in code.co_varnames:
+        _live_segments_code = code
+        if version and version != WHISPER_PINNED_VERSION:
+            logger.warning(f"openai-whisper {version} 與測試過的 {WHISPER_PINNED_VERSION} 不同，即時句段可能不完整")
+    else:
+        _live_segments_code = None
+        logger.warning(f"openai-whisper {version or ''} 的 transcribe() 結構已變更，只回報進度，句段在轉換結束後寫入")
+    whisper_transcribe.tqdm = type("tqdm", (), {"tqdm": _ProgressBar})
+
+
+@contextmanager
+def _time_encoder(model, timings: Dict):
+    """以 forward hooks 累計音訊編碼器的耗時，其餘推論時間即為 token 解碼"""
+    encoder = getattr(model, "encoder", None)
+    if encoder is None or not hasattr(encoder, "register_forward_hook"):
+        yield
+        return
+
+    starts = []
+    timings.setdefault("encode", 0.0)
+
+    def before(module, inputs):
+        starts.append(time.perf_counter())
+
+    def after(module, inputs, output):
+        timings["encode"] += time.perf_counter() - starts.pop()
+
+    handles = [encoder.register_forward_pre_hook(before), encoder.register_forward_hook(after)]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def _segments_from_tokens(tokenizer, tokens: list, duration: float) -> list:
+    """依時間戳記 token 將單一窗口的解碼結果切成句段"""
+    timestamp_begin = tokenizer.timestamp_begin
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token < timestamp_begin:
+            text_tokens.append(token)
+            continue
+        time_offset = (token - timestamp_begin) * 0.02
+        if start is not None and text_tokens:
+            segments.append({"start": start, "end": time_offset, "text": tokenizer.decode(text_tokens)})
+            text_tokens = []
+            start = None
+        else:
+            start = time_offset
+    if text_tokens:
+        segments.append({"start": start or 0.0, "end": duration, "text": tokenizer.decode(text_tokens)})
+    return segments
+
+
+class TorchEngine(InferenceEngine):
+    """openai-whisper（PyTorch fp32/fp16）"""
+
+    name = "torch"
+    package = "whisper"
+    # whisper 每次 transcribe 都會在共用模型上掛載 kv-cache hooks，同一模型不可同時轉換
+    capabilities = {"batching": True, "progress": True, "thread_safe": False, "word_timestamps": True, "prompt": True,
+                    "language_detection": True, "precision": "fp32"}
+
+    def is_downloaded(self, model_size: str) -> bool:
+        # 只檢查下載目錄，不在 API 行程中匯入 torch
+        download_root = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "whisper")
+        pattern = "large-v*.pt" if model_size == "large" else f"{model_size}.pt"
+        return bool(glob.glob(os.path.join(download_root, pattern)))
+
+    def __init__(self):
+        # 轉換後權重的本機快取：第一次載入後保存已轉為 fp32 的模型，之後以 mmap 載入，
+        # 重新啟動時不必再反序列化與轉換 checkpoint，各工作行程也共用同一份分頁快取
+        self.weight_cache_dir = os.getenv("WHISPER_WEIGHT_CACHE_DIR")
+
+    def load(self, model_size: str):
+        import whisper
+        if self.weight_cache_dir:
+            try:
+                model = self._load_cached(model_size)
+                if model is not None:
+                    return model
+            except Exception as e:
+                logger.warning(f"權重快取載入失敗，改用原始 checkpoint: {e}")
+
+        model = whisper.load_model(model_size)
+        if self.weight_cache_dir and model.device.type == "cpu":
+            try:
+                self._save_cached(model_size, model)
+            except Exception as e:
+                logger.warning(f"寫入權重快取失敗: {e}")
+        return model
+
+    def _cache_path(self, model_size: str) -> str:
+        return os.path.join(self.weight_cache_dir, f"{model_size}.pt")
+
+    def _load_cached(self, model_size: str):
+        """以 mmap 載入快取的模型（需要 torch 2.1 以上），不在快取中或可使用 GPU 時返回 None"""
+        import torch
+        path = self._cache_path(model_size)
+        if not os.path.exists(path) or torch.cuda.is_available():
+            return None
+        started = time.perf_counter()
+        # 快取由本服務自行寫入，需包含模型結構（非只有權重）
+        model = torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+        logger.info(f"以 mmap 載入權重快取 {model_size}: {time.perf_counter() - started:.2f}s")
+        return model
+
+    def _save_cached(self, model_size: str, model):
+        import torch
+        os.makedirs(self.weight_cache_dir, exist_ok=True)
+        path = self._cache_path(model_size)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(model, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(f"已寫入權重快取: {path}")
+
+    def transcribe(self, model, audio, language, report=None, word_timestamps=False, initial_prompt=None):
+        _install_progress_hook()
+        _progress_local.report = report
+        timings = {}
+        try:
+            with _time_encoder(model, timings):
+                result = model.transcribe(
+                    audio, language=language, verbose=False, word_timestamps=word_timestamps, initial_prompt=initial_prompt
+                )
+        finally:
+            _progress_local.report = None
+        return {
+            "text": result["text"],
+            "language": result.get("language"),
+            "segments": [segment_fields(segment) for segment in result.get("segments", [])],
+            "timings": timings,
+        }
+
+    def transcribe_batch(self, model, audios, language):
+        """將多個不超過 30 秒的音訊各補齊為一個 mel 窗口，以單次批次的編碼與解碼處理"""
+        import torch
+        import whisper
+        from whisper.tokenizer import get_tokenizer
+
+        mels = [whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels) for audio in audios]
+        options = whisper.DecodingOptions(
+            language=language,
+            without_timestamps=False,
+            fp16=model.device.type != "cpu",
+        )
+        # 未指定語言時 decode 會逐一偵測批次內各音訊的語言
+        timings = {}
+        with _time_encoder(model, timings):
+            results = whisper.decode(model, torch.stack(mels).to(model.device), options)
+
+        tokenizer_kwargs = {"num_languages": model.num_languages} if hasattr(model, "num_languages") else {}
+        items = []
+        for result, audio in zip(results, audios):
+            tokenizer = get_tokenizer(model.is_multilingual, language=result.language, task="transcribe", **tokenizer_kwargs)
+            items.append({
+                "text": result.text,
+                "language": result.language,
+                "segments": _segments_from_tokens(tokenizer, result.tokens, len(audio) / SAMPLE_RATE),
+                "timings": dict(timings),
+            })
+        return items
+
+    def detect_language(self, model, audio):
+        import whisper
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels).to(model.device)
+        # 只執行一次編碼器與一個解碼步驟
+        _, probs = model.detect_language(mel)
+        language = max(probs, key=probs.get)
+        return {"language": language, "probability": round(float(probs[language]), 3)}
+
+
+class CTranslate2Engine(InferenceEngine):
+    """faster-whisper（CTranslate2），預設以 int8 量化在 CPU 上執行"""
+
+    name = "ctranslate2"
+    package = "faster_whisper"
+
+    def __init__(self):
+        self.device = os.getenv("CT2_DEVICE", "cpu")
+        self.compute_type = os.getenv("CT2_COMPUTE_TYPE", "int8")
+        self.cpu_threads = int(os.getenv("CT2_CPU_THREADS", 0))
+        # 預先轉換好的模型目錄 {CT2_MODEL_DIR}/{model_size}，不存在時從 Hugging Face 下載
+        self.model_dir = os.getenv("CT2_MODEL_DIR")
+        self.capabilities = {
+            "batching": False, "progress": True, "thread_safe": True, "word_timestamps": True, "prompt": True,
+            "language_detection": True, "precision": self.compute_type
+        }
+
+    def _local_path(self, model_size: str) -> Optional[str]:
+        if self.model_dir and os.path.isdir(os.path.join(self.model_dir, model_size)):
+            return os.path.join(self.model_dir, model_size)
+        return None
+
+    def is_downloaded(self, model_size: str) -> bool:
+        if self._local_path(model_size):
+            return True
+        try:
+            from huggingface_hub import try_to_load_from_cache
+            repo = f"Systran/faster-whisper-{'large-v3' if model_size == 'large' else model_size}"
+            return isinstance(try_to_load_from_cache(repo, "model.bin"), str)
+        except ImportError:
+            return False
+
+    def load(self, model_size: str):
+        from faster_whisper import WhisperModel
+        return WhisperModel(
+            self._local_path(model_size) or ("large-v3" if model_size == "large" else model_size),
+            device=self.device,
+            compute_type=self.compute_type,
+            cpu_threads=self.cpu_threads,
+        )
+
+    def transcribe(self, model, audio, language, report=None, word_timestamps=False, initial_prompt=None):
+        # 與 openai-whisper transcribe() 的預設相同使用貪婪解碼
+        segment_iter, info = model.transcribe(
+            audio, language=language, beam_size=1, word_timestamps=word_timestamps, initial_prompt=initial_prompt
+        )
+        total_frames = int(info.duration * 100)
+        segments = []
+        for segment in segment_iter:
+            fields = segment_fields({
+                "start": segment.start, "end": segment.end, "text": segment.text,
+                "words": [{"start": w.start, "end": w.end, "word": w.word} for w in segment.words or []],
+            })
+            segments.append(fields)
+            if report is not None:
+                report(min(total_frames, int(segment.end * 100)), total_frames, [fields])
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "language": info.language,
+            "segments": segments,
+        }
+
+    def detect_language(self, model, audio):
+        # transcribe() 返回前即完成語言偵測，句段為延遲產生，不迭代就不會解碼
+        _, info = model.transcribe(audio[:30 * SAMPLE_RATE], beam_size=1)
+        return {"language": info.language, "probability": round(float(info.language_probability), 3)}
+
+
+class ONNXEngine(InferenceEngine):
+    """ONNX Runtime（透過 optimum 匯出的 Whisper 編碼器/解碼器）"""
+
+    name = "onnx"
+    package = "optimum.onnxruntime"
+
+    def __init__(self):
+        self.provider = os.getenv("ONNX_PROVIDER", "CPUExecutionProvider")
+        # 預先匯出的模型目錄 {ONNX_MODEL_DIR}/{model_size}，不存在時在載入時從 Hugging Face 匯出
+        self.model_dir = os.getenv("ONNX_MODEL_DIR")
+        self.capabilities = {"batching": False, "progress": False, "thread_safe": True, "word_timestamps": False, "prompt": False,
+                             "language_detection": False, "precision": "fp32"}
+
+    def _local_path(self, model_size: str) -> Optional[str]:
+        if self.model_dir and os.path.isdir(os.path.join(self.model_dir, model_size)):
+            return os.path.join(self.model_dir, model_size)
+        return None
+
+    def is_downloaded(self, model_size: str) -> bool:
+        return self._local_path(model_size) is not None
+
+    def load(self, model_size: str):
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+        from transformers import AutoProcessor, pipeline
+
+        path = self._local_path(model_size)
+        model_id = path or f"openai/whisper-{'large-v3' if model_size == 'large' else model_size}"
+        model = ORTModelForSpeechSeq2Seq.from_pretrained(model_id, export=path is None, provider=self.provider)
+        processor = AutoProcessor.from_pretrained(model_id)
+        return pipeline(
+            "automatic-speech-recognition",
+            model=model,
+            tokenizer=processor.tokenizer,
+            feature_extractor=processor.feature_extractor,
+            chunk_length_s=30,
+        )
+
+    def transcribe(self, model, audio, language, report=None, word_timestamps=False, initial_prompt=None):
+        generate_kwargs = {"task": "transcribe"}
+        if language:
+            generate_kwargs["language"] = language
+        output = model(np.array(audio), return_timestamps=True, generate_kwargs=generate_kwargs)
+
+        duration = len(audio) / SAMPLE_RATE
+        segments = []
+        for chunk in output.get("chunks", []):
+            start, end = chunk["timestamp"]
+            segments.append({"start": start or 0.0, "end": end if end is not None else duration, "text": chunk["text"]})
+        return {"text": output["text"], "language": language, "segments": segments}
+
+
+ENGINES = {engine.name: engine for engine in (TorchEngine, CTranslate2Engine, ONNXEngine)}
+_instances: Dict[str, InferenceEngine] = {}
+
+
+def available_engines() -> List[str]:
+    """已安裝執行環境的引擎名稱"""
+    return [name for name, engine in ENGINES.items() if engine.is_available()]
+
+
+def default_engine() -> str:
+    """WHISPER_ENGINE 指定的引擎；未指定時使用第一個已安裝的引擎"""
+    configured = os.getenv("WHISPER_ENGINE")
+    if configured:
+        return configured
+    installed = available_engines()
+    return installed[0] if installed else "torch"
+
+
+def get_engine(name: Optional[str] = None) -> InferenceEngine:
+    name = name or default_engine()
+    if name not in ENGINES:
+        raise ValueError(f"未知的推論引擎: {name}")
+    if name not in _instances:
+        _instances[name] = ENGINES[name]()
+    return _instances[name]
+
+
+def model_key(engine: str, model_size: str) -> str:
+    """模型登錄表使用的鍵，例如 "ctranslate2:base" """
+    return f"{engine}:{model_size}"
+
+
+def load_model(key: str):
+    """依 model_key 載入模型；不含引擎名稱時使用預設引擎"""
+    engine, _, model_size = key.rpartition(":")
+    return get_engine(engine or None).load(model_size)
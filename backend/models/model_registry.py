@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 各模型 fp32 權重的大約記憶體用量（MB），載入前用來預先騰出空間
+MODEL_MEMORY_MB = {
+    "tiny": 150,
+    "base": 290,
+    "small": 970,
+    "medium": 3050,
+    "large": 6170,
+}
+
+
+def _default_loader(model_key: str):
+    from .engines import load_model
+    return load_model(model_key)
+
+
+def _model_size(model_key: str) -> str:
+    """"ctranslate2:base" 形式的鍵取出模型大小"""
+    return model_key.rpartition(":")[2]
+
+
+def estimate_model_bytes(model: Any, model_size: str) -> int:
+    """計算模型參數與緩衝區實際佔用的位元組數（非 PyTorch 模型以 fp32 大小估算）"""
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except AttributeError:
+        return MODEL_MEMORY_MB.get(_model_size(model_size), 0) * 1024 * 1024
+
+
+class ModelRegistry:
+    """在記憶體預算內常駐多個模型，超出預算時淘汰最久未使用的模型
+
+    淘汰只會移除登錄表中的參考；正在使用該模型的請求仍持有參考，
+    直到完成後才由垃圾回收釋放，因此不會中斷進行中的轉換。
+    """
+
+    def __init__(self, memory_budget_mb: Optional[int] = None, loader: Optional[Callable[[str], Any]] = None):
+        if memory_budget_mb is None:
+            memory_budget_mb = int(os.getenv("WHISPER_MODEL_MEMORY_MB", 4096))
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.loader = loader or _default_loader
+
+        self._lock = threading.Lock()
+        self._models: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "loads": 0, "load_failures": 0}
+        self._load_seconds: Dict[str, float] = {}
+
+    def get(self, model_size: str):
+        """取得模型；未載入時載入，同一模型的並行載入只會執行一次"""
+        with self._lock:
+            if model_size in self._models:
+                self._models.move_to_end(model_size)
+                self._counters["hits"] += 1
+                return self._models[model_size][0]
+
+            self._counters["misses"] += 1
+            future = self._loading.get(model_size)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._loading[model_size] = future
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            model = self._load(model_size)
+            future.set_result(model)
+            return model
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(model_size, None)
+
+    def preload(self, model_size: str) -> Future:
+        """在背景執行緒載入模型，不阻塞呼叫端"""
+        future: Future = Future()
+
+        def _run():
+            try:
+                future.set_result(self.get(model_size))
+            except BaseException as e:
+                logger.warning(f"背景載入 {model_size} 模型失敗: {e}")
+                future.set_exception(e)
+
+        threading.Thread(target=_run, name=f"preload-{model_size}", daemon=True).start()
+        return future
+
+    def is_loaded(self, model_size: str) -> bool:
+        with self._lock:
+            return model_size in self._models
+
+    def stats(self) -> Dict:
+        """命中、未命中、淘汰次數與目前常駐模型，用於調整記憶體預算"""
+        with self._lock:
+            return {
+                **self._counters,
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024)),
+                "memory_used_mb": round(self._used_bytes() / (1024 * 1024)),
+                "resident": list(self._models.keys()),
+                "loading": list(self._loading.keys()),
+                "load_seconds": dict(self._load_seconds),
+            }
+
+    def _used_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._models.values())
+
+    def _evict_for(self, nbytes: int):
+        """淘汰最久未使用的模型直到容得下 nbytes（需持有鎖）"""
+        while self._models and self._used_bytes() + nbytes > self.memory_budget:
+            evicted, _ = self._models.popitem(last=False)
+            self._counters["evictions"] += 1
+            logger.info(f"記憶體預算不足，淘汰 {evicted} 模型")
+
+    def _load(self, model_size: str):
+        with self._lock:
+            self._evict_for(MODEL_MEMORY_MB.get(_model_size(model_size), 0) * 1024 * 1024)
+
+        start_time = time.perf_counter()
+        try:
+            model = self.loader(model_size)
+        except BaseException:
+            with self._lock:
+                self._counters["load_failures"] += 1
+            raise
+        load_seconds = time.perf_counter() - start_time
+        nbytes = estimate_model_bytes(model, model_size)
+
+        with self._lock:
+            self._evict_for(nbytes)
+            if nbytes > self.memory_budget:
+                logger.warning(f"{model_size} 模型 ({nbytes // (1024 * 1024)} MB) 超過記憶體預算")
+            self._models[model_size] = (model, nbytes)
+            self._counters["loads"] += 1
+            self._load_seconds[model_size] = round(load_seconds, 2)
+
+        logger.info(f"{model_size} 模型載入完成: {load_seconds:.1f}s, {nbytes // (1024 * 1024)} MB")
+        return model
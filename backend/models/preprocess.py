@@ -0,0 +1,141 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional, Set, Tuple
+from ..utils.file_handler import FileHandler
+from ..utils.tracing import tracer
+from .audio import SAMPLE_RATE, SPLIT_SEARCH_SECONDS, SpeechTimeline, decode_to_pcm, probe_duration, open_pcm, pcm_duration, detect_speech, compact_speech
+
+logger = logging.getLogger(__name__)
+
+
+def vad_options() -> Dict:
+    """語音活動偵測（VAD）參數，見 detect_speech"""
+    return {
+        "margin_db": float(os.getenv("VAD_MARGIN_DB", 15)),
+        "max_threshold_db": float(os.getenv("VAD_MAX_THRESHOLD_DB", -35)),
+        "min_speech": float(os.getenv("VAD_MIN_SPEECH_SECONDS", 0.25)),
+        "min_silence": float(os.getenv("VAD_MIN_SILENCE_SECONDS", 1.0)),
+        "padding": float(os.getenv("VAD_PADDING_SECONDS", 0.3)),
+    }
+
+
+def chunk_seconds_setting() -> float:
+    """長音訊切段的目標長度（CHUNK_SECONDS）
+
+    至少為靜音搜尋範圍的兩倍，否則搜尋範圍會越過上一個切點，產生空的或倒退的區段。
+    """
+    chunk_seconds = float(os.getenv("CHUNK_SECONDS", 300))
+    minimum = 2 * SPLIT_SEARCH_SECONDS
+    if chunk_seconds < minimum:
+        logger.warning(f"CHUNK_SECONDS={chunk_seconds:g} 小於靜音搜尋範圍的兩倍，改用 {minimum:g} 秒")
+        return minimum
+    return chunk_seconds
+
+
+class AudioPreprocessor:
+    """將上傳的媒體只解碼一次為 16 kHz 單聲道 int16 PCM，存放在上傳檔旁供之後的轉換記憶體映射使用
+
+    上傳完成即在背景開始解碼，讓解碼不在轉換的關鍵路徑上；同一檔案的並行請求共用同一次解碼。
+    """
+
+    def __init__(self, file_handler: FileHandler):
+        self.file_handler = file_handler
+        # ffmpeg 在子行程中解碼，執行緒只負責等待
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("PREPROCESS_WORKERS", 2)),
+            thread_name_prefix="audio-preprocess"
+        )
+        self.vad_options = vad_options()
+        # 可略過的靜音少於此比例時直接使用原始音訊，省去寫入串接檔
+        self.vad_min_skip_ratio = float(os.getenv("VAD_MIN_SKIP_RATIO", 0.05))
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+
+    def schedule(self, file_id: str):
+        """在背景預先解碼（上傳完成後呼叫）"""
+        task = asyncio.ensure_future(self.ensure_pcm(file_id))
+        self._background.add(task)
+        task.add_done_callback(partial(self._on_background_done, file_id))
+
+    def _on_background_done(self, file_id: str, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"預先解碼失敗 {file_id}: {task.exception()}")
+
+    async def ensure_pcm(self, file_id: str) -> str:
+        """返回 PCM 快取路徑，尚未解碼時解碼（或等待進行中的解碼）"""
+        pcm_path = await self.file_handler.get_pcm_path(file_id)
+        if await self.file_handler.pcm_exists(pcm_path):
+            return pcm_path
+
+        task = self._pending.get(pcm_path)
+        if task is None:
+            task = asyncio.ensure_future(self._decode(file_id, pcm_path))
+            self._pending[pcm_path] = task
+            task.add_done_callback(lambda _: self._pending.pop(pcm_path, None))
+
+        # 等待者取消時不中斷共用的解碼
+        await asyncio.shield(task)
+        return pcm_path
+
+    async def get_duration(self, file_id: str) -> Optional[float]:
+        """音訊長度（秒）：已解碼時使用解碼結果，否則以 ffprobe 讀取標頭；無法取得時返回 None"""
+        duration = await self.file_handler.get_audio_duration(file_id)
+        if duration:
+            return duration
+        
+        file_path = await self.file_handler.get_file_path(file_id)
+        loop = asyncio.get_running_loop()
+        duration = await loop.run_in_executor(self.executor, probe_duration, file_path)
+        if not duration:
+            return None
+        # 背景解碼完成後會以精確長度覆寫
+        if not await self.file_handler.get_audio_duration(file_id):
+            await self.file_handler.update_metadata(file_id, duration=round(duration, 3))
+        return duration
+    
+    async def speech_only(self, file_id: str, pcm_path: str) -> Tuple[str, Optional[SpeechTimeline], Dict]:
+        """偵測語音區間並將其串接為新的 PCM 檔，返回 (PCM 路徑, 時間對應, 略過音訊報告)
+
+        略過的靜音太少時返回原始 PCM 與 None（不需要還原時間）。
+        """
+        loop = asyncio.get_running_loop()
+        with tracer.span(file_id, "vad"):
+            regions = await loop.run_in_executor(self.executor, self._detect_speech, pcm_path)
+            duration = pcm_duration(pcm_path)
+            timeline = SpeechTimeline(regions)
+            skipped = max(0.0, duration - timeline.speech_seconds)
+            report = {
+                "speech_seconds": round(timeline.speech_seconds, 2),
+                "skipped_seconds": round(skipped, 2),
+                "skipped_ratio": round(skipped / duration, 4) if duration else 0.0,
+                "regions": len(regions),
+            }
+            if regions and skipped < duration * self.vad_min_skip_ratio:
+                report.update(skipped_seconds=0.0, skipped_ratio=0.0)
+                return pcm_path, None, report
+            
+            # 完全沒有語音時不寫檔，呼叫端依 speech_seconds 直接返回空結果
+            speech_path = f"{os.path.splitext(pcm_path)[0]}.speech.pcm"
+            if regions:
+                await loop.run_in_executor(self.executor, compact_speech, pcm_path, speech_path, regions)
+        logger.info(f"語音活動偵測 {file_id}: {len(regions)} 個語音區間，略過 {skipped:.1f}s / {duration:.1f}s")
+        return speech_path, timeline, report
+    
+    def _detect_speech(self, pcm_path: str) -> list:
+        return detect_speech(open_pcm(pcm_path), SAMPLE_RATE, **self.vad_options)
+    
+    async def _decode(self, file_id: str, pcm_path: str):
+        file_path = await self.file_handler.get_file_path(file_id)
+        loop = asyncio.get_running_loop()
+        with tracer.span(file_id, "decode"):
+            duration = await loop.run_in_executor(self.executor, decode_to_pcm, file_path, pcm_path)
+        await self.file_handler.update_metadata(file_id, duration=round(duration, 3))
+        logger.info(f"音訊已解碼 {file_id}: {duration:.1f}s")
+        await self.file_handler.source_produced(file_id, "decoded")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
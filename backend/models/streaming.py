@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+from .audio import SAMPLE_RATE
+from ..utils.metrics import STREAM_FINAL_LATENCY, STREAM_DROPPED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# decode(int16 音訊, 前文, 語言) -> {"language", "segments", "inference"}
+WindowDecoder = Callable[[np.ndarray, Optional[str], str], Awaitable[Dict]]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class StreamingTranscriber:
+    """即時串流轉換：將最近的音訊保留在固定大小的緩衝區，每收到 step_seconds 新音訊就轉換整個緩衝區
+
+    連續兩次轉換都得到相同文字的句段（最後一句除外）視為已確定（local agreement），以 final 送出後
+    從緩衝區移除，文字作為下一次轉換的前文；其餘以 partial 送出。緩衝區接近 window_seconds 時強制確定，
+    轉換跟不上輸入時丟棄最舊的音訊，因此每個連線最多保留 window_seconds 的音訊。
+    """
+
+    def __init__(
+        self,
+        decode: WindowDecoder,
+        language: str = "auto",
+        window_seconds: Optional[float] = None,
+        step_seconds: Optional[float] = None,
+        prompt_chars: Optional[int] = None,
+    ):
+        self.decode_window = decode
+        self.language = language
+        # 單一解碼窗口最多 30 秒
+        self.window_seconds = min(30.0, window_seconds or float(os.getenv("STREAM_WINDOW_SECONDS", 15)))
+        self.step_seconds = step_seconds or float(os.getenv("STREAM_STEP_SECONDS", 1.0))
+        self.prompt_chars = prompt_chars if prompt_chars is not None else int(os.getenv("STREAM_PROMPT_CHARS", 200))
+        self._buffer = np.zeros(int(self.window_seconds * SAMPLE_RATE), dtype=np.int16)
+        self._length = 0
+        # 緩衝區第一個樣本在整個串流中的位置，與上次轉換涵蓋到的位置
+        self._offset = 0
+        self._decoded_until = 0
+        self._remainder = b""
+        # (串流位置, 到達時間)，計算確定句段的延遲
+        self._arrivals: deque = deque(maxlen=4096)
+        self._previous: List[Dict] = []
+        self.prompt = ""
+        self.detected_language: Optional[str] = None
+        self.received_samples = 0
+        self.dropped_samples = 0
+        self.finalized = 0
+
+    def feed(self, data: bytes):
+        """加入 16 kHz 單聲道 int16 little-endian PCM"""
+        data = self._remainder + data
+        usable = len(data) - len(data) % 2
+        self._remainder = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype="<i2")
+        if not len(samples):
+            return
+
+        self.received_samples += len(samples)
+        if len(samples) > len(self._buffer):
+            self.dropped_samples += len(samples) - len(self._buffer)
+            samples = samples[-len(self._buffer):]
+        overflow = self._length + len(samples) - len(self._buffer)
+        if overflow > 0:
+            self.dropped_samples += overflow
+            STREAM_DROPPED_SECONDS.inc(overflow / SAMPLE_RATE)
+            self._trim(overflow)
+        self._buffer[self._length:self._length + len(samples)] = samples
+        self._length += len(samples)
+        self._offset = self.received_samples - self._length
+        self._arrivals.append((self.received_samples, time.perf_counter()))
+
+    @property
+    def ready(self) -> bool:
+        """新收到的音訊已達 step_seconds，可再轉換一次"""
+        return self.received_samples - max(self._decoded_until, self._offset) >= self.step_seconds * SAMPLE_RATE
+
+    def _trim(self, count: int):
+        """移除緩衝區最前面的 count 個樣本"""
+        count = min(count, self._length)
+        if count <= 0:
+            return
+        self._buffer[:self._length - count] = self._buffer[count:self._length]
+        self._length -= count
+        self._offset += count
+        while self._arrivals and self._arrivals[0][0] <= self._offset:
+            self._arrivals.popleft()
+
+    def _arrival_time(self, seconds: float) -> float:
+        position = seconds * SAMPLE_RATE
+        for end, arrived in self._arrivals:
+            if end >= position:
+                return arrived
+        return time.perf_counter()
+
+    async def step(self, final: bool = False) -> List[Dict]:
+        """轉換目前的緩衝區，返回要送給客戶端的 final 與 partial 事件；final=True 時確定所有句段"""
+        if not self._length:
+            return []
+
+        offset = self._offset
+        audio = self._buffer[:self._length].copy()
+        self._decoded_until = offset + len(audio)
+        result = await self.decode_window(audio, self.prompt or None, self.detected_language or self.language)
+        if self.language == "auto" and result.get("language"):
+            # 之後的窗口沿用第一次偵測到的語言，避免短窗口誤判
+            self.detected_language = result["language"]
+
+        start = offset / SAMPLE_RATE
+        window_end = len(audio) / SAMPLE_RATE
+        hypothesis = [
+            {
+                "start": round(start + segment["start"], 2),
+                "end": round(start + min(segment["end"], window_end), 2),
+                "text": segment["text"],
+            }
+            for segment in result["segments"]
+            if segment["text"].strip() and segment["start"] < window_end
+        ]
+
+        agreed = 0
+        for previous, current in zip(self._previous, hypothesis[:-1]):
+            if _normalize(previous["text"]) != _normalize(current["text"]):
+                break
+            agreed += 1
+        near_full = len(audio) >= len(self._buffer) - self.step_seconds * SAMPLE_RATE
+        if final:
+            agreed = len(hypothesis)
+        elif near_full:
+            agreed = max(agreed, len(hypothesis) - 1 if len(hypothesis) > 1 else len(hypothesis))
+        committed, self._previous = hypothesis[:agreed], hypothesis[agreed:]
+
+        events = []
+        now = time.perf_counter()
+        for segment in committed:
+            latency = max(0.0, now - self._arrival_time(segment["end"]))
+            STREAM_FINAL_LATENCY.observe(latency)
+            events.append({"type": "final", "segment": segment, "latency": round(latency, 3)})
+            self.prompt = (self.prompt + segment["text"])[-self.prompt_chars:] if self.prompt_chars else ""
+        self.finalized += len(committed)
+
+        if final:
+            self._trim(self._length)
+        elif committed:
+            self._trim(int(committed[-1]["end"] * SAMPLE_RATE) - self._offset)
+        elif near_full and not hypothesis:
+            # 長時間沒有語音：只保留最後一步的音訊
+            self._trim(self._length - int(self.step_seconds * SAMPLE_RATE))
+
+        if self._previous:
+            events.append({
+                "type": "partial",
+                "text": "".join(segment["text"] for segment in self._previous).strip(),
+                "start": self._previous[0]["start"],
+                "end": self._previous[-1]["end"],
+            })
+        return events
+
+    def stats(self) -> Dict:
+        return {
+            "received_seconds": round(self.received_samples / SAMPLE_RATE, 2),
+            "dropped_seconds": round(self.dropped_samples / SAMPLE_RATE, 2),
+            "finalized_segments": self.finalized,
+            "language": self.detected_language or self.language,
+        }
+
+
+class FFmpegStreamDecoder:
+    """以 ffmpeg 子行程將串流輸入（WebM/Ogg Opus 或其他取樣率的 PCM）即時解碼為 16 kHz 單聲道 int16 PCM"""
+
+    def __init__(self, input_format: str, sample_rate: Optional[int] = None, channels: int = 1):
+        self.input_args = ["-f", input_format]
+        if sample_rate:
+            # 原始 PCM 沒有標頭，需指定取樣率與聲道數
+            self.input_args += ["-ar", str(sample_rate), "-ac", str(channels)]
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, on_pcm: Callable[[bytes], None]):
+        self.process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error", *self.input_args, "-i", "pipe:0", "-vn",
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._reader = asyncio.create_task(self._read(on_pcm))
+
+    async def _read(self, on_pcm: Callable[[bytes], None]):
+        while True:
+            chunk = await self.process.stdout.read(65536)
+            if not chunk:
+                break
+            on_pcm(chunk)
+
+    async def write(self, data: bytes):
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def close(self):
+        """結束輸入並等待剩餘的音訊解碼完成"""
+        if self.process.stdin.can_write_eof():
+            self.process.stdin.write_eof()
+        await asyncio.wait_for(asyncio.gather(self._reader, return_exceptions=True), timeout=10)
+        await self.process.wait()
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        if self._reader is not None:
+            self._reader.cancel()
+
+
+async def serve_stream(
+    websocket: WebSocket,
+    transcriber: StreamingTranscriber,
+    decoder: Optional[FFmpegStreamDecoder] = None,
+    idle_timeout: float = 30.0,
+):
+    """處理一個已接受的 WebSocket 連線：二進位訊息為音訊，文字訊息 {"type": "stop"} 結束輸入
+
+    收到 stop（或 idle_timeout 秒沒有訊息）時轉換剩餘的音訊，送出最後的 final 與 {"type": "done"} 後關閉。
+    """
+    audio_ready = asyncio.Event()
+    closing = False
+
+    def on_pcm(data: bytes):
+        transcriber.feed(data)
+        if transcriber.ready:
+            audio_ready.set()
+
+    async def decode_loop():
+        # 每個連線同時只有一個轉換，轉換期間收到的音訊累積到下一次
+        while not closing:
+            await audio_ready.wait()
+            audio_ready.clear()
+            if closing:
+                break
+            for event in await transcriber.step():
+                await websocket.send_json(event)
+
+    if decoder is not None:
+        await decoder.start(on_pcm)
+    decoding = asyncio.create_task(decode_loop())
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=idle_timeout)
+            except asyncio.TimeoutError:
+                break
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if decoding.done():
+                # 轉換失敗時將例外拋出
+                decoding.result()
+            if message.get("bytes"):
+                if decoder is not None:
+                    await decoder.write(message["bytes"])
+                else:
+                    on_pcm(message["bytes"])
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    command = {}
+                if command.get("type") == "stop":
+                    break
+
+        if decoder is not None:
+            await decoder.close()
+        closing = True
+        audio_ready.set()
+        await decoding
+        for event in await transcriber.step(final=True):
+            await websocket.send_json(event)
+        await websocket.send_json({"type": "done", **transcriber.stats()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info(f"串流連線已中斷: {transcriber.stats()}")
+    finally:
+        decoding.cancel()
+        await asyncio.gather(decoding, return_exceptions=True)
+        if decoder is not None:
+            decoder.kill()
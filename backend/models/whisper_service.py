@@ -0,0 +1,780 @@
+import os
+import time
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from importlib.util import find_spec
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+from ..utils.file_handler import FileHandler
+from ..utils.estimator import ProcessingTimeEstimator
+from ..utils.metrics import TRANSCRIPTIONS, TRANSCRIPTION_SECONDS, INFERENCE_RTF
+from ..utils.tracing import tracer
+from .model_registry import ModelRegistry
+from .audio import (
+    SAMPLE_RATE, SegmentSequencer, SpeechTimeline, open_pcm, load_pcm, pcm_duration, find_split_points, plan_chunks, stitch_segments
+)
+from .engines import MODEL_INFO, get_engine, default_engine, model_key
+from .preprocess import AudioPreprocessor, chunk_seconds_setting
+from .batching import BatchCollector
+from .cpu_placement import CPUPlacement, configure_torch, create_cpu_placement, pin_threads
+
+logger = logging.getLogger(__name__)
+
+# 每個推論工作行程各自保有一份模型登錄表（依記憶體預算 LRU 淘汰）
+_registry = ModelRegistry()
+
+
+def _get_worker_model(model_size: str, engine: Optional[str] = None):
+    """在目前行程中載入（或重用）模型"""
+    return _registry.get(model_key(get_engine(engine).name, model_size))
+
+
+# 解碼進度回報佇列：行程模式下於工作行程初始化時設定，執行緒模式下與主行程共用
+_progress_queue = None
+
+# 已取消工作的代號（環狀寫入的共享記憶體陣列），推論工作行程在每個解碼窗口之間檢查
+CANCEL_SLOTS = 64
+_cancel_slots = None
+
+# CPU 核心配置與本工作行程的主要 NUMA 節點（行程模式且啟用 CPU_PLACEMENT 時設定）
+_placement: Optional[CPUPlacement] = None
+_home_node = 0
+
+
+class TranscriptionCancelled(Exception):
+    """工作已取消（使用者取消或超過期限），推論在下一個解碼窗口之前停止"""
+
+
+def _check_cancelled(cancel_token: int):
+    if cancel_token and _cancel_slots is not None and cancel_token in _cancel_slots[:]:
+        raise TranscriptionCancelled("工作已取消")
+
+
+# 以下為在推論工作行程中執行的公開進入點（ProcessPoolExecutor 的 initializer 與工作），
+# 離線批次轉換與校準工具也以自己的行程池直接使用
+
+def init_worker(preload_models: tuple, progress_queue=None, cancel_slots=None, placement: Optional[CPUPlacement] = None):
+    """推論工作行程初始化：設定進度回報佇列與取消代號，並在背景預載入模型，不延遲第一個工作
+
+    有核心配置時先綁定到主要 NUMA 節點再載入模型，模型權重配置在該節點的記憶體上。
+    """
+    global _progress_queue, _cancel_slots, _placement, _home_node
+    _progress_queue = progress_queue
+    _cancel_slots = cancel_slots
+    _placement = placement
+    if placement is not None:
+        _home_node = placement.assign_node()
+        node = placement.nodes[_home_node]
+        pin_threads(node, len(node))
+        if default_engine() == "torch" and find_spec("torch") is not None:
+            configure_torch(min(placement.threads_per_job or len(node), len(node)))
+    for model in preload_models:
+        # 未指定引擎（如 "base"）時使用預設引擎
+        _registry.preload(model if ":" in model else model_key(default_engine(), model))
+
+
+def _worker_stats() -> Dict:
+    return {"pid": os.getpid(), "model_cache": _registry.stats()}
+
+
+def load_and_report(model_size: str, engine: Optional[str] = None) -> Dict:
+    """載入模型並回報同一個工作行程的狀態"""
+    _get_worker_model(model_size, engine)
+    return _worker_stats()
+
+
+# 不可並行推論的引擎（見 capabilities["thread_safe"]），同一模型以鎖序列化
+_model_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+
+def _model_lock(engine, model_size: str):
+    if engine.capabilities.get("thread_safe"):
+        return nullcontext()
+    return _model_locks[model_key(engine.name, model_size)]
+
+
+@contextmanager
+def _cpu_slot(model_size: str):
+    """本次推論綁定的核心（未啟用核心配置時為 None），結束後歸還"""
+    if _placement is None:
+        yield None
+        return
+    cpus = _placement.acquire(model_size, _home_node)
+    pin_threads(cpus, len(cpus))
+    try:
+        yield cpus
+    finally:
+        _placement.release(cpus)
+
+
+def plan_pcm_chunks(pcm_path: str, chunk_seconds: float, overlap: float) -> list:
+    """在 PCM 快取上找靜音處規劃切割區段（只讀取切點附近的樣本）"""
+    audio = open_pcm(pcm_path)
+    splits = find_split_points(audio, SAMPLE_RATE, chunk_seconds=chunk_seconds)
+    return plan_chunks(len(audio) / SAMPLE_RATE, splits, overlap=overlap)
+
+
+def run_transcription(task_id: str, pcm_path: str, model_size: str, language: str, start: float = 0.0, duration: Optional[float] = None, engine: Optional[str] = None, word_timestamps: bool = False, cancel_token: int = 0) -> Dict:
+    """在推論工作行程中執行轉換（可只處理 start 起 duration 秒），只返回可序列化的結果
+
+    cancel_token 被取消時在下一個解碼窗口之前拋出 TranscriptionCancelled（引擎需支援 progress）。
+    """
+    _check_cancelled(cancel_token)
+    engine = get_engine(engine)
+    
+    def report(frames_done: int, total_frames: int, segments: list):
+        _check_cancelled(cancel_token)
+        if _progress_queue is not None:
+            _progress_queue.put((task_id, frames_done, total_frames, segments))
+    
+    with _cpu_slot(model_size) as cpus:
+        load_wall = time.time()
+        load_start = time.perf_counter()
+        model = _get_worker_model(model_size, engine.name)
+        model_load = time.perf_counter() - load_start
+        audio = load_pcm(pcm_path, start, duration)
+        
+        with _model_lock(engine, model_size):
+            inference_wall = time.time()
+            inference_start = time.perf_counter()
+            result = engine.transcribe(model, audio, None if language == "auto" else language, report, word_timestamps=word_timestamps)
+            inference = time.perf_counter() - inference_start
+    
+    result["timings"] = {"model_load": model_load, "inference": inference, **result.get("timings", {})}
+    result["spans"] = [
+        {"name": "model_acquire", "start": load_wall, "duration": model_load, "task": task_id, "pid": os.getpid()},
+        {"name": "inference", "start": inference_wall, "duration": inference, "task": task_id, "pid": os.getpid(),
+         **({"cpus": cpus} if cpus else {})},
+    ]
+    return {**result, "worker": _worker_stats()}
+
+
+def run_language_detection(pcm_path: str, model_size: str, engine: Optional[str] = None) -> Dict:
+    """以小模型偵測 PCM 前 30 秒的語言"""
+    engine = get_engine(engine)
+    model = _get_worker_model(model_size, engine.name)
+    audio = load_pcm(pcm_path, 0.0, 30.0)
+    with _model_lock(engine, model_size):
+        started = time.perf_counter()
+        detection = engine.detect_language(model, audio)
+    return {**detection, "seconds": time.perf_counter() - started, "worker": _worker_stats()}
+
+
+def parse_model_routing(value: str) -> Dict[str, str]:
+    """MODEL_ROUTING 格式 "en=small,zh=medium,*=base"：依語言選擇模型大小，* 為其他或未知語言"""
+    routing = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        language, model_size = (part.strip() for part in item.split("=", 1))
+        if model_size not in MODEL_INFO:
+            logger.warning(f"MODEL_ROUTING 中無效的模型大小: {item}")
+            continue
+        routing[language] = model_size
+    return routing
+
+
+def route_model(routing: Dict[str, str], model_size: str, language: str) -> str:
+    """model_size 為 auto 時依路由表選擇語言對應的模型大小（未列出的語言使用 *，再沒有則為 base）"""
+    if model_size != "auto":
+        return model_size
+    return routing.get(language) or routing.get("*") or "base"
+
+
+def _run_window(audio, model_size: str, language: str, engine: Optional[str] = None, prompt: Optional[str] = None) -> Dict:
+    """即時串流：轉換一段 int16 音訊窗口（不超過 30 秒），prompt 為前一段已確定的文字"""
+    engine = get_engine(engine)
+    model = _get_worker_model(model_size, engine.name)
+    with _model_lock(engine, model_size):
+        inference_start = time.perf_counter()
+        result = engine.transcribe(
+            model, audio.astype(np.float32) / 32768.0, None if language == "auto" else language,
+            initial_prompt=prompt if engine.capabilities.get("prompt") else None
+        )
+        inference = time.perf_counter() - inference_start
+    return {
+        "language": result.get("language"),
+        "segments": result["segments"],
+        "inference": inference,
+        "worker": _worker_stats(),
+    }
+
+
+def _run_batch(pcm_paths: list, model_size: str, language: str, engine: Optional[str] = None) -> Dict:
+    """將多個不超過 30 秒的音訊以單次批次推論處理"""
+    engine = get_engine(engine)
+    with _cpu_slot(model_size):
+        load_wall = time.time()
+        load_start = time.perf_counter()
+        model = _get_worker_model(model_size, engine.name)
+        model_load = time.perf_counter() - load_start
+        audios = [load_pcm(pcm_path) for pcm_path in pcm_paths]
+        with _model_lock(engine, model_size):
+            inference_wall = time.time()
+            inference_start = time.perf_counter()
+            items = engine.transcribe_batch(model, audios, None if language == "auto" else language)
+            inference = time.perf_counter() - inference_start
+    
+    # 批次中每個音訊都記錄整個批次的耗時
+    for item in items:
+        item["timings"] = {"model_load": model_load, "inference": inference, **item.get("timings", {})}
+        item["spans"] = [
+            {"name": "model_acquire", "start": load_wall, "duration": model_load, "pid": os.getpid()},
+            {"name": "inference", "start": inference_wall, "duration": inference, "batch_size": len(items), "pid": os.getpid()},
+        ]
+    return {"items": items, "worker": _worker_stats()}
+
+
+def _add_timings(total: Dict, timings: Dict):
+    """累加各階段耗時（切段轉換時為各區段的總和）"""
+    for stage, seconds in timings.items():
+        total[stage] = total.get(stage, 0.0) + seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    """格式化時間戳記為 MM:SS"""
+    minutes = int(seconds // 60)
+    seconds = int(seconds % 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def format_result(result: Dict, include_timestamps: bool) -> str:
+    """結果文字檔內容：含時間戳記時每個句段一行"""
+    if include_timestamps and result["segments"]:
+        return "\n".join(
+            f"[{format_timestamp(s['start'])} - {format_timestamp(s['end'])}] {s['text'].strip()}"
+            for s in result["segments"]
+        )
+    return result["text"].strip()
+
+
+class WhisperService:
+    def __init__(self, file_handler: Optional[FileHandler] = None):
+        self.file_handler = file_handler or FileHandler()
+        self.preprocessor = AudioPreprocessor(self.file_handler)
+        self.num_workers = int(os.getenv("WHISPER_WORKERS", 2))
+        # process: 推論在獨立行程中執行，不受 GIL 與 torch 執行緒影響 API 事件迴圈
+        self.worker_mode = os.getenv("WHISPER_WORKER_MODE", "process")
+        self.preload_models = tuple(
+            m for m in os.getenv("WHISPER_PRELOAD_MODELS", "base").split(",") if m
+        )
+        # 超過 segment_min_seconds 的音訊在靜音處切成約 chunk_seconds 的區段並行轉換
+        self.segment_min_seconds = float(os.getenv("SEGMENT_MIN_SECONDS", 600))
+        self.chunk_seconds = chunk_seconds_setting()
+        self.chunk_overlap = float(os.getenv("CHUNK_OVERLAP_SECONDS", 1.0))
+        # 不超過一個解碼窗口（30 秒）的短音訊跨請求合併為批次推論
+        self.batcher = BatchCollector(self._run_batch)
+        self.batch_max_seconds = min(30.0, float(os.getenv("BATCH_MAX_SECONDS", 30)))
+        # 語言偵測快速路徑：language 為 auto 時先以小模型偵測前 30 秒，結果保存在檔案元資料（空字串停用）
+        self.detection_model = os.getenv("LANGUAGE_DETECTION_MODEL", "tiny")
+        self.detection_min_probability = float(os.getenv("LANGUAGE_DETECTION_MIN_PROBABILITY", 0.5))
+        # model_size 為 auto 時依語言選擇的模型大小
+        self.model_routing = parse_model_routing(os.getenv("MODEL_ROUTING", ""))
+        # 依完成工作更新的處理時間估算（即時率表保存在工作儲存中）
+        self.estimator = ProcessingTimeEstimator()
+        self._executor: Optional[Executor] = None
+        self._progress_queue = None
+        # 行程模式下在工作行程之間分配 CPU 核心（CPU_PLACEMENT）；queue_depth 由排程器提供，決定每個工作的執行緒數
+        self.placement: Optional[CPUPlacement] = None
+        self.queue_depth: Callable[[], int] = lambda: 0
+        # 取消：進行中工作的代號與已要求取消的原因，代號寫入與工作行程共享的 _cancel_slots
+        self._cancel_slots = None
+        self._cancel_index = 0
+        self._cancel_tokens = itertools.count(1)
+        self._job_tokens: Dict[str, int] = {}
+        self._cancel_requests: Dict[str, str] = {}
+        self._progress_relay: Optional[threading.Thread] = None
+        # 進行中工作的各區段解碼進度 {file_id: {task_id: 完成比例}}，完成推論後移除
+        self._job_progress: Dict[str, Dict[str, float]] = {}
+        self._job_chunks: Dict[str, int] = {}
+        # 進行中工作的即時句段排序器與待寫入的句段
+        self._sequencers: Dict[str, SegmentSequencer] = {}
+        self._segment_buffers: Dict[str, list] = {}
+        self._segment_writers: Dict[str, asyncio.Task] = {}
+        # 啟用 VAD 的工作：串接語音音訊與原始時間軸的對應
+        self._timelines: Dict[str, SpeechTimeline] = {}
+        self._status_tasks = set()
+        # 各工作行程最近一次回報的模型快取統計
+        self._worker_stats: Dict[int, Dict] = {}
+        # 背景預載入狀態：pending / loading / ready / failed
+        self.warm_up_state = "pending"
+    
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.worker_mode == "process":
+                self._progress_queue = multiprocessing.Queue()
+                self._cancel_slots = multiprocessing.Array("q", CANCEL_SLOTS, lock=False)
+                self.placement = create_cpu_placement(self.num_workers, self.worker_mode)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    initializer=init_worker,
+                    initargs=(self.preload_models, self._progress_queue, self._cancel_slots, self.placement)
+                )
+            else:
+                global _progress_queue, _cancel_slots
+                self._progress_queue = _progress_queue = queue.Queue()
+                self._cancel_slots = _cancel_slots = [0] * CANCEL_SLOTS
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_workers,
+                    thread_name_prefix="whisper-worker"
+                )
+            self._start_progress_relay(asyncio.get_running_loop())
+        return self._executor
+    
+    def _start_progress_relay(self, loop: asyncio.AbstractEventLoop):
+        """以背景執行緒將工作者的解碼進度轉交給事件迴圈"""
+        def relay():
+            while True:
+                item = self._progress_queue.get()
+                if item is None:
+                    break
+                loop.call_soon_threadsafe(self._on_progress, *item)
+        
+        self._progress_relay = threading.Thread(target=relay, name="whisper-progress-relay", daemon=True)
+        self._progress_relay.start()
+    
+    def _on_progress(self, task_id: str, frames_done: int, total_frames: int, segments: list):
+        file_id, _, chunk_index = task_id.partition(":")
+        progress_by_task = self._job_progress.get(file_id)
+        if progress_by_task is None or not total_frames:
+            # 推論已結束（或未追蹤）的遲到訊息，避免覆蓋較新的狀態
+            return
+        
+        if segments and file_id in self._sequencers:
+            self._queue_segments(file_id, self._sequencers[file_id].add(int(chunk_index or 0), segments))
+        
+        previous = int(60 * sum(progress_by_task.values()) / self._job_chunks[file_id])
+        progress_by_task[task_id] = min(1.0, frames_done / total_frames)
+        fraction = sum(progress_by_task.values()) / self._job_chunks[file_id]
+        if int(60 * fraction) <= previous:
+            return
+        
+        task = asyncio.ensure_future(self.file_handler.update_processing_status(
+            file_id, "processing", 30 + int(60 * fraction), f"語音識別中 {int(fraction * 100)}%..."
+        ))
+        self._status_tasks.add(task)
+        task.add_done_callback(self._status_tasks.discard)
+    
+    def _queue_segments(self, file_id: str, segments: list):
+        """依序將即時句段寫入結果儲存，同一工作只有一個寫入者"""
+        if not segments:
+            return
+        if file_id in self._timelines:
+            segments = self._timelines[file_id].remap_segments(segments)
+        self._segment_buffers.setdefault(file_id, []).extend(segments)
+        if file_id in self._segment_writers:
+            return
+        
+        async def writer():
+            try:
+                while self._segment_buffers.get(file_id):
+                    pending = self._segment_buffers.pop(file_id)
+                    await self.file_handler.append_segments(file_id, pending)
+            finally:
+                self._segment_writers.pop(file_id, None)
+        
+        task = asyncio.ensure_future(writer())
+        self._segment_writers[file_id] = task
+        self._status_tasks.add(task)
+        task.add_done_callback(self._status_tasks.discard)
+    
+    async def load_model(self, model_size: str, engine: Optional[str] = None):
+        """預載入模型（行程模式下其餘工作行程會於初始化時載入 WHISPER_PRELOAD_MODELS）"""
+        loop = asyncio.get_running_loop()
+        self._record_worker_stats(await loop.run_in_executor(self.executor, load_and_report, model_size, engine))
+    
+    async def warm_up(self):
+        """載入 WHISPER_PRELOAD_MODELS（"base" 或 "ctranslate2:base" 形式）並記錄工作者狀態
+
+        於啟動後在背景執行，期間服務已可接受請求；進度見 warm_up_state。
+        """
+        self.warm_up_state = "loading"
+        started = time.perf_counter()
+        try:
+            for model in self.preload_models:
+                engine, _, model_size = model.rpartition(":")
+                await self.load_model(model_size, engine or None)
+        except Exception as e:
+            self.warm_up_state = "failed"
+            logger.warning(f"模型預載入失敗: {e}")
+            return
+        self.warm_up_state = "ready"
+        logger.info(f"✅ 模型預載入完成: {', '.join(self.preload_models)} ({time.perf_counter() - started:.1f}s)")
+    
+    def _record_worker_stats(self, stats: Dict):
+        self._worker_stats[stats["pid"]] = stats["model_cache"]
+    
+    def model_cache_stats(self) -> Dict:
+        """彙總各工作行程的模型快取命中、未命中與淘汰次數"""
+        workers = dict(self._worker_stats)
+        if self.worker_mode != "process":
+            workers = {os.getpid(): _registry.stats()}
+        
+        totals = {"hits": 0, "misses": 0, "evictions": 0, "loads": 0, "load_failures": 0}
+        for stats in workers.values():
+            for key in totals:
+                totals[key] += stats.get(key, 0)
+        
+        return {"totals": totals, "workers": {str(pid): stats for pid, stats in workers.items()}}
+    
+    def is_model_loaded(self) -> bool:
+        """預載入的模型是否已常駐在至少一個推論工作者中"""
+        wanted = {m if ":" in m else model_key(default_engine(), m) for m in self.preload_models}
+        if not wanted:
+            return True
+        workers = self.model_cache_stats()["workers"].values()
+        return any(wanted & set(stats.get("resident", [])) for stats in workers)
+    
+    async def load_estimator(self):
+        """從工作儲存載入先前的即時率表"""
+        table = await self.file_handler.store.get_metadata("rtf", kind="estimator")
+        if table:
+            self.estimator.load(table)
+    
+    async def estimate(self, file_id: str, model_size: str, engine: Optional[str] = None) -> Dict:
+        """預估處理秒數與音訊長度"""
+        duration = await self.preprocessor.get_duration(file_id)
+        size = None
+        if duration is None:
+            size = (await self.file_handler.get_file_info(file_id))["size"]
+        return {
+            "duration": duration,
+            "estimated_seconds": round(self.estimator.estimate(duration, model_size, get_engine(engine).name, size), 2),
+        }
+    
+    async def _record_processing_time(self, duration: float, model_size: str, engine: str, seconds: float):
+        self.estimator.record(duration, model_size, engine, seconds)
+        try:
+            # 多個節點共用儲存時只覆寫本機的項目
+            table = await self.file_handler.store.get_metadata("rtf", kind="estimator") or {}
+            table.update(self.estimator.own_entries())
+            await self.file_handler.store.put_metadata("rtf", table, kind="estimator")
+        except Exception as e:
+            logger.warning(f"保存即時率表失敗: {e}")
+    
+    def route_model(self, model_size: str, language: str) -> str:
+        """model_size 為 auto 時依 MODEL_ROUTING 選擇語言對應的模型大小"""
+        return route_model(self.model_routing, model_size, language)
+    
+    async def detect_language(self, file_id: str, engine: Optional[str] = None) -> Optional[Dict]:
+        """以小模型偵測檔案前 30 秒的語言，結果保存於檔案元資料；停用或引擎不支援時返回 None"""
+        engine = get_engine(engine)
+        if not self.detection_model or not engine.capabilities.get("language_detection"):
+            return None
+        cached = (await self.file_handler.get_file_info(file_id)).get("detected_language")
+        if cached:
+            return cached
+        
+        pcm_path = await self.preprocessor.ensure_pcm(file_id)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self.executor, run_language_detection, pcm_path, self.detection_model, engine.name
+        )
+        self._record_worker_stats(result.pop("worker"))
+        detection = {"language": result["language"], "probability": result["probability"], "model": self.detection_model}
+        await self.file_handler.update_metadata(file_id, detected_language=detection)
+        logger.info(
+            f"語言偵測 {file_id}: {detection['language']}（{detection['probability']:.2f}，{result['seconds']:.2f}s）"
+        )
+        return detection
+    
+    async def resolve_language(self, file_id: str, language: str, engine: Optional[str] = None) -> str:
+        """language 為 auto 時返回偵測到的語言；偵測停用、失敗或信心不足時仍為 auto，由主要模型自行偵測"""
+        if language != "auto":
+            return language
+        try:
+            detection = await self.detect_language(file_id, engine)
+        except Exception as e:
+            logger.warning(f"語言偵測失敗 {file_id}: {e}")
+            return language
+        if detection and detection["probability"] >= self.detection_min_probability:
+            return detection["language"]
+        return language
+    
+    async def known_language(self, file_id: str, language: str) -> str:
+        """不解碼、不執行推論：language 為 auto 且元資料中已有足夠信心的偵測結果時返回該語言，否則原樣返回"""
+        if language != "auto":
+            return language
+        detection = (await self.file_handler.get_file_info(file_id)).get("detected_language")
+        if detection and detection["probability"] >= self.detection_min_probability:
+            return detection["language"]
+        return language
+    
+    async def run_job(self, file_id: str, model_size: str, language: str, include_timestamps: bool, **kwargs):
+        """排程器的工作執行函式：model_size 為 auto 時先偵測語言並依語言選擇模型，
+        選定的模型已有相同內容的快取結果時直接使用，否則轉換"""
+        # 從工作開始就可取消（包含語言偵測期間）
+        owns_token = self._register_job(file_id)
+        try:
+            if model_size == "auto":
+                if language == "auto":
+                    await self.file_handler.update_processing_status(file_id, "processing", 8, "偵測語言中...")
+                detected = await self.resolve_language(file_id, language, kwargs.get("engine"))
+                model_size = self.route_model(model_size, detected)
+                self._raise_if_cancelled(file_id)
+                if await self.file_handler.restore_cached_result(
+                    file_id, model_size, language, include_timestamps, kwargs.get("engine"), kwargs.get("vad", False),
+                    kwargs.get("word_timestamps", False)
+                ):
+                    await self.file_handler.update_processing_status(file_id, "completed", 100, "完成", "使用快取結果", 0.0)
+                    return None
+            return await self.transcribe(file_id, model_size, language, include_timestamps, **kwargs)
+        except TranscriptionCancelled as e:
+            # 語言偵測期間取消（轉換中的取消由 transcribe 處理）
+            reason = self._cancel_requests.get(file_id) or str(e)
+            logger.info(f"轉換已取消 {file_id}: {reason}")
+            await self.file_handler.update_processing_status(file_id, "cancelled", 0, "已取消", reason)
+            return None
+        finally:
+            if owns_token:
+                self._unregister_job(file_id)
+    
+    def fit_model(self, duration: Optional[float], model_size: str, engine: Optional[str], seconds_left: float) -> Tuple[str, Optional[float]]:
+        """不大於 model_size、預估能在 seconds_left 秒內完成的最大模型與其預估秒數（都無法如期完成時為最小的模型）"""
+        sizes = list(MODEL_INFO)
+        if model_size not in sizes:
+            return model_size, None
+        engine_name = get_engine(engine).name
+        for candidate in reversed(sizes[:sizes.index(model_size) + 1]):
+            estimated = round(self.estimator.estimate(duration, candidate, engine_name), 2)
+            if estimated <= seconds_left:
+                break
+        return candidate, estimated
+    
+    def cancel(self, file_id: str, reason: str = "已取消") -> bool:
+        """要求停止執行中的工作：推論在下一個解碼窗口之前停止（不回報進度的引擎只能在區段之間停止），狀態改為 cancelled
+
+        只有轉換進行中才記錄，返回是否已記錄；轉換已結束（或尚未開始）時不留下取消要求，之後重新轉換同一檔案不受影響。
+        """
+        token = self._job_tokens.get(file_id)
+        if token is None:
+            return False
+        self._cancel_requests[file_id] = reason
+        if self._cancel_slots is not None:
+            self._cancel_slots[self._cancel_index % CANCEL_SLOTS] = token
+            self._cancel_index += 1
+        return True
+    
+    def _update_cpu_demand(self, extra: int = 0):
+        """推論送出前更新排隊中的工作數，工作行程據此決定執行緒數"""
+        if self.placement is not None:
+            self.placement.set_queue_depth(self.queue_depth() + extra)
+    
+    def _register_job(self, file_id: str) -> bool:
+        """登記進行中的轉換（之後才能取消），清除前一次遺留的取消要求；已登記（run_job 內的 transcribe）時返回 False"""
+        if file_id in self._job_tokens:
+            return False
+        self._cancel_requests.pop(file_id, None)
+        self._job_tokens[file_id] = next(self._cancel_tokens)
+        return True
+    
+    def _unregister_job(self, file_id: str):
+        self._job_tokens.pop(file_id, None)
+        self._cancel_requests.pop(file_id, None)
+    
+    def _raise_if_cancelled(self, file_id: str):
+        if file_id in self._cancel_requests:
+            raise TranscriptionCancelled(self._cancel_requests[file_id])
+    
+    async def transcribe(self, file_id: str, model_size: str, language: str, include_timestamps: bool, engine: Optional[str] = None, vad: bool = False, word_timestamps: bool = False):
+        """執行語音轉文字並寫入結果檔案，過程中更新處理狀態（engine 未指定時使用預設引擎）
+
+        vad 為 True 時只將偵測到的語音區間送入模型，句段時間還原為原始音訊的時間；
+        word_timestamps 為 True 時句段附帶逐字時間戳記（批次推論不支援，改為單獨轉換）；
+        language 為 auto 時先以 LANGUAGE_DETECTION_MODEL 偵測語言，主要模型不需再偵測。
+        以 cancel() 取消時在下一個階段或解碼窗口之前停止，狀態改為 cancelled。
+        """
+        start_time = time.time()
+        timings: Dict[str, float] = {}
+        owns_token = self._register_job(file_id)
+        cancel_token = self._job_tokens[file_id]
+        
+        try:
+            engine = get_engine(engine)
+            await self.file_handler.update_processing_status(
+                file_id, "processing", 10, f"載入 {model_size} 模型中..."
+            )
+            # 上傳後已在背景解碼，通常可直接使用 PCM 快取
+            stage_start = time.perf_counter()
+            pcm_path = await self.preprocessor.ensure_pcm(file_id)
+            timings["preprocess"] = time.perf_counter() - stage_start
+            self._raise_if_cancelled(file_id)
+            
+            # 結果快取仍以請求的語言（可能為 auto）為鍵，decode_language 為實際送入模型的語言
+            decode_language = language
+            if language == "auto" and self.detection_model:
+                await self.file_handler.update_processing_status(
+                    file_id, "processing", 15, "偵測語言中..."
+                )
+                stage_start = time.perf_counter()
+                decode_language = await self.resolve_language(file_id, language, engine.name)
+                timings["language_detection"] = time.perf_counter() - stage_start
+            
+            vad_report = None
+            if vad:
+                await self.file_handler.update_processing_status(
+                    file_id, "processing", 20, "偵測語音區間中..."
+                )
+                stage_start = time.perf_counter()
+                pcm_path, timeline, vad_report = await self.preprocessor.speech_only(file_id, pcm_path)
+                timings["vad"] = time.perf_counter() - stage_start
+                if timeline is not None:
+                    self._timelines[file_id] = timeline
+            
+            self._raise_if_cancelled(file_id)
+            await self.file_handler.update_processing_status(
+                file_id, "processing", 30, "語音識別中..."
+            )
+            loop = asyncio.get_running_loop()
+            # 啟用 VAD 時為串接後語音的長度
+            duration = self._timelines[file_id].speech_seconds if file_id in self._timelines else pcm_duration(pcm_path)
+            await self.file_handler.reset_result(file_id)
+            self._job_progress[file_id] = {}
+            self._job_chunks[file_id] = 1
+            try:
+                if not duration:
+                    # VAD 未偵測到任何語音
+                    result = {"text": "", "language": None, "segments": []}
+                elif duration > self.segment_min_seconds and self.num_workers > 1:
+                    result = await self._transcribe_chunked(file_id, pcm_path, model_size, decode_language, engine.name, timings, word_timestamps, cancel_token)
+                elif (self.batcher.enabled and engine.capabilities.get("batching") and not word_timestamps
+                      and duration <= self.batch_max_seconds):
+                    result = await self.batcher.submit(pcm_path, model_size, decode_language, engine.name)
+                    self._queue_segments(file_id, result["segments"])
+                else:
+                    whole = {"start": 0.0, "end": float("inf"), "decode_start": 0.0}
+                    self._sequencers[file_id] = SegmentSequencer([whole])
+                    self._update_cpu_demand()
+                    result = await loop.run_in_executor(
+                        self.executor, run_transcription, file_id, pcm_path, model_size, decode_language,
+                        0.0, None, engine.name, word_timestamps, cancel_token
+                    )
+                    self._record_worker_stats(result.pop("worker"))
+                    self._queue_segments(file_id, self._sequencers[file_id].finish(0, result["segments"]))
+                _add_timings(timings, result.pop("timings", {}))
+                tracer.add_spans(file_id, result.pop("spans", []))
+                if file_id in self._timelines:
+                    result["segments"] = self._timelines[file_id].remap_segments(result["segments"])
+            finally:
+                self._timelines.pop(file_id, None)
+                self._job_progress.pop(file_id, None)
+                self._job_chunks.pop(file_id, None)
+                self._sequencers.pop(file_id, None)
+                # 等待已送出的進度更新寫完，避免覆蓋接下來的狀態
+                if self._status_tasks:
+                    await asyncio.gather(*list(self._status_tasks), return_exceptions=True)
+            self._raise_if_cancelled(file_id)
+            
+            await self.file_handler.update_processing_status(
+                file_id, "processing", 95, "儲存結果中..."
+            )
+            stage_start = time.perf_counter()
+            with tracer.span(file_id, "result_write"):
+                await self.file_handler.save_result(
+                    file_id, format_result(result, include_timestamps), result["segments"], result.get("language")
+                )
+                await self.file_handler.cache_result(
+                    file_id, model_size, language, include_timestamps, engine.name, vad, word_timestamps
+                )
+            timings["write"] = time.perf_counter() - stage_start
+            if "encode" in timings:
+                timings["decode"] = timings["inference"] - timings["encode"]
+            await self.file_handler.record_timings(file_id, timings, vad=vad_report)
+            
+            processing_time = round(time.time() - start_time, 2)
+            await self.file_handler.update_processing_status(
+                file_id, "completed", 100, "完成", "轉換完成", processing_time
+            )
+            await self.file_handler.source_produced(file_id, "completed")
+            TRANSCRIPTIONS.inc(status="completed", model=model_size, engine=engine.name)
+            TRANSCRIPTION_SECONDS.observe(processing_time, model=model_size, engine=engine.name)
+            if duration:
+                await self._record_processing_time(duration, model_size, engine.name, processing_time)
+                INFERENCE_RTF.observe(timings["inference"] / duration, model=model_size, engine=engine.name)
+            logger.info(f"轉換完成 {file_id}: {processing_time}s")
+            return result
+            
+        except TranscriptionCancelled as e:
+            reason = self._cancel_requests.get(file_id) or str(e)
+            logger.info(f"轉換已取消 {file_id}: {reason}")
+            TRANSCRIPTIONS.inc(status="cancelled", model=model_size, engine=getattr(engine, "name", engine or ""))
+            await self.file_handler.update_processing_status(
+                file_id, "cancelled", 0, "已取消", reason, round(time.time() - start_time, 2)
+            )
+            return None
+        except Exception as e:
+            logger.error(f"轉換失敗 {file_id}: {e}")
+            TRANSCRIPTIONS.inc(status="error", model=model_size, engine=getattr(engine, "name", engine or ""))
+            await self.file_handler.update_processing_status(
+                file_id, "error", 0, "錯誤", f"轉換失敗: {str(e)}", round(time.time() - start_time, 2)
+            )
+            raise
+        finally:
+            if owns_token:
+                self._unregister_job(file_id)
+    
+    async def _transcribe_chunked(self, file_id: str, pcm_path: str, model_size: str, language: str, engine: str, timings: Dict, word_timestamps: bool = False, cancel_token: int = 0) -> Dict:
+        """將長音訊切段後分派到工作池並行轉換，再依時間位移拼接"""
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(
+            self.executor, plan_pcm_chunks, pcm_path, self.chunk_seconds, self.chunk_overlap
+        )
+        logger.info(f"長音訊切割 {file_id}: {len(chunks)} 個區段")
+        self._job_chunks[file_id] = len(chunks)
+        sequencer = self._sequencers[file_id] = SegmentSequencer(chunks)
+        # 其他區段也在等待工作者，每個區段分到的執行緒較少
+        self._update_cpu_demand(len(chunks) - 1)
+        
+        async def run_chunk(index: int, chunk: Dict):
+            result = await loop.run_in_executor(
+                self.executor, run_transcription, f"{file_id}:{index}", pcm_path, model_size, language,
+                chunk["decode_start"], chunk["decode_duration"], engine, word_timestamps, cancel_token
+            )
+            self._record_worker_stats(result.pop("worker"))
+            _add_timings(timings, result.pop("timings", {}))
+            tracer.add_spans(file_id, result.pop("spans", []))
+            self._queue_segments(file_id, sequencer.finish(index, result["segments"]))
+            return chunk, result
+        
+        tasks = [asyncio.ensure_future(run_chunk(i, chunk)) for i, chunk in enumerate(chunks)]
+        try:
+            chunk_results = await asyncio.gather(*tasks)
+        except BaseException:
+            # 一個區段失敗或取消時，尚未開始的區段不再執行
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return stitch_segments(list(chunk_results))
+    
+    async def transcribe_window(self, audio: np.ndarray, model_size: str, language: str, engine: Optional[str] = None, prompt: Optional[str] = None) -> Dict:
+        """即時串流的單一窗口轉換，在推論工作池中執行並重用已載入的模型（不經過轉換佇列）"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, _run_window, audio, model_size, language, engine, prompt)
+        self._record_worker_stats(result.pop("worker"))
+        return result
+    
+    async def _run_batch(self, pcm_paths: list, model_size: str, language: str, engine: str) -> list:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, _run_batch, pcm_paths, model_size, language, engine)
+        self._record_worker_stats(result["worker"])
+        return result["items"]
+    
+    def shutdown(self):
+        """關閉推論工作池、解碼工作池與進度轉交執行緒"""
+        self.preprocessor.shutdown()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._progress_relay is not None:
+            self._progress_queue.put(None)
+            self._progress_relay.join(timeout=1)
+            self._progress_relay = None
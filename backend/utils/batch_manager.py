@@ -0,0 +1,160 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from .file_handler import FileHandler
+from .job_queue import QueueFullError, SchedulerUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+class BatchPathError(ValueError):
+    """批次路徑不在允許的目錄內或不存在"""
+
+
+def walk_media_files(root: str, extensions: Iterable[str]) -> List[str]:
+    """依名稱順序列出目錄下（含子目錄）副檔名符合的檔案"""
+    extensions = {ext.lower() for ext in extensions}
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                found.append(os.path.join(dirpath, filename))
+    return found
+
+
+class BatchManager:
+    """批次轉換：記錄批次內的檔案，依佇列空間逐一匯入並送入排程器
+
+    佇列已滿時等待後重試，數千個檔案的批次不會被 JOB_QUEUE_SIZE 拒絕；
+    伺服器端路徑需位於 BATCH_INPUT_DIR 之下。
+    """
+
+    def __init__(
+        self,
+        file_handler: FileHandler,
+        start_job: Callable[[str, Dict], Awaitable[Dict]],
+        on_import: Optional[Callable[[str], None]] = None,
+        input_dir: Optional[str] = None,
+        max_files: Optional[int] = None,
+        retry_interval: float = 1.0,
+    ):
+        self.file_handler = file_handler
+        self.start_job = start_job
+        self.on_import = on_import
+        input_dir = input_dir or os.getenv("BATCH_INPUT_DIR")
+        self.input_dir = os.path.realpath(input_dir) if input_dir else None
+        self.max_files = max_files or int(os.getenv("BATCH_MAX_FILES", 10000))
+        self.retry_interval = retry_interval
+        self._feeders: Dict[str, asyncio.Task] = {}
+
+    def resolve_paths(self, paths: List[str], extensions: Iterable[str]) -> List[str]:
+        """將請求中的檔案或目錄展開為檔案列表（相對路徑以 BATCH_INPUT_DIR 為基準）"""
+        if not self.input_dir:
+            raise PermissionError("未設定 BATCH_INPUT_DIR，不接受伺服器端路徑")
+
+        extensions = {ext.lower() for ext in extensions}
+        resolved = []
+        for path in paths:
+            real_path = os.path.realpath(os.path.join(self.input_dir, path))
+            if os.path.commonpath([real_path, self.input_dir]) != self.input_dir:
+                raise BatchPathError(f"路徑不在允許的目錄內: {path}")
+            if os.path.isdir(real_path):
+                resolved.extend(walk_media_files(real_path, extensions))
+            elif os.path.isfile(real_path):
+                if os.path.splitext(real_path)[1].lower() not in extensions:
+                    raise BatchPathError(f"不支援的檔案格式: {path}")
+                resolved.append(real_path)
+            else:
+                raise BatchPathError(f"路徑不存在: {path}")
+
+        # 目錄與其中的檔案同時列出時只轉換一次
+        resolved = list(dict.fromkeys(resolved))
+        if len(resolved) > self.max_files:
+            raise BatchPathError(f"批次檔案數超過 {self.max_files} 個上限")
+        return resolved
+
+    async def create(self, sources: List[Dict], options: Dict) -> Dict:
+        """建立批次並在背景依序送入排程器
+
+        sources 為 [{"file_id": ..., "filename": ..., "path": 伺服器端路徑（已上傳者不需要）}, ...]
+        """
+        batch_id = str(uuid.uuid4())
+        record = {
+            "batch_id": batch_id,
+            "created_at": time.time(),
+            "options": options,
+            "files": [{**source, "file_id": source.get("file_id") or str(uuid.uuid4())} for source in sources],
+        }
+        await self.file_handler.store.put_metadata(batch_id, record, kind="batch")
+
+        task = asyncio.ensure_future(self._feed(record))
+        self._feeders[batch_id] = task
+        task.add_done_callback(lambda _: self._feeders.pop(batch_id, None))
+        logger.info(f"建立批次 {batch_id}: {len(record['files'])} 個檔案")
+        return record
+
+    async def _feed(self, record: Dict):
+        for item in record["files"]:
+            file_id = item["file_id"]
+            try:
+                if item.get("path"):
+                    await self.file_handler.import_file(item["path"], file_id)
+                    if self.on_import:
+                        self.on_import(file_id)
+                while True:
+                    try:
+                        await self.start_job(file_id, record["options"])
+                    except (QueueFullError, SchedulerUnavailableError):
+                        await asyncio.sleep(self.retry_interval)
+                        continue
+                    except ValueError:
+                        # 同一檔案已在佇列或處理中，不覆寫其狀態
+                        logger.info(f"批次 {record['batch_id']} 的檔案已在處理中: {file_id}")
+                    break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"批次 {record['batch_id']} 的檔案送出失敗 {item.get('path') or file_id}: {e}")
+                await self.file_handler.update_processing_status(
+                    file_id, "error", 0, "錯誤", f"送出轉換失敗: {str(e)}"
+                )
+
+    async def get(self, batch_id: str) -> Optional[Dict]:
+        """批次內各檔案的狀態與彙總（尚未送入排程器的檔案為 waiting）"""
+        record = await self.file_handler.store.get_metadata(batch_id, kind="batch")
+        if record is None:
+            return None
+
+        files = []
+        summary: Dict[str, int] = {}
+        for item in record["files"]:
+            status = await self.file_handler.store.get_status(item["file_id"]) or {"status": "waiting", "progress": 0}
+            summary[status["status"]] = summary.get(status["status"], 0) + 1
+            files.append({
+                "file_id": item["file_id"],
+                "filename": item["filename"],
+                "status": status["status"],
+                "progress": status.get("progress", 0),
+                "message": status.get("message", ""),
+            })
+
+        finished = summary.get("completed", 0) + summary.get("error", 0) + summary.get("cancelled", 0)
+        return {
+            "batch_id": batch_id,
+            "created_at": record["created_at"],
+            "total": len(files),
+            "finished": finished,
+            "done": finished == len(files),
+            "summary": summary,
+            "files": files,
+        }
+
+    async def shutdown(self):
+        for task in list(self._feeders.values()):
+            task.cancel()
+        if self._feeders:
+            await asyncio.gather(*self._feeders.values(), return_exceptions=True)
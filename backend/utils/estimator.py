@@ -0,0 +1,92 @@
+import os
+import socket
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 沒有歷史資料時的即時率（處理秒數 / 音訊秒數），以 CPU 上的 openai-whisper 為準
+DEFAULT_RTF = {
+    "tiny": 0.05,
+    "base": 0.1,
+    "small": 0.3,
+    "medium": 0.8,
+    "large": 1.6,
+}
+# 各推論引擎相對於 torch 的速度比例
+ENGINE_RTF_SCALE = {
+    "torch": 1.0,
+    "ctranslate2": 0.3,
+    "onnx": 0.6,
+}
+# 無法取得音訊長度時，以 128 kbps 由檔案大小推算
+FALLBACK_BYTES_PER_SECOND = 16000
+
+
+class ProcessingTimeEstimator:
+    """依音訊長度與 (主機, 引擎, 模型) 的即時率表估算處理時間，完成的工作會即時更新即時率
+
+    估計值 = overhead + rtf × 音訊長度；rtf 以指數移動平均更新，前幾筆資料以一般平均收斂。
+    """
+
+    def __init__(self, host: Optional[str] = None, alpha: Optional[float] = None, overhead: Optional[float] = None):
+        self.host = host or socket.gethostname()
+        self.alpha = alpha or float(os.getenv("ESTIMATOR_ALPHA", 0.2))
+        # 模型已載入時的固定開銷（讀取 PCM、寫入結果等）
+        self.overhead = overhead if overhead is not None else float(os.getenv("ESTIMATOR_OVERHEAD_SECONDS", 1.0))
+        self._lock = threading.Lock()
+        self._table: Dict[str, Dict] = {}
+
+    def _key(self, model_size: str, engine: str) -> str:
+        return f"{self.host}|{engine}|{model_size}"
+
+    def rtf(self, model_size: str, engine: str = "torch") -> float:
+        """本機的即時率；本機沒有資料時（如不執行推論的 API 節點）使用其他主機的平均"""
+        suffix = f"|{engine}|{model_size}"
+        with self._lock:
+            entry = self._table.get(self._key(model_size, engine))
+            others = [other["rtf"] for key, other in self._table.items() if key.endswith(suffix)]
+        if entry is not None:
+            return entry["rtf"]
+        if others:
+            return sum(others) / len(others)
+        return DEFAULT_RTF.get(model_size, 1.0) * ENGINE_RTF_SCALE.get(engine, 1.0)
+
+    def estimate(self, duration: Optional[float], model_size: str, engine: str = "torch", size: Optional[int] = None) -> float:
+        """預估處理秒數（不含排隊）；duration 未知時由檔案大小推算"""
+        if not duration:
+            duration = (size or 0) / FALLBACK_BYTES_PER_SECOND
+        return max(0.5, self.overhead + self.rtf(model_size, engine) * duration)
+
+    def record(self, duration: float, model_size: str, engine: str, seconds: float):
+        """以完成工作的實際處理時間更新即時率"""
+        if not duration or duration <= 0:
+            return
+        observed = max(0.0, seconds - self.overhead) / duration
+        key = self._key(model_size, engine)
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is None:
+                entry = self._table[key] = {"rtf": observed, "samples": 0}
+            samples = entry["samples"] + 1
+            weight = max(self.alpha, 1.0 / samples)
+            entry["rtf"] = round(entry["rtf"] + weight * (observed - entry["rtf"]), 5)
+            entry["samples"] = samples
+
+    def own_entries(self) -> Dict[str, Dict]:
+        """本機的即時率表（寫回共用儲存時只覆寫本機的項目）"""
+        prefix = f"{self.host}|"
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._table.items() if key.startswith(prefix)}
+
+    def load(self, table: Dict[str, Dict]):
+        """載入先前保存的即時率表"""
+        with self._lock:
+            for key, entry in table.items():
+                if "rtf" in entry:
+                    self._table[key] = dict(entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._table.items()}
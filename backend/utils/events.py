@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "error", "cancelled"}
+
+
+class EventBroker:
+    """行程內的處理狀態發布/訂閱，供 SSE 推送使用（需在事件迴圈執行緒中呼叫）"""
+
+    def __init__(self, max_queue_size: int = 16):
+        self.max_queue_size = max_queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._latest: Dict[str, Dict] = {}
+
+    def publish(self, file_id: str, event: Dict):
+        """發布事件；訂閱者來不及消化時丟棄最舊的事件，只保證拿到最新狀態"""
+        if event.get("status") in TERMINAL_STATUSES:
+            self._latest.pop(file_id, None)
+        else:
+            self._latest[file_id] = event
+
+        for queue in self._subscribers.get(file_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def subscribe(self, file_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._subscribers[file_id].add(queue)
+        return queue
+
+    def unsubscribe(self, file_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(file_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[file_id]
+
+    def latest(self, file_id: str) -> Optional[Dict]:
+        """最近一次的非終止狀態"""
+        return self._latest.get(file_id)
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
@@ -1,45 +1,389 @@
 import os
+import json
+import time
 import uuid
+import asyncio
+import hashlib
 import aiofiles
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Optional, Dict
+from typing import AsyncIterator, Callable, Optional, Dict, List, Set, Tuple
 import logging
 from fastapi import UploadFile
+from .result_cache import TranscriptCache
+from .events import EventBroker
+from .job_store import JobStore, create_job_store
+from .metrics import UPLOAD_BYTES
+from .tracing import tracer
+from .formats import OUTPUT_FORMATS, render
 
 logger = logging.getLogger(__name__)
 
+
+class FileTooLargeError(ValueError):
+    """上傳檔案超過大小限制"""
+
+
+class UploadOffsetError(ValueError):
+    """續傳區段的起始位置與已接收的位元組數不符"""
+
+    def __init__(self, expected_offset: int, received_offset: int):
+        super().__init__(f"續傳位置不符: 預期 {expected_offset}，收到 {received_offset}")
+        self.expected_offset = expected_offset
+        self.received_offset = received_offset
+
+
+class UploadRangeError(ValueError):
+    """續傳區段的 Content-Range 與工作階段或實際收到的位元組數不符"""
+
+
+def shard_path(root: str, key: str, filename: str) -> str:
+    """依鍵的前兩個字元分散到子目錄（root/ab/filename），單一目錄不會累積數十萬個檔案"""
+    return os.path.join(root, key[:2], filename)
+
+
+# 句段索引每個項目的位元組數
+SEGMENT_INDEX_WIDTH = 8
+
+
+def segment_line(segment: Dict) -> str:
+    """句段檔的一行（JSON Lines，不含多餘空白）"""
+    return json.dumps(segment, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def text_counts(text: str) -> Dict:
+    """字數（非空白字元數）與字元數"""
+    return {"word_count": len("".join(text.split())), "char_count": len(text)}
+
+
 class FileHandler:
     def __init__(self):
         self.upload_dir = os.getenv("UPLOAD_DIR", "../uploads")
         self.result_dir = os.getenv("RESULT_DIR", "../results")
         self.max_file_size = int(os.getenv("MAX_FILE_SIZE", 500 * 1024 * 1024))
+        self.chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
         
         os.makedirs(self.upload_dir, exist_ok=True)
         os.makedirs(self.result_dir, exist_ok=True)
+        
+        # 來源媒體刪除時機：never（保留）、decoded（已解碼為 PCM）、completed（已產生結果）
+        self.delete_source_after = os.getenv("DELETE_SOURCE_AFTER", "never")
+        
+        self.transcript_cache = TranscriptCache(self.result_dir)
+        self.events = EventBroker()
+        self.store: JobStore = create_job_store(self.upload_dir)
+        # 結果最近被讀取的時間，由定期清理寫回元資料（LRU 淘汰依據）
+        self.accessed: Dict[str, float] = {}
+        
+        # 所有檔案系統操作（含 aiofiles）都在此有界執行緒池中執行：儲存位於網路磁碟而變慢時
+        # 不阻塞事件迴圈，也不會佔滿預設執行緒池影響其他背景工作
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("FILE_IO_THREADS", 8)), thread_name_prefix="file-io"
+        )
+        # 檔案 stat 結果的短期快取（含不存在），本行程的寫入與刪除會立即使其失效；
+        # 其他行程的變更最多延遲 STAT_CACHE_SECONDS 才會看到
+        self.stat_cache_seconds = float(os.getenv("STAT_CACHE_SECONDS", 2.0))
+        self._stat_cache: Dict[str, Tuple[float, Optional[os.stat_result]]] = {}
+        self._known_dirs: Set[str] = set()
+        # 每個續傳工作階段一把鎖：重試與仍在進行的上傳不會同時通過位置檢查而重複附加
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+    
+    async def _io(self, func: Callable, *args, **kwargs):
+        """在檔案 I/O 執行緒池中執行阻塞的檔案系統呼叫"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, partial(func, *args, **kwargs))
     
-    async def save_upload(self, file: UploadFile, file_content: bytes) -> str:
-        """保存上傳的檔案"""
+    def _open(self, path: str, mode: str = 'r', **kwargs):
+        return aiofiles.open(path, mode, executor=self.io_executor, **kwargs)
+    
+    async def _stat(self, path: str) -> Optional[os.stat_result]:
+        now = time.monotonic()
+        cached = self._stat_cache.get(path)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        try:
+            stat = await self._io(os.stat, path)
+        except FileNotFoundError:
+            stat = None
+        if len(self._stat_cache) >= 10000:
+            self._stat_cache.clear()
+        self._stat_cache[path] = (now + self.stat_cache_seconds, stat)
+        return stat
+    
+    async def _exists(self, path: str) -> bool:
+        return await self._stat(path) is not None
+    
+    def _invalidate(self, *paths: str):
+        """使 stat 快取失效（未指定路徑時清除全部）"""
+        if not paths:
+            self._stat_cache.clear()
+        for path in paths:
+            self._stat_cache.pop(path, None)
+    
+    async def _ensure_dir(self, path: str):
+        """建立檔案所在的目錄（分散子目錄只建立一次）"""
+        directory = os.path.dirname(path)
+        if directory not in self._known_dirs:
+            await self._io(os.makedirs, directory, exist_ok=True)
+            self._known_dirs.add(directory)
+    
+    async def _replace(self, source: str, path: str):
+        await self._io(os.replace, source, path)
+        self._invalidate(source, path)
+    
+    async def _remove_if_exists(self, path: str):
+        self._invalidate(path)
+        try:
+            await self._io(os.remove, path)
+        except FileNotFoundError:
+            pass
+    
+    async def _stored_path(self, file_id: str, file_extension: str) -> Tuple[str, str]:
+        """新上傳檔案的存放名稱（相對於上傳目錄）與完整路徑"""
+        file_path = shard_path(self.upload_dir, file_id, f"{file_id}{file_extension}")
+        await self._ensure_dir(file_path)
+        return os.path.relpath(file_path, self.upload_dir), file_path
+    
+    async def save_upload(self, file: UploadFile) -> str:
+        """以固定大小的區塊串流保存上傳的檔案"""
         
         file_id = str(uuid.uuid4())
         file_extension = Path(file.filename).suffix
-        stored_filename = f"{file_id}{file_extension}"
-        file_path = os.path.join(self.upload_dir, stored_filename)
+        stored_filename, file_path = await self._stored_path(file_id, file_extension)
+        
+        file_size = 0
+        hasher = hashlib.sha256()
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            async with self._open(file_path, 'wb') as f:
+                while True:
+                    chunk = await file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    file_size += len(chunk)
+                    UPLOAD_BYTES.inc(len(chunk))
+                    if file_size > self.max_file_size:
+                        raise FileTooLargeError(f"檔案大小超過 {self.max_file_size // (1024 * 1024)}MB 限制")
+                    hasher.update(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            # 寫入中斷時不留下半個檔案
+            await self._remove_if_exists(file_path)
+            raise
         
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_content)
+        content_hash = hasher.hexdigest()
+        stored_filename = await self._dedupe_upload(stored_filename, content_hash)
         
         metadata = {
             "original_filename": file.filename,
             "stored_filename": stored_filename,
-            "file_size": len(file_content),
+            "file_size": file_size,
             "file_extension": file_extension,
+            "content_hash": content_hash,
+            "created_at": time.time(),
+        }
+        
+        await self._save_metadata(file_id, metadata)
+        tracer.record(file_id, "upload_write", started_at, time.perf_counter() - started, bytes=file_size)
+        
+        logger.info(f"檔案已保存: {file.filename} -> {file_id} ({file_size} bytes)")
+        return file_id
+    
+    async def create_upload_session(self, filename: str, file_size: int) -> Dict:
+        """建立可續傳的分段上傳工作階段"""
+        if file_size > self.max_file_size:
+            raise FileTooLargeError(f"檔案大小超過 {self.max_file_size // (1024 * 1024)}MB 限制")
+        
+        session_id = str(uuid.uuid4())
+        session = {
+            "session_id": session_id,
+            "original_filename": filename,
+            "file_extension": Path(filename).suffix,
+            "file_size": file_size,
         }
+        await self._save_metadata(session_id, session, kind="session")
+        
+        await self._ensure_dir(self._session_part_path(session_id))
+        # 建立空的暫存檔，已接收的位元組數以暫存檔大小為準
+        async with self._open(self._session_part_path(session_id), 'wb'):
+            pass
+        
+        logger.info(f"建立上傳工作階段: {filename} -> {session_id} ({file_size} bytes)")
+        return {**session, "offset": 0}
+    
+    async def get_upload_session(self, session_id: str) -> Optional[Dict]:
+        """獲取上傳工作階段與目前已接收的位元組數"""
+        session = await self._load_metadata(session_id, kind="session")
+        if not session:
+            return None
+        # 續傳位置必須是實際大小，不使用 stat 快取
+        try:
+            stat = await self._io(os.stat, self._session_part_path(session_id))
+        except FileNotFoundError:
+            return None
+        
+        return {**session, "offset": stat.st_size}
+    
+    def _session_lock(self, session_id: str) -> asyncio.Lock:
+        return self._session_locks.setdefault(session_id, asyncio.Lock())
+    
+    async def append_upload_chunk(self, session_id: str, start: int, end: int, total: int, stream: AsyncIterator[bytes]) -> Dict:
+        """將 Content-Range: bytes start-end/total 的區段串流附加到工作階段的暫存檔
         
+        同一工作階段的寫入依序進行，取得鎖之後才以暫存檔的實際大小檢查起始位置。
+        收到的位元組數與區段長度不符時，暫存檔截回 start 並拋出 UploadRangeError。
+        """
+        async with self._session_lock(session_id):
+            session = await self.get_upload_session(session_id)
+            if not session:
+                raise FileNotFoundError(f"上傳工作階段不存在: {session_id}")
+            
+            offset = session["offset"]
+            if start != offset:
+                raise UploadOffsetError(offset, start)
+            if total != session["file_size"]:
+                raise UploadRangeError(f"總長度 {total} 與宣告的檔案大小 {session['file_size']} 不符")
+            if end < start:
+                raise UploadRangeError(f"無效的區段範圍: {start}-{end}")
+            if end >= session["file_size"]:
+                raise FileTooLargeError("區段超出宣告的檔案大小")
+            
+            part_path = self._session_part_path(session_id)
+            range_end = end + 1
+            with tracer.span(session_id, "upload_write", offset=start):
+                try:
+                    async with self._open(part_path, 'ab') as f:
+                        try:
+                            async for chunk in stream:
+                                if offset + len(chunk) > range_end:
+                                    raise UploadRangeError(f"收到的位元組數超過區段 {start}-{end}")
+                                await f.write(chunk)
+                                offset += len(chunk)
+                                UPLOAD_BYTES.inc(len(chunk))
+                        finally:
+                            # 連線中斷時保留已寫入的部分，讓用戶端從新位置續傳
+                            await f.flush()
+                    if offset != range_end:
+                        raise UploadRangeError(f"收到 {offset - start} 個位元組，與區段 {start}-{end} 不符")
+                except UploadRangeError:
+                    await self._io(os.truncate, part_path, start)
+                    raise
+        
+        return {**session, "offset": offset}
+    
+    async def complete_upload_session(self, session_id: str) -> str:
+        """完成上傳工作階段，轉為一般上傳檔案並返回檔案 ID"""
+        async with self._session_lock(session_id):
+            session = await self.get_upload_session(session_id)
+            if not session:
+                raise FileNotFoundError(f"上傳工作階段不存在: {session_id}")
+            
+            if session["offset"] != session["file_size"]:
+                raise UploadOffsetError(session["file_size"], session["offset"])
+            
+            file_id = session_id
+            stored_filename, file_path = await self._stored_path(file_id, session["file_extension"])
+            await self._replace(self._session_part_path(session_id), file_path)
+        self._session_locks.pop(session_id, None)
+        
+        content_hash = await self._io(self._hash_file, file_path)
+        stored_filename = await self._dedupe_upload(stored_filename, content_hash)
+        
+        metadata = {
+            "original_filename": session["original_filename"],
+            "stored_filename": stored_filename,
+            "file_size": session["file_size"],
+            "file_extension": session["file_extension"],
+            "content_hash": content_hash,
+            "created_at": time.time(),
+        }
         await self._save_metadata(file_id, metadata)
+        await self.store.delete_metadata(session_id, kind="session")
         
-        logger.info(f"檔案已保存: {file.filename} -> {file_id}")
+        logger.info(f"續傳上傳完成: {session['original_filename']} -> {file_id}")
         return file_id
     
+    async def import_file(self, source_path: str, file_id: Optional[str] = None) -> str:
+        """將伺服器上的檔案匯入為上傳檔案（同一檔案系統時以硬連結匯入，不複製內容），返回檔案 ID"""
+        file_size = (await self._io(os.stat, source_path)).st_size
+        if file_size > self.max_file_size:
+            raise FileTooLargeError(f"檔案大小超過 {self.max_file_size // (1024 * 1024)}MB 限制")
+
+        file_id = file_id or str(uuid.uuid4())
+        file_extension = Path(source_path).suffix
+        stored_filename, file_path = await self._stored_path(file_id, file_extension)
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self._io(os.link, source_path, file_path)
+        except OSError:
+            import shutil
+            await self._io(shutil.copyfile, source_path, file_path)
+        self._invalidate(file_path)
+
+        content_hash = await self._io(self._hash_file, file_path)
+        stored_filename = await self._dedupe_upload(stored_filename, content_hash)
+
+        metadata = {
+            "original_filename": os.path.basename(source_path),
+            "stored_filename": stored_filename,
+            "file_size": file_size,
+            "file_extension": file_extension,
+            "content_hash": content_hash,
+            "source_path": source_path,
+            "created_at": time.time(),
+        }
+        await self._save_metadata(file_id, metadata)
+        tracer.record(file_id, "upload_write", started_at, time.perf_counter() - started, bytes=file_size)
+
+        logger.info(f"檔案已匯入: {source_path} -> {file_id} ({file_size} bytes)")
+        return file_id
+
+    def _session_part_path(self, session_id: str) -> str:
+        return shard_path(self.upload_dir, session_id, f"{session_id}.part")
+
+    async def session_part_stat(self, session_id: str) -> Optional[os.stat_result]:
+        """續傳工作階段暫存檔的狀態（尚未寫入時為 None）"""
+        try:
+            return await self._io(os.stat, self._session_part_path(session_id))
+        except FileNotFoundError:
+            return None
+
+    async def remove_session(self, session_id: str):
+        """刪除續傳工作階段的暫存檔與紀錄"""
+        await self._remove_if_exists(self._session_part_path(session_id))
+        await self.store.delete_metadata(session_id, kind="session")
+        self._session_locks.pop(session_id, None)
+    
+    def _hash_file(self, file_path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    async def _dedupe_upload(self, stored_filename: str, content_hash: str) -> str:
+        """內容相同的檔案已存在時，以硬連結（或直接引用）取代新寫入的副本，返回實際存放的檔名"""
+        file_path = os.path.join(self.upload_dir, stored_filename)
+        existing = await self._load_metadata(content_hash, kind="content")
+        existing_path = existing and os.path.join(self.upload_dir, existing["stored_filename"])
+        
+        if not existing_path or not await self._exists(existing_path):
+            await self._save_metadata(content_hash, {"stored_filename": stored_filename}, kind="content")
+            return stored_filename
+        
+        await self._remove_if_exists(file_path)
+        try:
+            await self._io(os.link, existing_path, file_path)
+        except OSError:
+            # 檔案系統不支援硬連結時直接引用既有檔案
+            stored_filename = existing["stored_filename"]
+        
+        logger.info(f"重複上傳，重用既有檔案: {existing['stored_filename']}")
+        return stored_filename
+    
     async def get_file_info(self, file_id: str) -> Dict:
         """獲取檔案資訊"""
         metadata = await self._load_metadata(file_id)
@@ -47,34 +391,336 @@ class FileHandler:
         if not metadata:
             raise FileNotFoundError(f"檔案不存在: {file_id}")
         
-        file_size_mb = metadata["file_size"] / (1024 * 1024)
-        estimated_time = max(0.5, file_size_mb / 10)
-        
         return {
             "filename": metadata["original_filename"],
             "size": metadata["file_size"],
-            "estimated_processing_time": round(estimated_time, 1)
+            "duration": metadata.get("duration"),
+            "detected_language": metadata.get("detected_language")
         }
     
     async def file_exists(self, file_id: str) -> bool:
-        """檢查檔案是否存在"""
+        """檢查檔案是否存在（來源媒體已刪除但 PCM 快取仍在時也可轉換）"""
         metadata = await self._load_metadata(file_id)
         if not metadata:
             return False
         
         file_path = os.path.join(self.upload_dir, metadata["stored_filename"])
-        return os.path.exists(file_path)
+        return await self._exists(file_path) or await self._exists(self._pcm_path(file_id, metadata))
+    
+    def _result_path(self, file_id: str) -> str:
+        return shard_path(self.result_dir, file_id, f"{file_id}_text.txt")
+    
+    async def _existing_result_path(self, file_id: str) -> Optional[str]:
+        """結果檔案路徑（含分散子目錄前的舊版位置），不存在時返回 None"""
+        for path in (self._result_path(file_id), os.path.join(self.result_dir, f"{file_id}_text.txt")):
+            if await self._exists(path):
+                return path
+        return None
     
     async def get_result_file(self, file_id: str) -> str:
         """獲取結果檔案路徑"""
-        result_filename = f"{file_id}_text.txt"
-        result_path = os.path.join(self.result_dir, result_filename)
+        result_path = await self._existing_result_path(file_id)
+        if result_path is None:
+            raise FileNotFoundError(f"結果檔案不存在: {file_id}_text.txt")
+        
+        self.accessed[file_id] = time.time()
+        return result_path
+    
+    async def read_result(self, file_id: str) -> str:
+        """讀取結果文字"""
+        async with self._open(await self.get_result_file(file_id), 'r', encoding='utf-8') as f:
+            return await f.read()
+    
+    async def stat_file(self, file_path: str) -> os.stat_result:
+        """檔案目前的 stat（不使用快取），供下載回應設定 Content-Length 與 ETag"""
+        return await self._io(os.stat, file_path)
+    
+    async def save_result(self, file_id: str, text: str, segments: Optional[List[Dict]] = None, language: Optional[str] = None) -> str:
+        """保存轉換結果文字檔（先寫暫存檔再替換，避免改寫與快取共用的硬連結內容）"""
+        result_path = self._result_path(file_id)
+        await self._ensure_dir(result_path)
+        tmp_path = f"{result_path}.tmp"
+        async with self._open(tmp_path, 'w', encoding='utf-8') as f:
+            await f.write(text)
+        await self._replace(tmp_path, result_path)
         
-        if not os.path.exists(result_path):
-            raise FileNotFoundError(f"結果檔案不存在: {result_filename}")
+        stats = text_counts(text)
+        if segments is not None:
+            # 以最終句段覆寫即時寫入的句段檔，確保兩者一致；替換期間讀取者沒有索引時從頭讀取
+            segments_path = self._segments_path(file_id)
+            lines = [segment_line(s) for s in segments]
+            async with self._open(f"{segments_path}.tmp", 'w', encoding='utf-8') as f:
+                await f.write("".join(lines))
+            await self._remove_if_exists(self._segment_index_path(file_id))
+            await self._replace(f"{segments_path}.tmp", segments_path)
+            await self._io(self._append_segment_index, file_id, lines)
+            stats["segment_count"] = len(segments)
+            stats["word_timestamps"] = any("words" in s for s in segments)
+        else:
+            stats["segment_count"] = (await self.get_result_stats(file_id)).get("segment_count", 0)
+        if language:
+            stats["language"] = language
+        await self.store.put_metadata(file_id, stats, kind="result")
+        await self._clear_outputs(file_id)
         
         return result_path
     
+    async def record_timings(self, file_id: str, timings: Dict[str, float], vad: Optional[Dict] = None):
+        """記錄轉換各階段耗時（秒）與 VAD 略過的音訊，與結果統計一起保存"""
+        stats = await self.get_result_stats(file_id)
+        stats["timings"] = {stage: round(seconds, 4) for stage, seconds in timings.items()}
+        if vad is not None:
+            stats["vad"] = vad
+        await self.store.put_metadata(file_id, stats, kind="result")
+    
+    def _segments_path(self, file_id: str) -> str:
+        return shard_path(self.result_dir, file_id, f"{file_id}_segments.jsonl")
+
+    def _segment_index_path(self, file_id: str) -> str:
+        """句段索引：每個句段在句段檔中的起始位元組（8 位元組 little-endian），輪詢時直接跳到第 after 個句段"""
+        return shard_path(self.result_dir, file_id, f"{file_id}_segments.idx")
+    
+    def _append_segment_index(self, file_id: str, lines: List[str], offset: int = 0):
+        """句段寫入句段檔之後，附加其起始位元組到索引（offset 為第一行的起始位元組）"""
+        entries = bytearray()
+        for line in lines:
+            entries += offset.to_bytes(SEGMENT_INDEX_WIDTH, "little")
+            offset += len(line.encode('utf-8'))
+        with open(self._segment_index_path(file_id), 'ab') as f:
+            f.write(entries)
+    
+    async def reset_result(self, file_id: str):
+        """開始新的轉換前清除上一次的即時句段與統計"""
+        await self._ensure_dir(self._segments_path(file_id))
+        await self._remove_if_exists(self._segments_path(file_id))
+        await self._remove_if_exists(self._segment_index_path(file_id))
+        await self._clear_outputs(file_id)
+        await self.store.put_metadata(file_id, {"segment_count": 0, "word_count": 0, "char_count": 0}, kind="result")
+    
+    async def append_segments(self, file_id: str, segments: List[Dict]):
+        """附加轉換中產生的句段，並同步更新統計，讀取時不需重新計算"""
+        segments_path = self._segments_path(file_id)
+        lines = [segment_line(s) for s in segments]
+        # 同一工作只有一個寫入者，附加前的檔案大小即為第一個新句段的起始位元組
+        self._invalidate(segments_path)
+        stat = await self._stat(segments_path)
+        async with self._open(segments_path, 'a', encoding='utf-8') as f:
+            await f.write("".join(lines))
+        await self._io(self._append_segment_index, file_id, lines, stat.st_size if stat else 0)
+        self._invalidate(segments_path)
+        
+        stats = await self.get_result_stats(file_id)
+        for segment in segments:
+            counts = text_counts(segment["text"])
+            stats["word_count"] = stats.get("word_count", 0) + counts["word_count"]
+            stats["char_count"] = stats.get("char_count", 0) + counts["char_count"]
+        stats["segment_count"] = stats.get("segment_count", 0) + len(segments)
+        await self.store.put_metadata(file_id, stats, kind="result")
+    
+    async def get_segments(self, file_id: str, after: int = 0) -> List[Dict]:
+        """讀取第 after 個之後的句段（轉換進行中也可讀取）"""
+        return await self._io(self._read_segments, file_id, after)
+    
+    def _read_segments(self, file_id: str, after: int) -> List[Dict]:
+        """依索引跳到第 after 個句段開始讀取；索引缺少（如快取還原的結果）或正在替換時從頭讀取"""
+        offset, skip = self._segment_offset(file_id, after)
+        segments = []
+        try:
+            with open(self._segments_path(file_id), 'rb') as f:
+                if offset:
+                    f.seek(offset - 1)
+                    if f.read(1) != b"\n":
+                        # 索引與句段檔不一致（句段檔剛被替換）
+                        f.seek(0)
+                        skip = after
+                for line in f:
+                    if skip:
+                        skip -= 1
+                    elif line.endswith(b"\n"):
+                        segments.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return segments
+    
+    def _segment_offset(self, file_id: str, after: int) -> Tuple[int, int]:
+        """第 after 個句段的起始位元組與之後還需跳過的行數（已索引的句段少於 after 個時從最後一個索引開始）"""
+        if not after:
+            return 0, 0
+        try:
+            with open(self._segment_index_path(file_id), 'rb') as f:
+                count = os.fstat(f.fileno()).st_size // SEGMENT_INDEX_WIDTH
+                if not count:
+                    return 0, after
+                position = min(after, count - 1)
+                f.seek(position * SEGMENT_INDEX_WIDTH)
+                return int.from_bytes(f.read(SEGMENT_INDEX_WIDTH), "little"), after - position
+        except FileNotFoundError:
+            return 0, after
+    
+    def _output_path(self, file_id: str, output_format: str) -> str:
+        return shard_path(self.result_dir, file_id, f"{file_id}.{OUTPUT_FORMATS[output_format][1]}")
+    
+    async def _clear_outputs(self, file_id: str):
+        """結果更新時清除先前產生的其他格式"""
+        for output_format in OUTPUT_FORMATS:
+            if output_format != "txt":
+                await self._remove_if_exists(self._output_path(file_id, output_format))
+    
+    async def get_output_file(self, file_id: str, output_format: str) -> str:
+        """指定格式的結果檔路徑：由句段產生並保存，之後的請求直接使用（不需重新轉換）"""
+        if output_format == "txt":
+            return await self.get_result_file(file_id)
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支援的輸出格式: {output_format}")
+        
+        segments_path = self._segments_path(file_id)
+        if not await self._exists(segments_path):
+            raise FileNotFoundError(f"句段檔案不存在: {file_id}")
+        output_path = self._output_path(file_id, output_format)
+        if not await self._exists(output_path):
+            stats = await self.get_result_stats(file_id)
+            if output_format == "words" and not stats.get("word_timestamps"):
+                raise ValueError("此結果沒有逐字時間戳記，請以 word_timestamps 重新轉換")
+            await self._io(self._render_output, segments_path, output_path, output_format, stats.get("language"))
+            self._invalidate(output_path)
+        
+        self.accessed[file_id] = time.time()
+        return output_path
+    
+    def _render_output(self, segments_path: str, output_path: str, output_format: str, language: Optional[str]):
+        def segments():
+            with open(segments_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+        
+        # 逐句段寫出，長音訊也不需將整份結果放入記憶體
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for part in render(output_format, segments(), language):
+                f.write(part)
+        os.replace(tmp_path, output_path)
+    
+    async def get_result_stats(self, file_id: str) -> Dict:
+        """結果的字數、字元數與句段數"""
+        return await self.store.get_metadata(file_id, kind="result") or {}
+    
+    async def _result_cache_key(self, file_id: str, model_size: str, language: str, include_timestamps: bool, engine: str, vad: bool, word_timestamps: bool) -> Optional[str]:
+        metadata = await self._load_metadata(file_id)
+        if not metadata or "content_hash" not in metadata:
+            return None
+        return TranscriptCache.make_key(metadata["content_hash"], model_size, language, include_timestamps, engine, vad, word_timestamps)
+    
+    async def restore_cached_result(self, file_id: str, model_size: str, language: str, include_timestamps: bool, engine: str = "torch", vad: bool = False, word_timestamps: bool = False) -> bool:
+        """相同內容與參數已轉換過時，直接將快取結果（與句段）作為此檔案的結果"""
+        key = await self._result_cache_key(file_id, model_size, language, include_timestamps, engine, vad, word_timestamps)
+        cached_path = key and await self._io(self.transcript_cache.lookup, key)
+        if not cached_path:
+            return False
+        
+        result_path = self._result_path(file_id)
+        await self._ensure_dir(result_path)
+        await self._link_or_copy(cached_path, result_path)
+        
+        async with self._open(result_path, 'r', encoding='utf-8') as f:
+            stats = text_counts(await f.read())
+        segments_path = self._segments_path(file_id)
+        await self._remove_if_exists(segments_path)
+        await self._remove_if_exists(self._segment_index_path(file_id))
+        await self._clear_outputs(file_id)
+        segment_count = 0
+        cached_segments = TranscriptCache.segments_path(cached_path)
+        if await self._exists(cached_segments):
+            await self._link_or_copy(cached_segments, segments_path)
+            segment_count = await self._io(self._count_lines, segments_path)
+        await self.store.put_metadata(
+            file_id, {**stats, "segment_count": segment_count, "word_timestamps": word_timestamps and segment_count > 0},
+            kind="result"
+        )
+        
+        logger.info(f"轉換結果快取命中: {file_id}")
+        return True
+    
+    async def _link_or_copy(self, source: str, path: str):
+        tmp_path = f"{path}.tmp"
+        try:
+            await self._io(os.link, source, tmp_path)
+        except OSError:
+            import shutil
+            await self._io(shutil.copyfile, source, tmp_path)
+        await self._replace(tmp_path, path)
+    
+    def _count_lines(self, path: str) -> int:
+        with open(path, 'rb') as f:
+            return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(self.chunk_size), b''))
+    
+    async def cache_result(self, file_id: str, model_size: str, language: str, include_timestamps: bool, engine: str = "torch", vad: bool = False, word_timestamps: bool = False):
+        """將已完成的結果與句段加入快取並執行淘汰"""
+        key = await self._result_cache_key(file_id, model_size, language, include_timestamps, engine, vad, word_timestamps)
+        if not key:
+            return
+        
+        await self._io(self.transcript_cache.store, key, self._result_path(file_id), self._segments_path(file_id))
+        await self._io(self.transcript_cache.evict)
+    
+    async def get_pcm_path(self, file_id: str) -> str:
+        """解碼後 PCM 快取的路徑；內容相同的上傳共用同一份"""
+        metadata = await self._load_metadata(file_id)
+        if not metadata:
+            raise FileNotFoundError(f"檔案不存在: {file_id}")
+        
+        pcm_path = self._pcm_path(file_id, metadata)
+        await self._ensure_dir(pcm_path)
+        return pcm_path
+    
+    def _pcm_path(self, file_id: str, metadata: Dict) -> str:
+        content_key = metadata.get("content_hash", file_id)
+        return shard_path(self.upload_dir, content_key, f"{content_key}.pcm")
+
+    async def pcm_exists(self, pcm_path: str) -> bool:
+        """PCM 快取是否已解碼完成（不使用 stat 快取，解碼可能剛寫入）"""
+        return await self._io(os.path.exists, pcm_path)
+
+    def pcm_paths(self, file_id: str, metadata: Dict) -> List[str]:
+        """檔案內容的 PCM 快取與 VAD 後的語音 PCM"""
+        pcm_path = self._pcm_path(file_id, metadata)
+        return [pcm_path, f"{os.path.splitext(pcm_path)[0]}.speech.pcm"]
+
+    def artifact_paths(self, file_id: str, metadata: Optional[Dict] = None) -> List[str]:
+        """工作自己的檔案：結果、純文字、句段、其他格式的輸出與來源媒體（不含共用的 PCM 快取）"""
+        paths = [
+            self._result_path(file_id),
+            os.path.join(self.result_dir, f"{file_id}_text.txt"),
+            self._segments_path(file_id),
+            self._segment_index_path(file_id),
+        ] + [self._output_path(file_id, output_format) for output_format in OUTPUT_FORMATS if output_format != "txt"]
+        # 直接引用其他檔案（不支援硬連結）時不刪除別人的檔案
+        if metadata and os.path.basename(metadata["stored_filename"]).startswith(file_id):
+            paths.append(os.path.join(self.upload_dir, metadata["stored_filename"]))
+        return paths
+
+    async def remove_file(self, path: str):
+        """刪除檔案（不存在時忽略）並使 stat 快取失效"""
+        await self._remove_if_exists(path)
+
+    def invalidate_cache(self):
+        """檔案在 FileHandler 之外被刪除後，清除 stat 快取"""
+        self._invalidate()
+    
+    async def get_audio_duration(self, file_id: str) -> Optional[float]:
+        """已解碼音訊的長度（秒），尚未解碼時為 None"""
+        metadata = await self._load_metadata(file_id)
+        return metadata.get("duration") if metadata else None
+    
+    async def update_metadata(self, file_id: str, **fields):
+        """更新檔案元資料的部分欄位"""
+        metadata = await self._load_metadata(file_id)
+        if metadata is None:
+            raise FileNotFoundError(f"檔案不存在: {file_id}")
+        
+        metadata.update(fields)
+        await self._save_metadata(file_id, metadata)
+    
     async def get_file_path(self, file_id: str) -> str:
         """獲取上傳檔案的完整路徑"""
         metadata = await self._load_metadata(file_id)
@@ -82,30 +728,77 @@ class FileHandler:
             raise FileNotFoundError(f"檔案不存在: {file_id}")
         
         return os.path.join(self.upload_dir, metadata["stored_filename"])
+
+    async def source_produced(self, file_id: str, stage: str):
+        """轉換進入某階段（decoded / completed）時，依 DELETE_SOURCE_AFTER 刪除不再需要的來源媒體"""
+        if self.delete_source_after == stage:
+            await self.release_source(file_id)
+
+    async def release_source(self, file_id: str) -> int:
+        """刪除此檔案的來源媒體（保留 PCM 快取與結果），返回釋放的位元組數"""
+        metadata = await self._load_metadata(file_id)
+        if not metadata or metadata.get("source_deleted"):
+            return 0
+
+        # 直接引用其他檔案（不支援硬連結）時不刪除別人的檔案
+        stored_filename = metadata["stored_filename"]
+        freed = 0
+        if os.path.basename(stored_filename).startswith(file_id):
+            file_path = os.path.join(self.upload_dir, stored_filename)
+            stat = await self._stat(file_path)
+            freed = stat.st_size if stat else 0
+            await self._remove_if_exists(file_path)
+        metadata["source_deleted"] = True
+        await self._save_metadata(file_id, metadata)
+        return freed
+
+    async def delete_job(self, file_id: str):
+        """刪除檔案的來源媒體、結果、句段、元資料與狀態（PCM 快取由清理工作依引用判斷）"""
+        metadata = await self._load_metadata(file_id)
+        if metadata:
+            content_key = metadata.get("content_hash")
+            index = content_key and await self.store.get_metadata(content_key, kind="content")
+            if index and index.get("stored_filename") == metadata["stored_filename"]:
+                await self.store.delete_metadata(content_key, kind="content")
+
+        for path in self.artifact_paths(file_id, metadata):
+            await self._remove_if_exists(path)
+        for kind in ("metadata", "result"):
+            await self.store.delete_metadata(file_id, kind=kind)
+            await self._remove_if_exists(self._legacy_json_path(file_id, kind))
+        await self.store.delete_status(file_id)
+        await self._remove_if_exists(self._legacy_json_path(file_id, "status"))
+        self.accessed.pop(file_id, None)
+        logger.info(f"已刪除工作檔案: {file_id}")
+
+    def _legacy_json_path(self, file_id: str, kind: str) -> str:
+        return os.path.join(self.upload_dir, f"{file_id}_{kind}.json")
     
-    async def _save_metadata(self, file_id: str, metadata: Dict):
+    async def _save_metadata(self, file_id: str, metadata: Dict, kind: str = "metadata"):
         """保存檔案元資料"""
-        import json
-        
-        metadata_path = os.path.join(self.upload_dir, f"{file_id}_metadata.json")
-        async with aiofiles.open(metadata_path, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(metadata, ensure_ascii=False, indent=2))
+        await self.store.put_metadata(file_id, metadata, kind)
     
-    async def _load_metadata(self, file_id: str) -> Optional[Dict]:
-        """載入檔案元資料"""
-        import json
-        
-        metadata_path = os.path.join(self.upload_dir, f"{file_id}_metadata.json")
+    async def _load_metadata(self, file_id: str, kind: str = "metadata") -> Optional[Dict]:
+        """載入檔案元資料（儲存中沒有時匯入舊版的 JSON 元資料檔）"""
+        metadata = await self.store.get_metadata(file_id, kind)
+        if metadata is not None:
+            return metadata
         
         try:
-            async with aiofiles.open(metadata_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return json.loads(content)
+            async with self._open(self._legacy_json_path(file_id, kind), 'r', encoding='utf-8') as f:
+                metadata = json.loads(await f.read())
         except (FileNotFoundError, json.JSONDecodeError):
             return None
+        
+        await self.store.put_metadata(file_id, metadata, kind)
+        return metadata
 
     async def get_processing_status(self, file_id: str) -> Dict:
-        """獲取處理狀態"""
+        """獲取處理狀態（由儲存的記憶體快取直接返回，不需讀取磁碟）"""
+        status = await self.store.get_status(file_id)
+        if status is not None:
+            return status
+        
         if not await self.file_exists(file_id):
             return {
                 "status": "file_not_found", 
@@ -114,17 +807,8 @@ class FileHandler:
                 "stage": "錯誤"
             }
         
-        # 檢查狀態檔案
-        status_path = os.path.join(self.upload_dir, f"{file_id}_status.json")
-        if os.path.exists(status_path):
-            async with aiofiles.open(status_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                import json
-                return json.loads(content)
-        
-        # 檢查結果檔案
-        result_path = os.path.join(self.result_dir, f"{file_id}_text.txt")
-        if os.path.exists(result_path):
+        # 沒有狀態紀錄時（舊版資料）依結果檔案判斷
+        if await self._existing_result_path(file_id):
             return {
                 "status": "completed", 
                 "message": "轉換完成",
@@ -141,9 +825,6 @@ class FileHandler:
 
     async def update_processing_status(self, file_id: str, status: str, progress: int, stage: str, message: str = "", processing_time: float = 0.0):
         """更新處理狀態"""
-        import json
-        import time
-        
         status_data = {
             "status": status,
             "progress": progress,
@@ -153,14 +834,16 @@ class FileHandler:
             "processing_time": processing_time
         }
         
-        status_path = os.path.join(self.upload_dir, f"{file_id}_status.json")
-        async with aiofiles.open(status_path, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(status_data, ensure_ascii=False, indent=2))
+        await self.store.put_status(file_id, status_data)
+        self.events.publish(file_id, status_data)
         
         logger.info(f"更新狀態 {file_id}: {status} - {progress}% - {stage}")
 
     async def cleanup_status(self, file_id: str):
-        """清理狀態檔案"""
-        status_path = os.path.join(self.upload_dir, f"{file_id}_status.json")
-        if os.path.exists(status_path):
-            os.remove(status_path)
+        """清理狀態紀錄"""
+        await self.store.delete_status(file_id)
+    
+    async def close(self):
+        """寫入尚未保存的狀態並關閉儲存與檔案 I/O 執行緒池"""
+        await self.store.close()
+        self.io_executor.shutdown(wait=False)
@@ -0,0 +1,75 @@
+import json
+from typing import Dict, Iterable, Iterator, Optional
+
+# 可輸出的格式：(Content-Type, 副檔名)；txt 為轉換時寫入的結果文字，其餘由句段產生，
+# words 需在轉換時啟用 word_timestamps
+OUTPUT_FORMATS = {
+    "txt": ("text/plain; charset=utf-8", "txt"),
+    "srt": ("application/x-subrip; charset=utf-8", "srt"),
+    "vtt": ("text/vtt; charset=utf-8", "vtt"),
+    "tsv": ("text/tab-separated-values; charset=utf-8", "tsv"),
+    "json": ("application/json", "json"),
+    "words": ("text/tab-separated-values; charset=utf-8", "words.tsv"),
+}
+
+
+def format_clock(seconds: float, decimal_marker: str = ",") -> str:
+    """字幕時間碼 HH:MM:SS,mmm（VTT 使用小數點）"""
+    milliseconds = max(0, round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
+
+
+def _cue_text(segment: Dict) -> str:
+    # 字幕格式中 "-->" 為時間分隔符號
+    return segment["text"].strip().replace("-->", "->")
+
+
+def render_srt(segments: Iterable[Dict]) -> Iterator[str]:
+    for index, segment in enumerate(segments, start=1):
+        yield f"{index}\n{format_clock(segment['start'])} --> {format_clock(segment['end'])}\n{_cue_text(segment)}\n\n"
+
+
+def render_vtt(segments: Iterable[Dict]) -> Iterator[str]:
+    yield "WEBVTT\n\n"
+    for segment in segments:
+        yield f"{format_clock(segment['start'], '.')} --> {format_clock(segment['end'], '.')}\n{_cue_text(segment)}\n\n"
+
+
+def render_tsv(segments: Iterable[Dict]) -> Iterator[str]:
+    """與 whisper 的 TSV 相同：開始與結束時間為整數毫秒"""
+    yield "start\tend\ttext\n"
+    for segment in segments:
+        text = segment["text"].strip().replace("\t", " ")
+        yield f"{round(segment['start'] * 1000)}\t{round(segment['end'] * 1000)}\t{text}\n"
+
+
+def render_words(segments: Iterable[Dict]) -> Iterator[str]:
+    """逐字時間戳記（TSV，毫秒）"""
+    yield "start\tend\tword\n"
+    for segment in segments:
+        for word in segment.get("words", []):
+            text = word["word"].strip().replace("\t", " ")
+            yield f"{round(word['start'] * 1000)}\t{round(word['end'] * 1000)}\t{text}\n"
+
+
+def render_json(segments: Iterable[Dict], language: Optional[str] = None) -> Iterator[str]:
+    """{"language", "segments", "text"}，逐句段輸出，不需先組出完整物件"""
+    yield '{"language": ' + json.dumps(language) + ', "segments": ['
+    texts = []
+    for index, segment in enumerate(segments):
+        texts.append(segment["text"])
+        yield ("" if index == 0 else ", ") + json.dumps(segment, ensure_ascii=False)
+    yield '], "text": ' + json.dumps("".join(texts).strip(), ensure_ascii=False) + "}"
+
+
+def render(output_format: str, segments: Iterable[Dict], language: Optional[str] = None) -> Iterator[str]:
+    """以句段產生指定格式的內容（逐段產生，可直接串流或寫入檔案）"""
+    if output_format == "json":
+        return render_json(segments, language)
+    renderers = {"srt": render_srt, "vtt": render_vtt, "tsv": render_tsv, "words": render_words}
+    if output_format not in renderers:
+        raise ValueError(f"不支援的輸出格式: {output_format}")
+    return renderers[output_format](segments)
@@ -0,0 +1,321 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from .file_handler import FileHandler
+from .job_store import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# 中斷的寫入留下的暫存檔超過此時間才刪除，避免刪到正在寫入的檔案
+TMP_FILE_GRACE_SECONDS = 3600
+# 剛解碼的 PCM 快取在此時間內不刪除：其工作可能在列出工作之後才上傳
+PCM_GRACE_SECONDS = 600
+
+
+def _hours(name: str, default: float) -> float:
+    return float(os.getenv(name, default)) * 3600
+
+
+class StorageJanitor:
+    """定期清理上傳檔案、PCM 快取、結果與工作紀錄，並在超過磁碟配額時依最近使用時間淘汰
+
+    - UPLOAD_TTL_HOURS：來源媒體與 PCM 快取在最後一次使用後保留的時間
+    - RESULT_TTL_HOURS：整個工作（結果、句段、元資料、狀態）在最後一次使用後保留的時間
+    - STORAGE_QUOTA_MB：上傳與結果目錄的總大小上限，超過時從最久未使用的工作開始刪除
+      （轉換結果快取另有 RESULT_CACHE_MAX_MB 上限，不計入）
+    排隊或處理中的工作一律不刪除；設為 0 表示停用該項清理。
+    """
+
+    def __init__(
+        self,
+        file_handler: FileHandler,
+        is_active: Callable[[str], bool],
+        interval: Optional[float] = None,
+        upload_ttl: Optional[float] = None,
+        result_ttl: Optional[float] = None,
+        quota_bytes: Optional[int] = None,
+        session_ttl: Optional[float] = None,
+    ):
+        self.file_handler = file_handler
+        self.is_active = is_active
+        self.interval = interval or float(os.getenv("JANITOR_INTERVAL_SECONDS", 600))
+        self.upload_ttl = upload_ttl if upload_ttl is not None else _hours("UPLOAD_TTL_HOURS", 24)
+        self.result_ttl = result_ttl if result_ttl is not None else _hours("RESULT_TTL_HOURS", 168)
+        self.quota_bytes = quota_bytes if quota_bytes is not None else int(float(os.getenv("STORAGE_QUOTA_MB", 0)) * 1024 * 1024)
+        self.session_ttl = session_ttl if session_ttl is not None else _hours("SESSION_TTL_HOURS", 24)
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._counts = {"deleted_jobs": 0, "released_sources": 0, "removed_files": 0, "freed_bytes": 0}
+        self.usage_bytes = 0
+        self.last_run: Optional[float] = None
+        self.last_run_seconds = 0.0
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"儲存空間清理失敗: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Dict:
+        """執行一次清理，返回本次的刪除統計"""
+        async with self._lock:
+            started = time.perf_counter()
+            before = dict(self._counts)
+            now = time.time()
+            store = self.file_handler.store
+
+            jobs = await self._load_jobs(now)
+            statuses = await store.list_statuses()
+
+            for file_id, metadata in list(jobs.items()):
+                if self._busy(file_id, statuses):
+                    continue
+                idle = now - metadata["last_used"]
+                if self.result_ttl and idle > self.result_ttl:
+                    await self._delete_job(file_id, jobs)
+                elif self.upload_ttl and idle > self.upload_ttl and not metadata.get("source_deleted"):
+                    self._count("freed_bytes", await self.file_handler.release_source(file_id))
+                    self._count("released_sources")
+
+            await self._expire_sessions(now)
+            await self._expire_batches(now)
+
+            # 仍需要 PCM 快取的內容：處理中或在 UPLOAD_TTL_HOURS 內使用過的工作
+            live_keys = {
+                metadata.get("content_hash", file_id)
+                for file_id, metadata in jobs.items()
+                if not self.upload_ttl
+                or self._busy(file_id, statuses)
+                or now - metadata["last_used"] <= self.upload_ttl
+            }
+            usage, removed, freed, orphans = await asyncio.to_thread(self._sweep, live_keys, now)
+            orphans = await self._unreferenced_pcm(orphans, jobs)
+            pcm_removed, pcm_freed = await asyncio.to_thread(self._remove_files, orphans)
+            usage -= pcm_freed
+            removed += pcm_removed
+            freed += pcm_freed
+            if removed:
+                self.file_handler.invalidate_cache()
+            self._count("removed_files", removed)
+            self._count("freed_bytes", freed)
+
+            if self.quota_bytes and usage > self.quota_bytes:
+                usage = await self._enforce_quota(jobs, statuses, usage)
+            self.usage_bytes = usage
+
+            self.last_run = now
+            self.last_run_seconds = time.perf_counter() - started
+            report = {key: self._counts[key] - before[key] for key in self._counts}
+            if any(report.values()):
+                logger.info(
+                    f"儲存空間清理: 刪除 {report['deleted_jobs']} 個工作、{report['released_sources']} 個來源檔、"
+                    f"{report['removed_files']} 個殘留檔案，釋放 {report['freed_bytes'] / 1024 / 1024:.1f}MB，"
+                    f"目前使用 {usage / 1024 / 1024:.1f}MB"
+                )
+            return report
+
+    def _count(self, key: str, amount: int = 1):
+        self._counts[key] += amount
+
+    def _busy(self, file_id: str, statuses: Dict[str, Dict]) -> bool:
+        status = statuses.get(file_id)
+        return self.is_active(file_id) or (status is not None and status.get("status") not in TERMINAL_STATUSES)
+
+    async def _load_jobs(self, now: float) -> Dict[str, Dict]:
+        """所有上傳檔案的元資料，附上最後使用時間（上傳、轉換完成或下載結果中最晚者）"""
+        store = self.file_handler.store
+        accessed = dict(self.file_handler.accessed)
+        jobs = await store.list_metadata("metadata")
+        statuses = await store.list_statuses()
+        for file_id, metadata in jobs.items():
+            changed = False
+            if file_id in accessed and accessed[file_id] > metadata.get("accessed_at", 0):
+                metadata["accessed_at"] = accessed[file_id]
+                changed = True
+            if "created_at" not in metadata:
+                # 舊版資料沒有建立時間，從第一次清理開始計算
+                metadata["created_at"] = now
+                changed = True
+            if changed:
+                await store.put_metadata(file_id, metadata)
+            status = statuses.get(file_id) or {}
+            metadata["last_used"] = max(
+                metadata["created_at"], metadata.get("accessed_at", 0), status.get("timestamp", 0)
+            )
+        for file_id in accessed:
+            self.file_handler.accessed.pop(file_id, None)
+        return jobs
+
+    async def _delete_job(self, file_id: str, jobs: Dict[str, Dict]):
+        # 列出工作後才送出的轉換仍要保留
+        if self.is_active(file_id):
+            return
+        await self.file_handler.delete_job(file_id)
+        jobs.pop(file_id, None)
+        self._count("deleted_jobs")
+
+    async def _expire_sessions(self, now: float):
+        """刪除長時間沒有新區段的續傳工作階段"""
+        if not self.session_ttl:
+            return
+        store = self.file_handler.store
+        for session_id in await store.list_metadata("session"):
+            stat = await self.file_handler.session_part_stat(session_id)
+            if stat is None:
+                # 工作階段剛建立、暫存檔尚未寫入
+                continue
+            if now - stat.st_mtime > self.session_ttl:
+                await self.file_handler.remove_session(session_id)
+                self._count("removed_files")
+                self._count("freed_bytes", stat.st_size)
+
+    async def _expire_batches(self, now: float):
+        if not self.result_ttl:
+            return
+        store = self.file_handler.store
+        for batch_id, record in (await store.list_metadata("batch")).items():
+            if now - record.get("created_at", now) > self.result_ttl:
+                await store.delete_metadata(batch_id, kind="batch")
+
+    def _walk(self, root: str, exclude: Iterable[str] = ()) -> Iterable[Tuple[str, os.stat_result]]:
+        exclude = {os.path.realpath(path) for path in exclude}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if os.path.realpath(os.path.join(dirpath, d)) not in exclude]
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+    def _sweep(self, live_keys: Set[str], now: float) -> Tuple[int, int, int, List[Tuple[str, int]]]:
+        """刪除中斷留下的暫存檔與過期的舊版 JSON 紀錄，返回 (目前用量, 刪除檔案數, 釋放位元組, 候選 PCM)
+
+        沒有工作引用的 PCM 快取只列為候選（路徑與大小，已計入用量），由 _unreferenced_pcm 重新確認後才刪除。
+        """
+        handler = self.file_handler
+        usage = removed = freed = 0
+        orphans = []
+        files = list(self._walk(handler.upload_dir)) + list(
+            self._walk(handler.result_dir, exclude=[handler.transcript_cache.cache_dir])
+        )
+        for path, stat in files:
+            name = os.path.basename(path)
+            age = now - stat.st_mtime
+            if name.endswith(".pcm") and name.split(".", 1)[0] not in live_keys and age > PCM_GRACE_SECONDS:
+                orphans.append((path, stat.st_size))
+            stale = (
+                (name.endswith(".tmp") and age > TMP_FILE_GRACE_SECONDS)
+                or (
+                    self.result_ttl and age > self.result_ttl
+                    and name.endswith(("_metadata.json", "_status.json"))
+                )
+            )
+            if stale:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+            else:
+                usage += stat.st_size
+        return usage, removed, freed, orphans
+
+    async def _unreferenced_pcm(self, orphans: List[Tuple[str, int]], jobs: Dict[str, Dict]) -> List[Tuple[str, int]]:
+        """重新讀取工作紀錄：清理期間上傳或開始處理的工作所使用的 PCM 快取不刪除"""
+        if not orphans:
+            return orphans
+        store = self.file_handler.store
+        current = await store.list_metadata("metadata")
+        statuses = await store.list_statuses()
+        referenced = {
+            metadata.get("content_hash", file_id)
+            for file_id, metadata in current.items()
+            if file_id not in jobs or self._busy(file_id, statuses)
+        }
+        return [(path, size) for path, size in orphans if os.path.basename(path).split(".", 1)[0] not in referenced]
+
+    def _remove_files(self, files: List[Tuple[str, int]]) -> Tuple[int, int]:
+        removed = freed = 0
+        for path, size in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def _job_files(self, file_id: str, metadata: Dict) -> Dict[str, int]:
+        """工作佔用的檔案與大小（來源、結果、句段與其他格式的輸出）"""
+        sizes = {}
+        for path in self.file_handler.artifact_paths(file_id, metadata):
+            try:
+                sizes[path] = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+        return sizes
+
+    async def _enforce_quota(self, jobs: Dict[str, Dict], statuses: Dict[str, Dict], usage: int) -> int:
+        """從最久未使用的工作開始刪除，直到用量低於配額；共用的 PCM 快取在最後一個引用者刪除時移除"""
+        references: Dict[str, int] = {}
+        for file_id, metadata in jobs.items():
+            key = metadata.get("content_hash", file_id)
+            references[key] = references.get(key, 0) + 1
+
+        candidates = sorted(
+            (metadata["last_used"], file_id) for file_id, metadata in jobs.items() if not self._busy(file_id, statuses)
+        )
+        for _, file_id in candidates:
+            if usage <= self.quota_bytes:
+                break
+            if self.is_active(file_id):
+                continue
+            metadata = jobs[file_id]
+            sizes = await asyncio.to_thread(self._job_files, file_id, metadata)
+            await self._delete_job(file_id, jobs)
+            usage -= sum(sizes.values())
+            self._count("freed_bytes", sum(sizes.values()))
+
+            key = metadata.get("content_hash", file_id)
+            references[key] -= 1
+            if references[key] == 0:
+                for path in self.file_handler.pcm_paths(file_id, metadata):
+                    try:
+                        size = (await asyncio.to_thread(os.stat, path)).st_size
+                    except FileNotFoundError:
+                        continue
+                    await self.file_handler.remove_file(path)
+                    usage -= size
+                    self._count("removed_files")
+                    self._count("freed_bytes", size)
+
+        if usage > self.quota_bytes:
+            logger.warning(f"儲存空間仍超過配額（{usage / 1024 / 1024:.1f}MB），已沒有可刪除的閒置工作")
+        return max(usage, 0)
+
+    def stats(self) -> Dict:
+        return {
+            **self._counts,
+            "usage_bytes": self.usage_bytes,
+            "quota_bytes": self.quota_bytes,
+            "last_run": self.last_run,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+        }
@@ -0,0 +1,395 @@
+import os
+import time
+import heapq
+import bisect
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 優先等級：數字小者先處理；等待每滿 aging_seconds 提升一級
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1}
+# 超過期限時的處理：drop（取消排隊或執行中的工作）、downgrade（開始時改用能在期限內完成的較小模型）
+DEADLINE_ACTIONS = ("drop", "downgrade")
+
+
+class QueueFullError(Exception):
+    """佇列已滿，請稍後重試"""
+
+
+class SchedulerUnavailableError(Exception):
+    """排程器尚未啟動或正在關閉"""
+
+
+def parse_model_limits(value: str) -> Dict[str, int]:
+    """解析 "large=1,medium=2" 格式的每模型並行上限"""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            model_size, limit = item.split("=", 1)
+            limits[model_size.strip()] = int(limit)
+    return limits
+
+
+@dataclass
+class TranscriptionJob:
+    file_id: str
+    model_size: str
+    language: str
+    include_timestamps: bool
+    # 已解碼的音訊長度（秒），未知時為 None
+    duration: Optional[float] = None
+    # 預估處理秒數（不含排隊），用於最短工作優先排序與等待時間估算
+    estimated_seconds: Optional[float] = None
+    kwargs: Dict = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    priority: str = "interactive"
+    # 完成期限（time.monotonic()），None 表示沒有期限
+    deadline: Optional[float] = None
+    deadline_action: str = "downgrade"
+
+    def runner_kwargs(self) -> Dict:
+        return {
+            "file_id": self.file_id,
+            "model_size": self.model_size,
+            "language": self.language,
+            "include_timestamps": self.include_timestamps,
+            **self.kwargs,
+        }
+
+
+class TranscriptionScheduler:
+    """有界的轉換工作佇列，以固定數量的工作者並依模型大小限制並行數
+
+    待處理的工作先依優先等級（互動 interactive 先於批次 batch），同等級再依預估處理時間由短到長取出
+    （最短工作優先）。等待每滿 aging_seconds 提升一個等級，批次工作不會一直被互動工作插隊；
+    等待超過 max_wait 秒的工作則依加入順序優先處理，避免長工作一直被插隊。
+
+    short_job_slots > 0 時，長度不超過 short_job_seconds 的短音訊另有獨立的並行額度，
+    讓多個短音訊能同時送入批次推論，不受長音訊佔用工作者與每模型上限影響。
+
+    有期限的工作：deadline_action 為 downgrade 時，開始前以 fit_deadline(工作, 剩餘秒數) 選擇能在期限內
+    完成的模型；為 drop 時超過期限即以 on_expired(工作) 通知（排隊中的工作會先移出佇列）。
+    """
+
+    def __init__(
+        self,
+        runner: Callable[..., Awaitable],
+        num_workers: Optional[int] = None,
+        max_queue_size: Optional[int] = None,
+        model_limits: Optional[Dict[str, int]] = None,
+        short_job_slots: Optional[int] = None,
+        short_job_seconds: Optional[float] = None,
+        max_wait: Optional[float] = None,
+        aging_seconds: Optional[float] = None,
+        fit_deadline: Optional[Callable[[TranscriptionJob, float], Tuple[str, Optional[float]]]] = None,
+        on_expired: Optional[Callable[[TranscriptionJob], Awaitable]] = None,
+    ):
+        self.runner = runner
+        self.num_workers = num_workers or int(os.getenv("JOB_WORKERS", 2))
+        self.max_queue_size = max_queue_size or int(os.getenv("JOB_QUEUE_SIZE", 20))
+        self.model_limits = model_limits if model_limits is not None else parse_model_limits(
+            os.getenv("MODEL_CONCURRENCY", "large=1,medium=1")
+        )
+        self.short_job_slots = short_job_slots if short_job_slots is not None else int(os.getenv("SHORT_JOB_SLOTS", 0))
+        self.short_job_seconds = short_job_seconds or float(os.getenv("BATCH_MAX_SECONDS", 30))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("SJF_MAX_WAIT_SECONDS", 300))
+        self.aging_seconds = aging_seconds if aging_seconds is not None else float(os.getenv("PRIORITY_AGING_SECONDS", 60))
+        self.fit_deadline = fit_deadline
+        self.on_expired = on_expired
+
+        # 待處理的工作依排程順序排列，_pending_keys 為對應的排序鍵、_positions 為各工作的索引；
+        # 排序鍵隨等待時間改變（提升優先等級、超過 max_wait），到 _order_expires 時才重新排序
+        self._pending: List[TranscriptionJob] = []
+        self._pending_keys: List[tuple] = []
+        self._positions: Dict[str, int] = {}
+        self._order_expires = float("inf")
+        self._running: Dict[str, TranscriptionJob] = {}
+        self._started_at: Dict[str, float] = {}
+        self._active_per_model: Dict[str, int] = {}
+        self._active_short = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+        self._deadline_task: Optional[asyncio.Task] = None
+        # 已通知過期的工作，避免重複通知
+        self._expired: set = set()
+        self._accepting = False
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def saturated(self) -> bool:
+        return len(self._pending) >= self.max_queue_size
+
+    def active_per_model(self) -> Dict[str, int]:
+        """各模型執行中的工作數（含短音訊）"""
+        counts: Dict[str, int] = {}
+        for job in self._running.values():
+            counts[job.model_size] = counts.get(job.model_size, 0) + 1
+        return counts
+
+    async def start(self):
+        """啟動工作者"""
+        if self._workers:
+            return
+        self._condition = asyncio.Condition()
+        self._accepting = True
+        self._workers = [
+            asyncio.create_task(self._worker_loop(i), name=f"transcription-worker-{i}")
+            for i in range(self.num_workers + self.short_job_slots)
+        ]
+        self._deadline_task = asyncio.create_task(self._deadline_loop(), name="transcription-deadlines")
+        logger.info(
+            f"轉換排程器已啟動: {self.num_workers} 個工作者（另 {self.short_job_slots} 個短音訊額度）, "
+            f"佇列上限 {self.max_queue_size}"
+        )
+
+    async def stop(self):
+        """停止接受新工作並結束工作者"""
+        self._accepting = False
+        tasks = self._workers + ([self._deadline_task] if self._deadline_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._deadline_task = None
+
+    async def submit(self, job: TranscriptionJob) -> int:
+        """加入工作，返回排隊位置（從 1 開始）"""
+        if not self._accepting:
+            raise SchedulerUnavailableError("轉換服務尚未就緒")
+
+        async with self._condition:
+            if self.is_active(job.file_id):
+                raise ValueError(f"檔案已在處理中: {job.file_id}")
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(f"轉換佇列已滿（{self.max_queue_size}）")
+
+            self._add_pending(job)
+            self._condition.notify_all()
+            return self.get_position(job.file_id)
+
+    async def cancel(self, file_id: str, reason: str = "") -> Optional[str]:
+        """取消工作：排隊中的工作直接移出佇列並返回 "queued"；執行中返回 "running"（由呼叫端停止推論）；
+        不在佇列中返回 None"""
+        async with self._condition:
+            if file_id in self._running:
+                return "running"
+            if self._remove_pending(file_id) is not None:
+                self._condition.notify_all()
+                return "queued"
+        return None
+
+    def is_active(self, file_id: str) -> bool:
+        return file_id in self._running or file_id in self._positions
+
+    def get_position(self, file_id: str) -> Optional[int]:
+        """排隊位置；執行中為 0，不在佇列中為 None"""
+        if file_id in self._running:
+            return 0
+        self._refresh_order(time.monotonic())
+        index = self._positions.get(file_id)
+        return index + 1 if index is not None else None
+
+    def _order_key(self, job: TranscriptionJob, now: float):
+        waited = now - job.enqueued_at
+        if waited >= self.max_wait:
+            return (0, job.enqueued_at)
+        rank = PRIORITY_CLASSES.get(job.priority, 0)
+        if self.aging_seconds:
+            rank = max(0, rank - int(waited // self.aging_seconds))
+        estimated = job.estimated_seconds if job.estimated_seconds is not None else float("inf")
+        return (1, rank, estimated, job.enqueued_at)
+
+    def _key_expires(self, job: TranscriptionJob, now: float) -> float:
+        """排序鍵下一次改變的時間：等待超過 max_wait 或提升一個優先等級"""
+        waited = now - job.enqueued_at
+        if waited >= self.max_wait:
+            return float("inf")
+        expires = job.enqueued_at + self.max_wait
+        rank = PRIORITY_CLASSES.get(job.priority, 0)
+        if self.aging_seconds and rank - int(waited // self.aging_seconds) > 0:
+            expires = min(expires, job.enqueued_at + (int(waited // self.aging_seconds) + 1) * self.aging_seconds)
+        return expires
+
+    def _set_pending(self, jobs: List[TranscriptionJob], now: Optional[float] = None):
+        """以目前時間重新排序所有待處理的工作"""
+        now = time.monotonic() if now is None else now
+        keyed = sorted(((self._order_key(job, now), job) for job in jobs), key=lambda item: item[0])
+        self._pending = [job for _, job in keyed]
+        self._pending_keys = [key for key, _ in keyed]
+        self._positions = {job.file_id: index for index, job in enumerate(self._pending)}
+        self._order_expires = min((self._key_expires(job, now) for job in self._pending), default=float("inf"))
+
+    def _refresh_order(self, now: float):
+        if now >= self._order_expires:
+            self._set_pending(self._pending, now)
+
+    def _add_pending(self, job: TranscriptionJob):
+        """依排序鍵插入待處理的工作（其他工作的排序鍵在 _order_expires 之前不變）"""
+        self._remove_pending(job.file_id)
+        now = time.monotonic()
+        self._refresh_order(now)
+        key = self._order_key(job, now)
+        index = bisect.bisect_right(self._pending_keys, key)
+        self._pending.insert(index, job)
+        self._pending_keys.insert(index, key)
+        self._reindex(index)
+        self._order_expires = min(self._order_expires, self._key_expires(job, now))
+
+    def _remove_pending(self, file_id: str) -> Optional[TranscriptionJob]:
+        index = self._positions.pop(file_id, None)
+        if index is None:
+            return None
+        job = self._pending.pop(index)
+        self._pending_keys.pop(index)
+        self._reindex(index)
+        return job
+
+    def _reindex(self, start: int):
+        for index in range(start, len(self._pending)):
+            self._positions[self._pending[index].file_id] = index
+
+    def _ordered_pending(self) -> List[TranscriptionJob]:
+        self._refresh_order(time.monotonic())
+        return self._pending
+
+    def estimate_remaining(self, file_id: str) -> Optional[float]:
+        """預估完成前的剩餘秒數（排隊中的工作包含等待時間），未知時為 None"""
+        job = self._running.get(file_id)
+        if job is not None:
+            if job.estimated_seconds is None:
+                return None
+            return max(0.0, job.estimated_seconds - (time.monotonic() - self._started_at[file_id]))
+        if file_id in self._positions:
+            job = self._pending[self._positions[file_id]]
+            return self.estimate_wait(file_id) + (job.estimated_seconds or 0.0)
+        return None
+
+    def estimate_wait(self, file_id: Optional[str] = None) -> float:
+        """預估開始處理前的等待秒數：將排在前面的工作依序指派給最早空出的工作者
+
+        file_id 為 None 時估算新加入的工作（排在所有待處理工作之後）。
+        """
+        if file_id in self._running:
+            return 0.0
+
+        free_at = [
+            self.estimate_remaining(running_id) or 0.0
+            for running_id, job in self._running.items() if not self._is_short(job)
+        ]
+        free_at += [0.0] * max(0, self.num_workers - len(free_at))
+        heapq.heapify(free_at)
+
+        for job in self._ordered_pending():
+            if job.file_id == file_id:
+                break
+            heapq.heappush(free_at, heapq.heappop(free_at) + (job.estimated_seconds or 0.0))
+        return free_at[0]
+
+    def _is_short(self, job: TranscriptionJob) -> bool:
+        return self.short_job_slots > 0 and job.duration is not None and job.duration <= self.short_job_seconds
+
+    def _has_capacity(self, job: TranscriptionJob) -> bool:
+        if self._is_short(job):
+            # 短音訊在同一次批次推論中共用模型，不佔每模型上限
+            return self._active_short < self.short_job_slots
+        if len(self._running) - self._active_short >= self.num_workers:
+            return False
+        limit = self.model_limits.get(job.model_size)
+        return limit is None or self._active_per_model.get(job.model_size, 0) < limit
+
+    def _apply_deadline(self, job: TranscriptionJob) -> bool:
+        """有期限且預估無法如期完成的 downgrade 工作改用較小的模型，返回是否已變更"""
+        if job.deadline is None or job.deadline_action != "downgrade" or self.fit_deadline is None:
+            return False
+        remaining = job.deadline - time.monotonic()
+        if job.estimated_seconds is not None and job.estimated_seconds <= remaining:
+            return False
+        model_size, estimated = self.fit_deadline(job, remaining)
+        if model_size == job.model_size:
+            return False
+        logger.info(f"工作 {job.file_id} 預估無法在期限內完成，模型由 {job.model_size} 改為 {model_size}")
+        job.model_size = model_size
+        job.estimated_seconds = estimated
+        return True
+
+    def _pick_next(self) -> Optional[TranscriptionJob]:
+        """依排序取出第一個尚有並行額度的工作"""
+        for job in list(self._ordered_pending()):
+            if self._apply_deadline(job):
+                # 預估時間已改變，依新的排序鍵重新插入
+                self._remove_pending(job.file_id)
+                self._add_pending(job)
+            if self._has_capacity(job):
+                self._remove_pending(job.file_id)
+                return job
+        return None
+
+    async def _deadline_loop(self, interval: float = 1.0):
+        """每秒檢查 drop 工作的期限：排隊中的移出佇列，執行中的交由 on_expired 停止"""
+        while True:
+            await asyncio.sleep(interval)
+            if self.on_expired is None:
+                continue
+            now = time.monotonic()
+
+            def past_deadline(job: TranscriptionJob) -> bool:
+                return job.deadline is not None and job.deadline_action == "drop" and now >= job.deadline
+
+            async with self._condition:
+                expired = [job for job in self._pending if past_deadline(job)]
+                for job in expired:
+                    self._remove_pending(job.file_id)
+                for job in self._running.values():
+                    if past_deadline(job) and job.file_id not in self._expired:
+                        # 執行中的工作在工作者結束時清除
+                        self._expired.add(job.file_id)
+                        expired.append(job)
+            for job in expired:
+                logger.info(f"工作 {job.file_id} 已超過期限")
+                try:
+                    await self.on_expired(job)
+                except Exception as e:
+                    logger.error(f"處理過期工作 {job.file_id} 失敗: {e}")
+
+    async def _worker_loop(self, worker_index: int):
+        while True:
+            async with self._condition:
+                job = self._pick_next()
+                while job is None:
+                    await self._condition.wait()
+                    job = self._pick_next()
+
+                short = self._is_short(job)
+                self._running[job.file_id] = job
+                self._started_at[job.file_id] = time.monotonic()
+                if short:
+                    self._active_short += 1
+                else:
+                    self._active_per_model[job.model_size] = self._active_per_model.get(job.model_size, 0) + 1
+
+            try:
+                await self.runner(**job.runner_kwargs())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"工作者 {worker_index} 處理 {job.file_id} 失敗: {e}")
+            finally:
+                async with self._condition:
+                    self._running.pop(job.file_id, None)
+                    self._started_at.pop(job.file_id, None)
+                    self._expired.discard(job.file_id)
+                    if short:
+                        self._active_short -= 1
+                    else:
+                        self._active_per_model[job.model_size] -= 1
+                    self._condition.notify_all()
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "error", "cancelled"}
+
+
+class JobStore:
+    """檔案元資料與處理狀態的儲存介面
+
+    kind 區分不同種類的元資料：metadata（上傳檔案）、session（續傳工作階段）、content（內容雜湊索引）、
+    result（結果統計）、batch（批次）。
+    """
+
+    async def get_metadata(self, key: str, kind: str = "metadata") -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def put_metadata(self, key: str, metadata: Dict, kind: str = "metadata"):
+        raise NotImplementedError
+
+    async def delete_metadata(self, key: str, kind: str = "metadata"):
+        raise NotImplementedError
+
+    async def list_metadata(self, kind: str = "metadata") -> Dict[str, Dict]:
+        """列出某種類的所有元資料（供定期清理使用，不在請求路徑上呼叫）"""
+        raise NotImplementedError
+
+    async def get_status(self, file_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def list_statuses(self) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    async def put_status(self, file_id: str, status: Dict):
+        raise NotImplementedError
+
+    async def delete_status(self, file_id: str):
+        raise NotImplementedError
+
+    def list_jobs(self, status: Optional[str] = None) -> List[str]:
+        raise NotImplementedError
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.flush()
+
+
+class MemoryJobStore(JobStore):
+    """單節點使用的記憶體儲存，依狀態建立索引，所有查詢皆為 O(1)"""
+
+    def __init__(self):
+        self._metadata: Dict[Tuple[str, str], Dict] = {}
+        self._status: Dict[str, Dict] = {}
+        self._by_status: Dict[str, Set[str]] = defaultdict(set)
+
+    async def get_metadata(self, key: str, kind: str = "metadata") -> Optional[Dict]:
+        metadata = self._metadata.get((kind, key))
+        return dict(metadata) if metadata is not None else None
+
+    async def put_metadata(self, key: str, metadata: Dict, kind: str = "metadata"):
+        self._metadata[(kind, key)] = dict(metadata)
+
+    async def delete_metadata(self, key: str, kind: str = "metadata"):
+        self._metadata.pop((kind, key), None)
+
+    async def list_metadata(self, kind: str = "metadata") -> Dict[str, Dict]:
+        return {key: dict(metadata) for (metadata_kind, key), metadata in self._metadata.items() if metadata_kind == kind}
+
+    async def list_statuses(self) -> Dict[str, Dict]:
+        return {file_id: dict(status) for file_id, status in self._status.items()}
+
+    async def get_status(self, file_id: str) -> Optional[Dict]:
+        status = self._status.get(file_id)
+        return dict(status) if status is not None else None
+
+    async def put_status(self, file_id: str, status: Dict):
+        self._index_status(file_id, status)
+
+    async def delete_status(self, file_id: str):
+        self._unindex_status(file_id)
+
+    def _unindex_status(self, file_id: str):
+        previous = self._status.pop(file_id, None)
+        if previous is not None:
+            self._by_status[previous["status"]].discard(file_id)
+
+    def _index_status(self, file_id: str, status: Dict):
+        previous = self._status.get(file_id)
+        if previous is not None:
+            self._by_status[previous["status"]].discard(file_id)
+        self._status[file_id] = dict(status)
+        self._by_status[status["status"]].add(file_id)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[str]:
+        if status is None:
+            return list(self._status.keys())
+        return list(self._by_status.get(status, ()))
+
+
+class SQLiteJobStore(MemoryJobStore):
+    """以 SQLite（WAL 模式）持久化，記憶體中保留讀取快取
+
+    狀態更新先寫入快取並標記，再由背景工作每 flush_interval 秒以單一交易批次寫入；
+    同一工作在間隔內的多次更新只會寫入最後一次。終止狀態（完成/錯誤）會立即寫入。
+    其他行程寫入的狀態在快取中最多保留 read_ttl 秒。
+
+    shared=True（多個 API 與推論節點共用，見 JOB_QUEUE）時，本行程寫入的狀態與元資料也只在
+    read_ttl 秒內由快取返回，之後重新讀取，才能看到其他節點的更新。
+
+    記憶體中只保留進行中的工作：終止狀態寫入後即移出快取（連同其元資料與結果統計），之後由 SQLite 讀取；
+    其他元資料最多快取 cache_entries 筆，超過時移除最久未使用的。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        flush_interval: Optional[float] = None,
+        read_ttl: Optional[float] = None,
+        shared: bool = False,
+        cache_entries: Optional[int] = None,
+    ):
+        super().__init__()
+        self.db_path = db_path
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv("JOB_STORE_FLUSH_INTERVAL", 0.5))
+        self.read_ttl = read_ttl if read_ttl is not None else float(os.getenv("JOB_STORE_READ_TTL", 1.0))
+        self.shared = shared
+        self.cache_entries = cache_entries if cache_entries is not None else int(os.getenv("JOB_STORE_CACHE_ENTRIES", 10000))
+
+        # sqlite 連線只在單一執行緒中使用，寫入自然序列化
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        self._conn = self._db_executor.submit(self._connect).result()
+        self._dirty: Set[str] = set()
+        self._owned: Set[str] = set()
+        self._fetched_at: Dict[str, float] = {}
+        self._metadata_fetched_at: Dict[Tuple[str, str], float] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS status ("
+            "file_id TEXT PRIMARY KEY, status TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_status_status ON status (status)")
+        conn.commit()
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, fn, *args)
+
+    def _fresh(self, fetched_at: Optional[float]) -> bool:
+        return fetched_at is not None and time.monotonic() - fetched_at < self.read_ttl
+
+    async def get_metadata(self, key: str, kind: str = "metadata") -> Optional[Dict]:
+        metadata = await super().get_metadata(key, kind)
+        if metadata is not None and (not self.shared or self._fresh(self._metadata_fetched_at.get((kind, key)))):
+            # 移到最後，淘汰時最後才移除
+            self._metadata[(kind, key)] = self._metadata.pop((kind, key))
+            return metadata
+
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT data FROM metadata WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone())
+        if row is None:
+            return None
+        metadata = json.loads(row[0])
+        self._cache_metadata(key, metadata, kind)
+        return metadata
+
+    def _cache_metadata(self, key: str, metadata: Dict, kind: str):
+        """加入元資料快取（移到最後），超過 cache_entries 筆時移除最久未使用的"""
+        self._metadata.pop((kind, key), None)
+        self._metadata[(kind, key)] = dict(metadata)
+        self._metadata_fetched_at[(kind, key)] = time.monotonic()
+        while len(self._metadata) > self.cache_entries:
+            oldest = next(iter(self._metadata))
+            self._metadata.pop(oldest)
+            self._metadata_fetched_at.pop(oldest, None)
+
+    async def put_metadata(self, key: str, metadata: Dict, kind: str = "metadata"):
+        self._cache_metadata(key, metadata, kind)
+        data = json.dumps(metadata, ensure_ascii=False)
+
+        def write():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (kind, key, data) VALUES (?, ?, ?)", (kind, key, data)
+            )
+            self._conn.commit()
+
+        await self._run(write)
+
+    async def delete_metadata(self, key: str, kind: str = "metadata"):
+        await super().delete_metadata(key, kind)
+        self._metadata_fetched_at.pop((kind, key), None)
+
+        def delete():
+            self._conn.execute("DELETE FROM metadata WHERE kind = ? AND key = ?", (kind, key))
+            self._conn.commit()
+
+        await self._run(delete)
+
+    async def list_metadata(self, kind: str = "metadata") -> Dict[str, Dict]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT key, data FROM metadata WHERE kind = ?", (kind,)
+        ).fetchall())
+        return {key: json.loads(data) for key, data in rows}
+
+    async def list_statuses(self) -> Dict[str, Dict]:
+        rows = await self._run(lambda: self._conn.execute("SELECT file_id, data FROM status").fetchall())
+        statuses = {file_id: json.loads(data) for file_id, data in rows}
+        # 本行程尚未寫入的更新較新
+        for file_id in (self._dirty if self.shared else self._owned):
+            if file_id in self._status:
+                statuses[file_id] = dict(self._status[file_id])
+        return statuses
+
+    async def get_status(self, file_id: str) -> Optional[Dict]:
+        status = self._status.get(file_id)
+        owned = file_id in (self._dirty if self.shared else self._owned)
+        if status is not None and (owned or self._fresh(self._fetched_at.get(file_id))):
+            return dict(status)
+
+        row = await self._run(lambda: self._conn.execute(
+            "SELECT data FROM status WHERE file_id = ?", (file_id,)
+        ).fetchone())
+        if row is None:
+            return None
+        status = json.loads(row[0])
+        if status["status"] in TERMINAL_STATUSES and file_id not in self._dirty:
+            # 終止狀態每次由 SQLite 讀取，不留在快取中
+            self._evict(file_id)
+            return status
+        self._index_status(file_id, status)
+        self._fetched_at[file_id] = time.monotonic()
+        return dict(status)
+
+    async def put_status(self, file_id: str, status: Dict):
+        self._index_status(file_id, status)
+        self._fetched_at[file_id] = time.monotonic()
+        self._owned.add(file_id)
+        self._dirty.add(file_id)
+
+        if status["status"] in TERMINAL_STATUSES:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def delete_status(self, file_id: str):
+        await super().delete_status(file_id)
+        self._dirty.discard(file_id)
+        self._owned.discard(file_id)
+        self._fetched_at.pop(file_id, None)
+
+        def delete():
+            self._conn.execute("DELETE FROM status WHERE file_id = ?", (file_id,))
+            self._conn.commit()
+
+        await self._run(delete)
+
+    async def flush(self):
+        """將累積的狀態更新以單一交易寫入"""
+        if not self._dirty:
+            return
+        # 以狀態本身的時間為準：多個節點寫入同一工作時，延遲寫入的舊狀態不會覆蓋較新的狀態
+        rows = [
+            (
+                file_id, self._status[file_id]["status"], json.dumps(self._status[file_id], ensure_ascii=False),
+                self._status[file_id].get("timestamp") or time.time()
+            )
+            for file_id in self._dirty if file_id in self._status
+        ]
+        self._dirty.clear()
+        terminal = [row[0] for row in rows if row[1] in TERMINAL_STATUSES]
+
+        def write():
+            self._conn.executemany(
+                "INSERT INTO status (file_id, status, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (file_id) DO UPDATE SET status = excluded.status, data = excluded.data, "
+                "updated_at = excluded.updated_at WHERE excluded.updated_at >= status.updated_at", rows
+            )
+            self._conn.commit()
+
+        await self._run(write)
+        # 寫入期間又有新狀態的工作仍保留
+        for file_id in terminal:
+            if file_id not in self._dirty:
+                self._evict(file_id)
+
+    def _evict(self, file_id: str):
+        """將已寫入的終止工作移出記憶體"""
+        self._unindex_status(file_id)
+        self._owned.discard(file_id)
+        self._fetched_at.pop(file_id, None)
+        for kind in ("metadata", "result"):
+            self._metadata.pop((kind, file_id), None)
+            self._metadata_fetched_at.pop((kind, file_id), None)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[str]:
+        """已寫入的工作加上尚未寫入的更新（終止的工作不在記憶體中，需查詢資料庫）"""
+        def query():
+            if status is None:
+                return self._conn.execute("SELECT file_id FROM status").fetchall()
+            return self._conn.execute("SELECT file_id FROM status WHERE status = ?", (status,)).fetchall()
+
+        file_ids = {row[0] for row in self._db_executor.submit(query).result()}
+        for file_id in self._dirty:
+            if file_id not in self._status:
+                continue
+            if status is None or self._status[file_id]["status"] == status:
+                file_ids.add(file_id)
+            else:
+                file_ids.discard(file_id)
+        return list(file_ids)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        await self._run(self._conn.close)
+        self._db_executor.shutdown(wait=True)
+
+
+def job_store_path(data_dir: str) -> str:
+    return os.getenv("JOB_STORE_PATH", os.path.join(data_dir, "jobs.db"))
+
+
+def create_job_store(data_dir: str) -> JobStore:
+    """依 JOB_STORE 環境變數建立儲存（sqlite 或 memory）；使用共用佇列（JOB_QUEUE）時必須為 sqlite"""
+    backend = os.getenv("JOB_STORE", "sqlite")
+    shared = os.getenv("JOB_QUEUE", "local") != "local"
+    if backend == "memory":
+        if shared:
+            raise ValueError("JOB_QUEUE 共用佇列需要 JOB_STORE=sqlite，讓所有節點讀到相同的狀態")
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(job_store_path(data_dir), shared=shared)
+    raise ValueError(f"未知的 JOB_STORE: {backend}")
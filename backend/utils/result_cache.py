@@ -0,0 +1,124 @@
+import os
+import time
+import hashlib
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptCache:
+    """以音檔內容雜湊與轉換參數為鍵的轉換結果快取，依大小與存放時間淘汰
+
+    快取項目與結果檔案以硬連結共用同一份內容，命中時以檔案修改時間記錄最近使用；
+    句段檔（{key}.segments.jsonl）與結果文字一起保存與淘汰，命中後仍可產生字幕等其他格式。
+    """
+
+    def __init__(self, result_dir: str):
+        self.cache_dir = os.path.join(result_dir, "cache")
+        self.max_bytes = int(os.getenv("RESULT_CACHE_MAX_MB", 1024)) * 1024 * 1024
+        self.max_age = float(os.getenv("RESULT_CACHE_MAX_AGE_DAYS", 30)) * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash: str, model_size: str, language: str, include_timestamps: bool, engine: str = "torch", vad: bool = False, word_timestamps: bool = False) -> str:
+        raw = f"{content_hash}:{model_size}:{language}:{int(include_timestamps)}"
+        if engine != "torch":
+            # 預設引擎沿用原本的鍵，既有快取仍然有效
+            raw = f"{raw}:{engine}"
+        if vad:
+            raw = f"{raw}:vad"
+        if word_timestamps:
+            raw = f"{raw}:words"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    @staticmethod
+    def segments_path(entry_path: str) -> str:
+        """快取項目對應的句段檔"""
+        return f"{entry_path[:-len('.txt')]}.segments.jsonl"
+
+    def _remove(self, entry_path: str):
+        for path in (entry_path, self.segments_path(entry_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """返回快取項目路徑並更新最近使用時間，未命中或已過期返回 None"""
+        path = self._entry_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                self._remove(path)
+                self.evictions += 1
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def store(self, key: str, result_path: str, segments_path: Optional[str] = None):
+        """將結果檔案（與句段檔）加入快取（硬連結，不支援時複製）"""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先放句段檔，結果文字出現時句段檔已完整
+        if segments_path and os.path.exists(segments_path):
+            self._link(segments_path, self.segments_path(path))
+        self._link(result_path, path)
+
+    @staticmethod
+    def _link(source: str, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            import shutil
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _scan(self):
+        """列出快取項目（分散子目錄與舊版直接存放在快取目錄的項目）"""
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_dir():
+                    with os.scandir(entry.path) as shard:
+                        yield from (e for e in shard if e.name.endswith(".txt"))
+                elif entry.name.endswith(".txt"):
+                    yield entry
+
+    def evict(self):
+        """移除過期項目，並依最近使用時間淘汰直到總大小低於上限"""
+        now = time.time()
+        entries = []
+        total = 0
+        for entry in self._scan():
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age:
+                self._remove(entry.path)
+                self.evictions += 1
+                continue
+            try:
+                size = stat.st_size + os.path.getsize(self.segments_path(entry.path))
+            except FileNotFoundError:
+                size = stat.st_size
+            entries.append((stat.st_mtime, size, entry.path))
+            total += size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .job_queue import TranscriptionScheduler, TranscriptionJob, QueueFullError, SchedulerUnavailableError, PRIORITY_CLASSES
+from .job_store import job_store_path
+
+logger = logging.getLogger(__name__)
+
+
+def _wall_to_monotonic(timestamp: float) -> float:
+    """將其他節點記錄的時間（time.time()）換算為本行程的 time.monotonic()"""
+    return time.monotonic() - (time.time() - timestamp)
+
+
+def _monotonic_to_wall(timestamp: float) -> float:
+    return time.time() - (time.monotonic() - timestamp)
+
+
+class SharedJobQueue:
+    """多個 API 節點與推論節點共用的工作佇列
+
+    API 節點以 enqueue 加入工作；推論節點以 claim 領取並取得 lease_seconds 秒的租約，執行期間以 heartbeat
+    續約，完成（或失敗）後以 complete 移除。租約到期仍未續約（節點當機或失聯）的工作由 requeue_expired
+    重新排隊，領取超過 max_attempts 次仍未完成則放棄。處理狀態與結果不在佇列中，而是寫入共用的 JobStore。
+    cancel 移除排隊中的工作；執行中的工作則記錄取消要求，持有的節點在下一次 heartbeat 時得知並停止推論。
+    """
+
+    def __init__(self, lease_seconds: Optional[float] = None, max_attempts: Optional[int] = None):
+        self.lease_seconds = lease_seconds or float(os.getenv("JOB_LEASE_SECONDS", 30))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+    async def enqueue(self, job: TranscriptionJob, max_pending: Optional[int] = None):
+        """加入工作；已在佇列中時拋出 ValueError，排隊中的工作已達 max_pending 時拋出 QueueFullError"""
+        raise NotImplementedError
+
+    async def claim(self, worker_id: str, exclude_models: Iterable[str] = (), max_wait: float = 300, aging_seconds: float = 60) -> Optional[TranscriptionJob]:
+        """依優先等級（每等待 aging_seconds 秒提升一級）與最短工作優先（等待超過 max_wait 秒者依加入順序）
+        領取一個工作，沒有可領取的工作時返回 None"""
+        raise NotImplementedError
+
+    async def heartbeat(self, worker_id: str, file_ids: Iterable[str], info: Dict) -> Tuple[Set[str], Dict[str, str]]:
+        """續約並回報節點狀態，返回 (仍由此節點持有的工作（租約已被收回的不在其中）, {要求取消的工作: 原因})"""
+        raise NotImplementedError
+
+    async def cancel(self, file_id: str, reason: str = "") -> Optional[str]:
+        """排隊中的工作直接移除並返回 "queued"；執行中的記錄取消要求並返回 "running"；不在佇列中返回 None"""
+        raise NotImplementedError
+
+    async def expire_pending(self) -> List[str]:
+        """移除已超過期限、deadline_action 為 drop 的排隊工作，返回這些工作"""
+        raise NotImplementedError
+
+    async def complete(self, worker_id: str, file_id: str):
+        raise NotImplementedError
+
+    async def release(self, worker_id: str) -> List[str]:
+        """節點正常關閉：立即將持有的工作重新排隊（不計入嘗試次數），返回這些工作"""
+        raise NotImplementedError
+
+    async def requeue_expired(self) -> Tuple[List[str], List[str]]:
+        """將租約到期的工作重新排隊，返回 (重新排隊的工作, 超過嘗試次數而放棄的工作)"""
+        raise NotImplementedError
+
+    async def snapshot(self) -> Dict:
+        """{"pending": [工作], "running": [(工作, 開始時間)], "workers": [存活節點資訊]}，時間為本行程的 monotonic"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class SQLiteJobQueue(SharedJobQueue):
+    """以 SQLite 實作的共用佇列，適用於同一台主機上的多個行程或容器（資料庫放在共用的本機磁碟）
+
+    領取與續約都在 BEGIN IMMEDIATE 交易中進行，同一工作只會被一個節點領取。租約以各節點的系統時間
+    計算，節點間的時鐘誤差需遠小於 lease_seconds。
+    """
+
+    def __init__(self, db_path: str, lease_seconds: Optional[float] = None, max_attempts: Optional[int] = None):
+        super().__init__(lease_seconds, max_attempts)
+        self.db_path = db_path
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-queue")
+        self._conn = self._db_executor.submit(self._connect).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 自行控制交易；其他節點持有寫入鎖時最多等待 30 秒
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "file_id TEXT PRIMARY KEY, state TEXT NOT NULL, model_size TEXT NOT NULL, job TEXT NOT NULL, "
+            "estimated_seconds REAL, enqueued_at REAL NOT NULL, worker_id TEXT, lease_expires REAL, "
+            "started_at REAL, attempts INTEGER NOT NULL DEFAULT 0, priority INTEGER NOT NULL DEFAULT 0, "
+            "deadline REAL, cancel_reason TEXT)"
+        )
+        # 舊版建立的資料表補上優先等級、期限與取消欄位
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(queue)")}
+        for column, definition in (("priority", "INTEGER NOT NULL DEFAULT 0"), ("deadline", "REAL"), ("cancel_reason", "TEXT")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE queue ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_state ON queue (state, lease_expires)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL, info TEXT NOT NULL)"
+        )
+        return conn
+
+    async def _transaction(self, fn, mode: str = "IMMEDIATE"):
+        """在資料庫執行緒中以交易執行 fn(conn)；寫入使用 IMMEDIATE，一開始就取得寫入鎖"""
+        def run():
+            self._conn.execute(f"BEGIN {mode}")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, run)
+
+    @staticmethod
+    def _to_job(row) -> TranscriptionJob:
+        file_id, model_size, data, estimated_seconds, enqueued_at = row
+        data = json.loads(data)
+        return TranscriptionJob(
+            file_id=file_id,
+            model_size=model_size,
+            language=data["language"],
+            include_timestamps=data["include_timestamps"],
+            duration=data.get("duration"),
+            estimated_seconds=estimated_seconds,
+            kwargs=data.get("kwargs", {}),
+            enqueued_at=_wall_to_monotonic(enqueued_at),
+            priority=data.get("priority", "interactive"),
+            deadline=_wall_to_monotonic(data["deadline"]) if data.get("deadline") is not None else None,
+            deadline_action=data.get("deadline_action", "downgrade"),
+        )
+
+    async def enqueue(self, job: TranscriptionJob, max_pending: Optional[int] = None):
+        data = json.dumps({
+            "language": job.language,
+            "include_timestamps": job.include_timestamps,
+            "duration": job.duration,
+            "kwargs": job.kwargs,
+            "priority": job.priority,
+            # 期限以系統時間保存，其他節點再換算回各自的 monotonic
+            "deadline": _monotonic_to_wall(job.deadline) if job.deadline is not None else None,
+            "deadline_action": job.deadline_action,
+        }, ensure_ascii=False)
+        # deadline 欄位只記錄 drop 工作的期限，供 expire_pending 移除過期的排隊工作
+        deadline = _monotonic_to_wall(job.deadline) if job.deadline is not None and job.deadline_action == "drop" else None
+
+        def write(conn):
+            if conn.execute("SELECT 1 FROM queue WHERE file_id = ?", (job.file_id,)).fetchone():
+                raise ValueError(f"檔案已在處理中: {job.file_id}")
+            if max_pending and conn.execute("SELECT COUNT(*) FROM queue WHERE state = 'queued'").fetchone()[0] >= max_pending:
+                raise QueueFullError(f"轉換佇列已滿（{max_pending}）")
+            conn.execute(
+                "INSERT INTO queue (file_id, state, model_size, job, estimated_seconds, enqueued_at, priority, deadline) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job.file_id, job.model_size, data, job.estimated_seconds, time.time(),
+                 PRIORITY_CLASSES.get(job.priority, 0), deadline)
+            )
+
+        await self._transaction(write)
+
+    async def claim(self, worker_id: str, exclude_models: Iterable[str] = (), max_wait: float = 300, aging_seconds: float = 60) -> Optional[TranscriptionJob]:
+        exclude_models = tuple(exclude_models)
+        # 與 TranscriptionScheduler._order_key 相同的排序：等待過久者依加入順序，其餘依提升後的優先等級、預估時間
+        rank = f"MAX(0, priority - CAST((? - enqueued_at) / {float(aging_seconds)} AS INTEGER))" if aging_seconds else "priority"
+
+        def claim(conn):
+            now = time.time()
+            aged = now - max_wait
+            excluded = f" AND model_size NOT IN ({', '.join('?' * len(exclude_models))})" if exclude_models else ""
+            row = conn.execute(
+                "SELECT file_id, model_size, job, estimated_seconds, enqueued_at FROM queue "
+                f"WHERE state = 'queued'{excluded} "
+                "ORDER BY CASE WHEN enqueued_at <= ? THEN 0 ELSE 1 END, "
+                f"CASE WHEN enqueued_at <= ? THEN 0 ELSE {rank} END, "
+                "CASE WHEN enqueued_at <= ? THEN enqueued_at ELSE COALESCE(estimated_seconds, 1e18) END, enqueued_at "
+                "LIMIT 1",
+                (*exclude_models, aged, aged, *((now,) if aging_seconds else ()), aged)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE queue SET state = 'running', worker_id = ?, lease_expires = ?, started_at = ?, "
+                "attempts = attempts + 1 WHERE file_id = ?",
+                (worker_id, now + self.lease_seconds, now, row[0])
+            )
+            return row
+
+        row = await self._transaction(claim)
+        return self._to_job(row) if row is not None else None
+
+    async def heartbeat(self, worker_id: str, file_ids: Iterable[str], info: Dict) -> Tuple[Set[str], Dict[str, str]]:
+        file_ids = tuple(file_ids)
+        data = json.dumps(info, ensure_ascii=False)
+
+        def beat(conn):
+            now = time.time()
+            if file_ids:
+                conn.execute(
+                    f"UPDATE queue SET lease_expires = ? WHERE worker_id = ? AND state = 'running' "
+                    f"AND file_id IN ({', '.join('?' * len(file_ids))})",
+                    (now + self.lease_seconds, worker_id, *file_ids)
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat_at, info) VALUES (?, ?, ?)", (worker_id, now, data)
+            )
+            rows = conn.execute(
+                "SELECT file_id, cancel_reason FROM queue WHERE worker_id = ? AND state = 'running'", (worker_id,)
+            ).fetchall()
+            held = {file_id for file_id, _ in rows}
+            return held, {file_id: reason for file_id, reason in rows if reason is not None}
+
+        return await self._transaction(beat)
+
+    async def cancel(self, file_id: str, reason: str = "") -> Optional[str]:
+        def cancel(conn):
+            row = conn.execute("SELECT state FROM queue WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == "queued":
+                conn.execute("DELETE FROM queue WHERE file_id = ?", (file_id,))
+            else:
+                conn.execute("UPDATE queue SET cancel_reason = ? WHERE file_id = ?", (reason or "已取消", file_id))
+            return row[0]
+
+        return await self._transaction(cancel)
+
+    async def expire_pending(self) -> List[str]:
+        def expire(conn):
+            rows = conn.execute(
+                "SELECT file_id FROM queue WHERE state = 'queued' AND deadline < ?", (time.time(),)
+            ).fetchall()
+            conn.executemany("DELETE FROM queue WHERE file_id = ?", rows)
+            return [file_id for file_id, in rows]
+
+        return await self._transaction(expire)
+
+    async def complete(self, worker_id: str, file_id: str):
+        # 租約已被收回並由其他節點重新領取時不刪除
+        await self._transaction(lambda conn: conn.execute(
+            "DELETE FROM queue WHERE file_id = ? AND worker_id = ?", (file_id, worker_id)
+        ))
+
+    async def release(self, worker_id: str) -> List[str]:
+        def release(conn):
+            rows = conn.execute(
+                "SELECT file_id FROM queue WHERE worker_id = ? AND state = 'running'", (worker_id,)
+            ).fetchall()
+            conn.execute(
+                "UPDATE queue SET state = 'queued', worker_id = NULL, lease_expires = NULL, started_at = NULL, "
+                "attempts = MAX(attempts - 1, 0) WHERE worker_id = ? AND state = 'running'",
+                (worker_id,)
+            )
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            return [file_id for file_id, in rows]
+
+        return await self._transaction(release)
+
+    async def requeue_expired(self) -> Tuple[List[str], List[str]]:
+        def requeue(conn):
+            now = time.time()
+            rows = conn.execute(
+                "SELECT file_id, attempts FROM queue WHERE state = 'running' AND lease_expires < ?", (now,)
+            ).fetchall()
+            requeued = [file_id for file_id, attempts in rows if attempts < self.max_attempts]
+            abandoned = [file_id for file_id, attempts in rows if attempts >= self.max_attempts]
+            conn.executemany(
+                "UPDATE queue SET state = 'queued', worker_id = NULL, lease_expires = NULL, started_at = NULL "
+                "WHERE file_id = ?", [(file_id,) for file_id in requeued]
+            )
+            conn.executemany("DELETE FROM queue WHERE file_id = ?", [(file_id,) for file_id in abandoned])
+            # 失聯很久的節點不再列出
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - 10 * self.lease_seconds,))
+            return requeued, abandoned
+
+        return await self._transaction(requeue)
+
+    async def snapshot(self) -> Dict:
+        def read(conn):
+            now = time.time()
+            jobs = conn.execute(
+                "SELECT file_id, model_size, job, estimated_seconds, enqueued_at, state, started_at FROM queue"
+            ).fetchall()
+            workers = conn.execute(
+                "SELECT worker_id, info FROM workers WHERE heartbeat_at >= ?", (now - self.lease_seconds,)
+            ).fetchall()
+            return jobs, workers
+
+        jobs, workers = await self._transaction(read, mode="DEFERRED")
+        return {
+            "pending": [self._to_job(row[:5]) for row in jobs if row[5] == "queued"],
+            "running": [(self._to_job(row[:5]), _wall_to_monotonic(row[6])) for row in jobs if row[5] == "running"],
+            "workers": [{"worker_id": worker_id, **json.loads(info)} for worker_id, info in workers],
+        }
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._db_executor, self._conn.close)
+        self._db_executor.shutdown(wait=True)
+
+
+def create_shared_queue(data_dir: str) -> Optional[SharedJobQueue]:
+    """依 JOB_QUEUE 環境變數建立共用佇列；local（預設）表示在 API 行程內排程，返回 None"""
+    backend = os.getenv("JOB_QUEUE", "local")
+    if backend == "local":
+        return None
+    if backend == "sqlite":
+        # 預設與工作儲存使用同一個資料庫檔
+        return SQLiteJobQueue(os.getenv("JOB_QUEUE_PATH", job_store_path(data_dir)))
+    raise ValueError(f"未知的 JOB_QUEUE: {backend}")
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedQueueScheduler(TranscriptionScheduler):
+    """API 節點使用的排程器：工作加入共用佇列，由推論節點（python -m backend.worker）領取執行
+
+    API 節點本身不載入模型。排隊位置、預估時間與執行中的工作來自每 refresh_interval 秒更新一次的
+    佇列快照，因此介面與 TranscriptionScheduler 相同，任何一個 API 節點都能回答。
+    """
+
+    def __init__(
+        self,
+        queue: SharedJobQueue,
+        max_queue_size: Optional[int] = None,
+        max_wait: Optional[float] = None,
+        refresh_interval: Optional[float] = None,
+    ):
+        super().__init__(runner=None, num_workers=1, max_queue_size=max_queue_size, short_job_slots=0, max_wait=max_wait)
+        self.queue = queue
+        self.refresh_interval = refresh_interval or float(os.getenv("JOB_QUEUE_REFRESH_SECONDS", 1.0))
+        # 最近一次快照中存活的推論節點
+        self.workers: List[Dict] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._refresh_task is not None:
+            return
+        self._condition = asyncio.Condition()
+        await self.refresh()
+        self._accepting = True
+        self._refresh_task = asyncio.create_task(self._refresh_forever())
+        logger.info(f"共用轉換佇列已連線: {len(self.workers)} 個推論節點, 佇列上限 {self.max_queue_size}")
+
+    async def stop(self):
+        self._accepting = False
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+        await self.queue.close()
+
+    async def _refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"讀取共用佇列失敗: {e}")
+
+    async def refresh(self):
+        snapshot = await self.queue.snapshot()
+        self._set_pending(snapshot["pending"])
+        self._running = {job.file_id: job for job, _ in snapshot["running"]}
+        self._started_at = {job.file_id: started_at for job, started_at in snapshot["running"]}
+        self.workers = snapshot["workers"]
+        # 等待時間以所有存活節點的工作者總數估算
+        self.num_workers = max(1, sum(worker.get("slots", 1) for worker in self.workers))
+
+    async def submit(self, job: TranscriptionJob) -> int:
+        if not self._accepting:
+            raise SchedulerUnavailableError("轉換服務尚未就緒")
+        job.enqueued_at = time.monotonic()
+        await self.queue.enqueue(job, self.max_queue_size)
+        self._add_pending(job)
+        return self.get_position(job.file_id)
+
+    async def cancel(self, file_id: str, reason: str = "") -> Optional[str]:
+        state = await self.queue.cancel(file_id, reason)
+        if state == "queued":
+            self._remove_pending(file_id)
+        return state
@@ -0,0 +1,63 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class Tracer:
+    """記錄每個工作的各階段時間區段（上傳寫入、解碼、模型取得、推論、結果寫入），可匯出為 JSON
+
+    以 TRACING=1 啟用；只保留最近 max_jobs 個工作的紀錄。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, max_jobs: Optional[int] = None):
+        self.enabled = enabled if enabled is not None else os.getenv("TRACING", "0") == "1"
+        self.max_jobs = max_jobs or int(os.getenv("TRACE_MAX_JOBS", 500))
+        self._lock = threading.Lock()
+        self._traces: "OrderedDict[str, List[Dict]]" = OrderedDict()
+
+    def record(self, file_id: str, name: str, start: float, duration: float, **attributes):
+        """記錄一個區段；start 為 time.time() 的牆鐘時間"""
+        if not self.enabled:
+            return
+        span = {"name": name, "start": round(start, 6), "duration": round(duration, 6), **attributes}
+        with self._lock:
+            spans = self._traces.get(file_id)
+            if spans is None:
+                spans = self._traces[file_id] = []
+                while len(self._traces) > self.max_jobs:
+                    self._traces.popitem(last=False)
+            spans.append(span)
+
+    def add_spans(self, file_id: str, spans: List[Dict]):
+        """加入推論工作者回傳的區段"""
+        for span in spans:
+            self.record(file_id, **span)
+
+    @contextmanager
+    def span(self, file_id: str, name: str, **attributes):
+        """以 with 區塊量測一個區段（區塊內可 await）"""
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(file_id, name, start, time.perf_counter() - started, **attributes)
+
+    def get(self, file_id: str) -> Optional[List[Dict]]:
+        with self._lock:
+            spans = self._traces.get(file_id)
+            return sorted(spans, key=lambda span: span["start"]) if spans is not None else None
+
+    def dump(self) -> Dict[str, List[Dict]]:
+        with self._lock:
+            file_ids = list(self._traces.keys())
+        return {file_id: self.get(file_id) for file_id in file_ids}
+
+
+tracer = Tracer()
@@ -0,0 +1,227 @@
+"""推論節點：從共用佇列（JOB_QUEUE）領取轉換工作
+
+API 節點（uvicorn backend.app:app，可多個 --workers 或多個容器）只負責上傳、排隊與查詢，不載入模型；
+推論節點各自保有一個推論工作池，以租約領取工作並定期續約，狀態與結果寫入共用的工作儲存與結果目錄，
+任何 API 節點都能讀取。推論節點當機或失聯時，租約到期後工作會由其他節點重新領取。
+
+    JOB_QUEUE=sqlite UPLOAD_DIR=/shared/uploads RESULT_DIR=/shared/results python -m backend.worker
+    JOB_QUEUE=sqlite ... WHISPER_WORKERS=4 MODEL_CONCURRENCY=large=1 python -m backend.worker --worker-id gpu-1
+"""
+import os
+import sys
+import signal
+import asyncio
+import logging
+import argparse
+from typing import Dict, Optional, Set
+from .models.whisper_service import WhisperService
+from .utils.file_handler import FileHandler
+from .utils.job_queue import TranscriptionScheduler, TranscriptionJob
+from .utils.shared_queue import SharedJobQueue, create_shared_queue, default_worker_id
+
+logger = logging.getLogger(__name__)
+
+
+class QueueWorker:
+    """從共用佇列領取工作，交給本機的 TranscriptionScheduler 執行
+
+    本機排程器仍負責每模型並行上限與短音訊批次推論；只有在本機有空閒的工作者時才領取新工作，
+    已達 MODEL_CONCURRENCY 上限的模型不領取，留給其他節點。
+
+    API 節點的取消要求在下一次心跳時得知（最多延遲 lease_seconds / 3 秒），執行中的工作在下一個解碼窗口之前停止。
+    """
+
+    def __init__(self, queue: SharedJobQueue, whisper_service: WhisperService, worker_id: Optional[str] = None, poll_interval: Optional[float] = None):
+        self.queue = queue
+        self.whisper_service = whisper_service
+        self.file_handler = whisper_service.file_handler
+        self.worker_id = worker_id or default_worker_id()
+        self.poll_interval = poll_interval or float(os.getenv("JOB_QUEUE_POLL_SECONDS", 1.0))
+        self.scheduler = TranscriptionScheduler(
+            self._run,
+            num_workers=whisper_service.num_workers,
+            short_job_slots=whisper_service.batcher.max_batch_size if whisper_service.batcher.enabled else 0,
+            short_job_seconds=whisper_service.batch_max_seconds,
+            fit_deadline=lambda job, seconds_left: whisper_service.fit_model(
+                job.duration, job.model_size, job.kwargs.get("engine"), seconds_left
+            ),
+            on_expired=self._expire
+        )
+        whisper_service.queue_depth = lambda: self.scheduler.queue_depth
+        # 已領取（含尚在本機排隊）的工作，每次心跳續約
+        self._held: Set[str] = set()
+        # 已要求停止的工作，避免每次心跳重複處理
+        self._cancelling: Set[str] = set()
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    def info(self) -> Dict:
+        return {
+            "host": self.worker_id.split(":", 1)[0],
+            "pid": os.getpid(),
+            "slots": self.scheduler.num_workers,
+            "running": len(self._held),
+            "active": self.scheduler.active_per_model(),
+        }
+
+    async def start(self):
+        await self.whisper_service.load_estimator()
+        await self.scheduler.start()
+        await self.queue.heartbeat(self.worker_id, (), self.info())
+        self._tasks = [
+            asyncio.create_task(self._claim_loop()),
+            asyncio.create_task(self._heartbeat_loop()),
+            asyncio.create_task(self._requeue_loop()),
+            asyncio.create_task(self.whisper_service.warm_up()),
+        ]
+        logger.info(f"推論節點 {self.worker_id} 已啟動: {self.scheduler.num_workers} 個工作者，租約 {self.queue.lease_seconds}s")
+
+    async def stop(self):
+        """停止領取，將持有的工作立即交回佇列由其他節點處理"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.scheduler.stop()
+        for file_id in await self.queue.release(self.worker_id):
+            await self.file_handler.update_processing_status(file_id, "queued", 5, "重新排隊（推論節點關閉）")
+        await self.queue.close()
+        self.whisper_service.shutdown()
+        await self.file_handler.close()
+        logger.info(f"推論節點 {self.worker_id} 已停止")
+
+    def _has_room(self) -> bool:
+        return self.scheduler.queue_depth == 0 and len(self._held) < self.scheduler.num_workers + self.scheduler.short_job_slots
+
+    def _full_models(self) -> Set[str]:
+        active = self.scheduler.active_per_model()
+        return {model_size for model_size, limit in self.scheduler.model_limits.items() if active.get(model_size, 0) >= limit}
+
+    async def _claim_loop(self):
+        while True:
+            job = None
+            if self._has_room():
+                try:
+                    job = await self.queue.claim(
+                        self.worker_id, self._full_models(), self.scheduler.max_wait, self.scheduler.aging_seconds
+                    )
+                except Exception as e:
+                    logger.warning(f"領取工作失敗: {e}")
+            if job is not None:
+                self._held.add(job.file_id)
+                await self._submit(job)
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _submit(self, job: TranscriptionJob):
+        try:
+            await self.scheduler.submit(job)
+        except Exception as e:
+            logger.error(f"無法執行領取的工作 {job.file_id}: {e}")
+            self._held.discard(job.file_id)
+            await self.queue.complete(self.worker_id, job.file_id)
+
+    async def _run(self, file_id: str, model_size: str, language: str, include_timestamps: bool, **kwargs):
+        try:
+            # model_size 為 auto 時依語言選擇模型在推論節點進行
+            await self.whisper_service.run_job(file_id, model_size, language, include_timestamps, **kwargs)
+        finally:
+            self._held.discard(file_id)
+            self._cancelling.discard(file_id)
+            await self.queue.complete(self.worker_id, file_id)
+            self._wake.set()
+
+    async def _cancel(self, file_id: str, reason: str):
+        """停止已領取的工作：尚在本機排隊的直接移除並從佇列刪除，執行中的停止推論（由 _run 完成收尾）"""
+        if file_id in self._cancelling:
+            return
+        logger.info(f"取消工作 {file_id}: {reason}")
+        self._cancelling.add(file_id)
+        state = await self.scheduler.cancel(file_id, reason)
+        if state == "running":
+            self.whisper_service.cancel(file_id, reason)
+            return
+        await self.file_handler.update_processing_status(file_id, "cancelled", 0, "已取消", reason)
+        self._held.discard(file_id)
+        self._cancelling.discard(file_id)
+        await self.queue.complete(self.worker_id, file_id)
+        self._wake.set()
+
+    async def _expire(self, job: TranscriptionJob):
+        # 本機排隊中的工作已由排程器移出，scheduler.cancel 返回 None，與排隊中相同處理
+        await self._cancel(job.file_id, "已超過期限")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                held, cancel_requests = await self.queue.heartbeat(self.worker_id, list(self._held), self.info())
+            except Exception as e:
+                logger.warning(f"續約失敗: {e}")
+                continue
+            for file_id, reason in cancel_requests.items():
+                if file_id in self._held:
+                    await self._cancel(file_id, reason)
+            lost = self._held - held
+            if lost:
+                # 續約太慢，租約已被收回並重新排隊；本機仍會完成，但不再從佇列移除
+                logger.warning(f"工作租約已失效: {', '.join(sorted(lost))}")
+
+    async def _requeue_loop(self):
+        """收回當機節點的工作並移除過期的排隊工作（每個推論節點都會執行，交易保證只處理一次）"""
+        while True:
+            try:
+                requeued, abandoned = await self.queue.requeue_expired()
+                for file_id in requeued:
+                    logger.warning(f"工作租約到期，重新排隊: {file_id}")
+                    await self.file_handler.update_processing_status(file_id, "queued", 5, "重新排隊（推論節點失聯）")
+                for file_id in abandoned:
+                    logger.error(f"工作重試次數已達上限: {file_id}")
+                    await self.file_handler.update_processing_status(
+                        file_id, "error", 0, "錯誤", f"推論節點連續 {self.queue.max_attempts} 次在處理途中失聯，已放棄"
+                    )
+                for file_id in await self.queue.expire_pending():
+                    logger.info(f"排隊中的工作已超過期限: {file_id}")
+                    await self.file_handler.update_processing_status(file_id, "cancelled", 0, "已取消", "已超過期限")
+            except Exception as e:
+                logger.warning(f"收回逾期工作失敗: {e}")
+            await asyncio.sleep(self.queue.lease_seconds)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="從共用佇列領取轉換工作的推論節點")
+    parser.add_argument("--worker-id", default=None, help="節點名稱（預設 主機名稱:PID，需在叢集中唯一）")
+    return parser.parse_args(argv)
+
+
+async def serve(worker_id: Optional[str] = None) -> int:
+    file_handler = FileHandler()
+    queue = create_shared_queue(file_handler.upload_dir)
+    if queue is None:
+        print("推論節點需要共用佇列，請設定 JOB_QUEUE=sqlite", file=sys.stderr)
+        await file_handler.close()
+        return 2
+
+    worker = QueueWorker(queue, WhisperService(file_handler), worker_id)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    await worker.start()
+    await stopping.wait()
+    await worker.stop()
+    return 0
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    return asyncio.run(serve(args.worker_id))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,17 @@ class WhisperApp {
         this.apiBase = '/api';  // 使用相對路徑
         this.currentFileId = null;
         this.pollingInterval = null;
+        this.eventSource = null;
+        // 轉換進行中（離開頁面時取消，釋放伺服器的工作者）
+        this.transcribing = false;
+        
+        // 轉換中已取得的句段數，用於增量讀取
+        this.segmentCursor = 0;
+        this.fetchingSegments = false;
+        
+        // 超過此大小的檔案改用可續傳的分段上傳
+        this.resumableThreshold = 50 * 1024 * 1024;
+        this.maxChunkRetries = 5;
         
         // 進度條動畫配置
         this.progressConfig = {
@@ -10,7 +21,9 @@ class WhisperApp {
             targetProgress: 0,
             animationInterval: null,
             simulationInterval: null,
-            startTime: null
+            startTime: null,
+            // 伺服器依音訊長度與歷史即時率預估的處理秒數（含排隊）
+            estimatedSeconds: null
         };
         
         this.initializeElements();
@@ -43,6 +56,13 @@ class WhisperApp {
     }
     
     bindEvents() {
+        // 離開頁面時取消尚未完成的轉換
+        window.addEventListener('pagehide', () => {
+            if (this.transcribing && this.currentFileId) {
+                fetch(`${this.apiBase}/jobs/${this.currentFileId}`, { method: 'DELETE', keepalive: true });
+            }
+        });
+        
         // 檔案上傳事件
         this.elements.uploadArea.addEventListener('click', () => {
             this.elements.fileInput.click();
@@ -77,22 +97,38 @@ class WhisperApp {
         this.elements.downloadTextBtn.addEventListener('click', () => {
             this.downloadResult();
         });
+        
+        // 字幕格式由伺服器以保存的句段產生
+        document.querySelectorAll('.download-btn[data-format]').forEach((button) => {
+            button.addEventListener('click', () => {
+                if (!this.currentFileId) return;
+                window.location.href = `${this.apiBase}/download/${this.currentFileId}?format=${button.dataset.format}`;
+            });
+        });
     }
     
     async loadInitialData() {
         try {
             const response = await fetch(`${this.apiBase}/models`);
             const data = await response.json();
-            this.updateModelOptions(data.models);
+            this.updateModelOptions(data.models, data.routing || {});
         } catch (error) {
             console.error('Failed to load models:', error);
         }
     }
     
-    updateModelOptions(models) {
+    updateModelOptions(models, routing) {
         const select = document.getElementById('modelSelect');
         select.innerHTML = '';
         
+        // 伺服器設定了 MODEL_ROUTING 時可依偵測到的語言自動選擇模型
+        if (Object.keys(routing).length > 0) {
+            const option = document.createElement('option');
+            option.value = 'auto';
+            option.textContent = '自動 - 依語言選擇';
+            select.appendChild(option);
+        }
+        
         models.forEach(model => {
             const option = document.createElement('option');
             option.value = model.id;
@@ -108,7 +144,7 @@ class WhisperApp {
         // 顯示檔案資訊
         this.elements.fileName.textContent = file.name;
         this.elements.fileSize.textContent = `${(file.size / 1024 / 1024).toFixed(1)} MB`;
-        this.elements.estimatedTime.textContent = `${Math.max(0.5, file.size / 1024 / 1024 / 10).toFixed(1)} 分鐘`;
+        this.elements.estimatedTime.textContent = '計算中...';
         
         this.elements.fileInfo.style.display = 'block';
         this.elements.settingsSection.style.display = 'block';
@@ -118,23 +154,14 @@ class WhisperApp {
             this.elements.transcribeBtn.disabled = true;
             this.elements.transcribeBtn.textContent = '上傳中...';
             
-            const formData = new FormData();
-            formData.append('file', file);
-            
-            const response = await fetch(`${this.apiBase}/upload`, {
-                method: 'POST',
-                body: formData
-            });
+            const data = file.size > this.resumableThreshold
+                ? await this.uploadResumable(file)
+                : await this.uploadSingle(file);
             
-            const data = await response.json();
-            
-            if (response.ok) {
-                this.currentFileId = data.file_id;
-                this.elements.transcribeBtn.disabled = false;
-                this.elements.transcribeBtn.textContent = '🚀 開始轉換';
-            } else {
-                throw new Error(data.detail);
-            }
+            this.currentFileId = data.file_id;
+            this.elements.estimatedTime.textContent = this.formatSeconds(data.estimated_seconds);
+            this.elements.transcribeBtn.disabled = false;
+            this.elements.transcribeBtn.textContent = '🚀 開始轉換';
         } catch (error) {
             alert(`上傳失敗: ${error.message}`);
             this.elements.transcribeBtn.disabled = false;
@@ -142,6 +169,86 @@ class WhisperApp {
         }
     }
     
+    async uploadSingle(file) {
+        const formData = new FormData();
+        formData.append('file', file);
+        
+        const response = await fetch(`${this.apiBase}/upload`, {
+            method: 'POST',
+            body: formData
+        });
+        
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.detail);
+        }
+        return data;
+    }
+    
+    async uploadResumable(file) {
+        // 建立上傳工作階段
+        const sessionResponse = await fetch(`${this.apiBase}/upload/sessions`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        const session = await sessionResponse.json();
+        if (!sessionResponse.ok) {
+            throw new Error(session.detail);
+        }
+        
+        const chunkSize = Math.max(session.chunk_size, 8 * 1024 * 1024);
+        let offset = session.offset;
+        let retries = 0;
+        
+        while (offset < file.size) {
+            const end = Math.min(offset + chunkSize, file.size);
+            try {
+                const response = await fetch(`${this.apiBase}/upload/sessions/${session.session_id}`, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Range': `bytes ${offset}-${end - 1}/${file.size}`
+                    },
+                    body: file.slice(offset, end)
+                });
+                const data = await response.json();
+                
+                if (response.ok) {
+                    offset = data.offset;
+                    retries = 0;
+                } else if (response.status === 409) {
+                    // 伺服器已接收的位置與本地不同，從伺服器的位置繼續
+                    offset = data.detail.offset;
+                } else {
+                    throw new Error(data.detail);
+                }
+            } catch (error) {
+                // 連線中斷：查詢伺服器已接收的位置後續傳
+                if (++retries > this.maxChunkRetries) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                const statusResponse = await fetch(`${this.apiBase}/upload/sessions/${session.session_id}`);
+                if (statusResponse.ok) {
+                    offset = (await statusResponse.json()).offset;
+                }
+            }
+            
+            this.elements.transcribeBtn.textContent = `上傳中... ${Math.floor(offset / file.size * 100)}%`;
+        }
+        
+        const completeResponse = await fetch(`${this.apiBase}/upload/sessions/${session.session_id}/complete`, {
+            method: 'POST'
+        });
+        const data = await completeResponse.json();
+        if (!completeResponse.ok) {
+            throw new Error(data.detail.message || data.detail);
+        }
+        return data;
+    }
+    
     async startTranscription() {
         if (!this.currentFileId) return;
         
@@ -170,13 +277,21 @@ class WhisperApp {
             });
             
             if (response.ok) {
+                const data = await response.json();
+                this.transcribing = true;
+                this.progressConfig.estimatedSeconds = data.estimated_seconds || null;
+                
+                // 重置即時結果
+                this.segmentCursor = 0;
+                this.elements.resultText.value = '';
+                
                 // 重置進度配置
                 this.progressConfig.currentProgress = 0;
                 this.progressConfig.targetProgress = 0;
                 this.progressConfig.startTime = Date.now();
                 
-                // 開始輪詢狀態
-                this.startPolling();
+                // 優先以 SSE 接收狀態推送，不支援或中斷時改為輪詢
+                this.startStatusUpdates();
                 
                 // 開始進度模擬
                 this.startProgressSimulation();
@@ -191,6 +306,34 @@ class WhisperApp {
         }
     }
     
+    startStatusUpdates() {
+        if (!window.EventSource) {
+            this.startPolling();
+            return;
+        }
+        
+        this.stopEventStream();
+        this.eventSource = new EventSource(`${this.apiBase}/events/${this.currentFileId}`);
+        
+        this.eventSource.onmessage = (event) => {
+            this.handleStatusUpdate(JSON.parse(event.data));
+        };
+        
+        this.eventSource.onerror = () => {
+            // 推送中斷，改用輪詢備援
+            console.warn('狀態推送中斷，改用輪詢');
+            this.stopEventStream();
+            this.startPolling();
+        };
+    }
+    
+    stopEventStream() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+    
     startPolling() {
         if (this.pollingInterval) {
             clearInterval(this.pollingInterval);
@@ -236,22 +379,58 @@ class WhisperApp {
         // 更新進度條和文字
         this.updateProgress(progress, stage);
         
+        // 以伺服器的剩餘時間校正進度模擬速度
+        if (status.estimated_remaining !== undefined && this.progressConfig.startTime) {
+            const elapsed = (Date.now() - this.progressConfig.startTime) / 1000;
+            this.progressConfig.estimatedSeconds = elapsed + status.estimated_remaining;
+        }
+        
         // 儲存處理時間到狀態中
         if (status.processing_time) {
             this.processingTime = status.processing_time;
         }
         
+        // 轉換進行中即時顯示已產生的句段
+        if (status.status === 'processing' && progress >= 30) {
+            this.fetchNewSegments();
+        }
+        
         // 處理完成或錯誤狀態
         if (status.status === 'completed') {
             this.onProcessingComplete(status);
-        } else if (status.status === 'error') {
+        } else if (status.status === 'error' || status.status === 'cancelled') {
             this.onProcessingError(status);
         }
     }
     
     
+    async fetchNewSegments() {
+        if (this.fetchingSegments || !this.currentFileId) return;
+        this.fetchingSegments = true;
+        
+        try {
+            const response = await fetch(`${this.apiBase}/result/${this.currentFileId}/segments?after=${this.segmentCursor}`);
+            if (response.ok) {
+                const data = await response.json();
+                if (data.segments.length > 0) {
+                    this.elements.resultText.value += data.segments.map(segment => segment.text).join('');
+                    this.elements.resultsSection.style.display = 'block';
+                    this.elements.wordCount.textContent = data.word_count;
+                    this.elements.charCount.textContent = data.char_count;
+                }
+                this.segmentCursor = data.next;
+            }
+        } catch (error) {
+            console.error('獲取即時句段失敗:', error);
+        } finally {
+            this.fetchingSegments = false;
+        }
+    }
+    
     async onProcessingComplete(status) {
-        // 停止輪詢和進度模擬
+        this.transcribing = false;
+        // 停止推送、輪詢和進度模擬
+        this.stopEventStream();
         if (this.pollingInterval) {
             clearInterval(this.pollingInterval);
             this.pollingInterval = null;
@@ -302,7 +481,9 @@ class WhisperApp {
     }
     
     onProcessingError(status) {
-        // 停止輪詢和進度模擬
+        this.transcribing = false;
+        // 停止推送、輪詢和進度模擬
+        this.stopEventStream();
         if (this.pollingInterval) {
             clearInterval(this.pollingInterval);
             this.pollingInterval = null;
@@ -310,8 +491,9 @@ class WhisperApp {
         this.stopProgressSimulation();
         
         // 顯示錯誤
-        this.updateProgress(0, '處理失敗');
-        alert(`轉換失敗: ${status.message}`);
+        const cancelled = status.status === 'cancelled';
+        this.updateProgress(0, cancelled ? '已取消' : '處理失敗');
+        alert(`${cancelled ? '轉換已取消' : '轉換失敗'}: ${status.message}`);
         
         // 重置UI
         this.elements.transcribeBtn.disabled = false;
@@ -403,9 +585,12 @@ class WhisperApp {
                 shouldSimulate = true;
                 increaseRate = Math.random() * 0.5 + 0.3; // 0.3-0.8%
             } else if (this.progressConfig.targetProgress >= 20 && this.progressConfig.targetProgress < 95) {
-                // 主要處理階段：較慢的模擬（轉換需要時間）
+                // 主要處理階段：依預估處理時間推進，沒有預估時緩慢推進
                 shouldSimulate = true;
-                increaseRate = Math.random() * 0.15 + 0.05; // 0.05-0.2%
+                const estimated = this.progressConfig.estimatedSeconds;
+                increaseRate = estimated
+                    ? 65 * 0.8 / estimated  // 30%~95% 的區間在預估時間內走完
+                    : Math.random() * 0.15 + 0.05; // 0.05-0.2%
             }
             
             if (shouldSimulate) {
@@ -419,6 +604,12 @@ class WhisperApp {
         }, 800); // 每800ms微調一次，讓進度更穩定
     }
     
+    formatSeconds(seconds) {
+        if (!seconds && seconds !== 0) return '-';
+        if (seconds < 60) return `約 ${Math.max(1, Math.round(seconds))} 秒`;
+        return `約 ${(seconds / 60).toFixed(1)} 分鐘`;
+    }
+    
     stopProgressSimulation() {
         if (this.progressConfig.simulationInterval) {
             clearInterval(this.progressConfig.simulationInterval);
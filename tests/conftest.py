@@ -0,0 +1,17 @@
+import asyncio
+
+import pytest
+
+from backend.utils.file_handler import FileHandler
+
+
+@pytest.fixture
+def file_handler(tmp_path, monkeypatch):
+    """以暫存目錄與記憶體儲存建立的 FileHandler"""
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setenv("RESULT_DIR", str(tmp_path / "results"))
+    monkeypatch.setenv("JOB_STORE", "memory")
+    monkeypatch.delenv("JOB_QUEUE", raising=False)
+    handler = FileHandler()
+    yield handler
+    asyncio.run(handler.close())
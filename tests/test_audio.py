@@ -0,0 +1,119 @@
+import numpy as np
+
+from backend.models.audio import SAMPLE_RATE, SPLIT_SEARCH_SECONDS, SegmentSequencer, find_split_points, plan_chunks, stitch_segments
+from backend.models.preprocess import chunk_seconds_setting
+
+
+def test_plan_chunks_adds_overlap_within_bounds():
+    chunks = plan_chunks(100.0, [40.0, 70.0], overlap=1.0)
+
+    assert [(chunk["start"], chunk["end"]) for chunk in chunks] == [(0.0, 40.0), (40.0, 70.0), (70.0, 100.0)]
+    assert chunks[0]["decode_start"] == 0.0
+    assert chunks[0]["decode_duration"] == 41.0
+    assert chunks[1]["decode_start"] == 39.0
+    assert chunks[1]["decode_duration"] == 32.0
+    # 最後一段不超過音訊結尾
+    assert chunks[2]["decode_start"] + chunks[2]["decode_duration"] == 100.0
+
+
+def test_plan_chunks_without_splits_is_a_single_chunk():
+    assert plan_chunks(12.5, []) == [{"start": 0.0, "end": 12.5, "decode_start": 0.0, "decode_duration": 12.5}]
+
+
+def test_find_split_points_prefers_silence():
+    audio = np.full(60 * SAMPLE_RATE, 8000, dtype=np.int16)
+    audio[28 * SAMPLE_RATE:29 * SAMPLE_RATE] = 0
+
+    splits = find_split_points(audio, chunk_seconds=25.0, search_seconds=10.0)
+
+    assert len(splits) == 1
+    assert 28.0 <= splits[0] <= 29.0
+
+
+def test_find_split_points_clamps_search_to_start():
+    audio = np.full(40 * SAMPLE_RATE, 8000, dtype=np.int16)
+    audio[3 * SAMPLE_RATE:4 * SAMPLE_RATE] = 0
+
+    splits = find_split_points(audio, chunk_seconds=5.0, search_seconds=10.0)
+
+    assert 3.0 <= splits[0] <= 4.0
+
+
+def test_find_split_points_ignores_window_edges_on_continuous_speech():
+    # 連續語音中只有一處能量稍低，不應切在搜尋範圍的邊界
+    audio = np.full(100 * SAMPLE_RATE, 8000, dtype=np.int16)
+    audio[45 * SAMPLE_RATE:46 * SAMPLE_RATE] = 6000
+
+    splits = find_split_points(audio, chunk_seconds=40.0, search_seconds=30.0)
+
+    assert len(splits) == 1
+    assert 45.0 <= splits[0] <= 46.0
+
+
+def test_chunk_seconds_setting_enforces_minimum(monkeypatch):
+    monkeypatch.setenv("CHUNK_SECONDS", "10")
+    assert chunk_seconds_setting() == 2 * SPLIT_SEARCH_SECONDS
+
+    monkeypatch.setenv("CHUNK_SECONDS", "120")
+    assert chunk_seconds_setting() == 120.0
+
+
+def test_stitch_segments_drops_overlap_and_orders_chunks():
+    chunks = plan_chunks(20.0, [10.0], overlap=1.0)
+    first = {"language": "en", "segments": [
+        {"start": 0.0, "end": 4.0, "text": " a"},
+        {"start": 4.0, "end": 9.5, "text": " b"},
+        # 中點落在下一段，由下一段負責
+        {"start": 9.5, "end": 11.0, "text": " overlap"},
+    ]}
+    # 第二段從 9 秒開始解碼，時間相對於解碼起點
+    second = {"language": "en", "segments": [
+        {"start": 0.5, "end": 2.0, "text": " c"},
+        {"start": 2.0, "end": 11.0, "text": " d"},
+    ]}
+
+    result = stitch_segments([(chunks[1], second), (chunks[0], first)])
+
+    assert result["text"] == " a b c d"
+    assert [(s["start"], s["end"]) for s in result["segments"]] == [(0.0, 4.0), (4.0, 9.5), (9.5, 11.0), (11.0, 20.0)]
+    assert result["language"] == "en"
+
+
+def test_stitch_segments_keeps_segments_ending_at_the_last_chunk():
+    chunks = plan_chunks(10.0, [5.0], overlap=0.0)
+    result = stitch_segments([
+        (chunks[0], {"segments": [{"start": 0.0, "end": 5.0, "text": " a"}]}),
+        (chunks[1], {"segments": [{"start": 4.0, "end": 6.0, "text": " tail"}]}),
+    ])
+
+    assert [s["text"] for s in result["segments"]] == [" a", " tail"]
+    assert result["language"] is None
+
+
+def test_segment_sequencer_holds_later_chunks_until_earlier_finish():
+    chunks = plan_chunks(20.0, [10.0], overlap=0.0)
+    sequencer = SegmentSequencer(chunks)
+
+    # 第二段先產生句段，第一段完成前不釋出
+    assert sequencer.add(1, [{"start": 1.0, "end": 2.0, "text": " c"}]) == []
+    assert [s["text"] for s in sequencer.add(0, [{"start": 0.0, "end": 3.0, "text": " a"}])] == [" a"]
+
+    released = sequencer.finish(0, [{"start": 0.0, "end": 3.0, "text": " a"}, {"start": 3.0, "end": 9.0, "text": " b"}])
+    assert [(s["text"], s["start"]) for s in released] == [(" b", 3.0), (" c", 11.0)]
+
+    # 最終結果只補齊尚未釋出的句段
+    released = sequencer.finish(1, [{"start": 1.0, "end": 2.0, "text": " c"}, {"start": 2.0, "end": 10.0, "text": " d"}])
+    assert [s["text"] for s in released] == [" d"]
+    assert sequencer.add(1, [{"start": 5.0, "end": 6.0, "text": " late"}]) == []
+
+
+def test_segment_sequencer_matches_stitch_segments():
+    chunks = plan_chunks(20.0, [10.0], overlap=1.0)
+    results = [
+        {"segments": [{"start": 0.0, "end": 5.0, "text": " a"}, {"start": 5.0, "end": 10.5, "text": " b"}]},
+        {"segments": [{"start": 0.0, "end": 1.5, "text": " dup"}, {"start": 1.5, "end": 11.0, "text": " c"}]},
+    ]
+    sequencer = SegmentSequencer(chunks)
+    streamed = sequencer.finish(1, results[1]["segments"]) + sequencer.finish(0, results[0]["segments"])
+
+    assert streamed == stitch_segments(list(zip(chunks, results)))["segments"]
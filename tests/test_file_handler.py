@@ -0,0 +1,81 @@
+import asyncio
+
+from backend.utils.file_handler import UploadRangeError
+
+
+def _texts(segments):
+    return [segment["text"] for segment in segments]
+
+
+def test_get_segments_seeks_past_earlier_segments(file_handler):
+    async def run():
+        await file_handler.reset_result("job1")
+        await file_handler.append_segments("job1", [{"start": 0, "end": 1, "text": "中文"}, {"start": 1, "end": 2, "text": "b"}])
+        await file_handler.append_segments("job1", [{"start": 2, "end": 3, "text": "c"}])
+        return [_texts(await file_handler.get_segments("job1", after)) for after in range(5)]
+
+    assert asyncio.run(run()) == [["中文", "b", "c"], ["b", "c"], ["c"], [], []]
+
+
+def test_get_segments_reads_lines_not_yet_indexed(file_handler):
+    async def run():
+        await file_handler.reset_result("job1")
+        await file_handler.append_segments("job1", [{"start": 0, "end": 1, "text": "a"}, {"start": 1, "end": 2, "text": "b"}])
+        # 句段已寫入、索引尚未寫入
+        with open(file_handler._segments_path("job1"), "a", encoding="utf-8") as f:
+            f.write('{"start":2,"end":3,"text":"c"}\n')
+        return _texts(await file_handler.get_segments("job1", 1)), _texts(await file_handler.get_segments("job1", 3))
+
+    assert asyncio.run(run()) == (["b", "c"], [])
+
+
+def test_get_segments_after_final_result_replaces_live_segments(file_handler):
+    async def run():
+        await file_handler.reset_result("job1")
+        await file_handler.append_segments("job1", [{"start": 0, "end": 1, "text": "live segment"}])
+        await file_handler.save_result("job1", "x y", [{"start": 0, "end": 1, "text": "x"}, {"start": 1, "end": 2, "text": "y"}])
+        return _texts(await file_handler.get_segments("job1", 1)), _texts(await file_handler.get_segments("job1"))
+
+    assert asyncio.run(run()) == (["y"], ["x", "y"])
+
+
+async def _stream(*chunks, delay=0.0):
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        yield chunk
+
+
+def test_append_upload_chunk_serializes_overlapping_retries(file_handler):
+    async def run():
+        session = await file_handler.create_upload_session("a.wav", 8)
+        session_id = session["session_id"]
+        # 重試與仍在進行的同一區段同時送達：只有一個能附加
+        results = await asyncio.gather(
+            file_handler.append_upload_chunk(session_id, 0, 3, 8, _stream(b"ab", b"cd", delay=0.01)),
+            file_handler.append_upload_chunk(session_id, 0, 3, 8, _stream(b"abcd")),
+            return_exceptions=True,
+        )
+        return results, (await file_handler.get_upload_session(session_id))["offset"]
+
+    results, offset = asyncio.run(run())
+    assert offset == 4
+    assert [type(result).__name__ for result in results] == ["dict", "UploadOffsetError"]
+
+
+def test_append_upload_chunk_rejects_range_mismatch(file_handler):
+    async def run():
+        session = await file_handler.create_upload_session("a.wav", 8)
+        session_id = session["session_id"]
+        await file_handler.append_upload_chunk(session_id, 0, 1, 8, _stream(b"ab"))
+        errors = []
+        for end, total, chunks in [(5, 8, (b"cd",)), (3, 8, (b"cd", b"ef")), (3, 9, (b"cd",))]:
+            try:
+                await file_handler.append_upload_chunk(session_id, 2, end, total, _stream(*chunks))
+            except UploadRangeError:
+                errors.append(end)
+        return errors, (await file_handler.get_upload_session(session_id))["offset"]
+
+    errors, offset = asyncio.run(run())
+    assert errors == [5, 3, 3]
+    # 不符的區段截回起始位置
+    assert offset == 2
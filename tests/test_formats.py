@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from backend.utils.formats import format_clock, render
+
+SEGMENTS = [
+    {"start": 0.0, "end": 1.5, "text": " Hello -->", "words": [
+        {"start": 0.0, "end": 0.6, "word": " Hello"}, {"start": 0.6, "end": 1.5, "word": " -->"},
+    ]},
+    {"start": 3661.25, "end": 3662.0, "text": " 第二\t句"},
+]
+
+
+def rendered(output_format, segments=SEGMENTS, language=None):
+    return "".join(render(output_format, iter(segments), language))
+
+
+def test_format_clock():
+    assert format_clock(0) == "00:00:00,000"
+    assert format_clock(3661.2506) == "01:01:01,251"
+    assert format_clock(59.9996, ".") == "00:01:00.000"
+    assert format_clock(-1) == "00:00:00,000"
+
+
+def test_render_srt():
+    assert rendered("srt") == (
+        "1\n00:00:00,000 --> 00:00:01,500\nHello ->\n\n"
+        "2\n01:01:01,250 --> 01:01:02,000\n第二\t句\n\n"
+    )
+
+
+def test_render_vtt():
+    assert rendered("vtt") == (
+        "WEBVTT\n\n"
+        "00:00:00.000 --> 00:00:01.500\nHello ->\n\n"
+        "01:01:01.250 --> 01:01:02.000\n第二\t句\n\n"
+    )
+
+
+def test_render_tsv_uses_milliseconds_and_escapes_tabs():
+    assert rendered("tsv") == "start\tend\ttext\n0\t1500\tHello -->\n3661250\t3662000\t第二 句\n"
+
+
+def test_render_words():
+    assert rendered("words") == "start\tend\tword\n0\t600\tHello\n600\t1500\t-->\n"
+
+
+def test_render_json_streams_a_complete_document():
+    document = json.loads(rendered("json", language="zh"))
+
+    assert document["language"] == "zh"
+    assert document["segments"] == SEGMENTS
+    assert document["text"] == "Hello --> 第二\t句"
+
+
+def test_render_empty_segments():
+    assert rendered("srt", []) == ""
+    assert json.loads(rendered("json", [])) == {"language": None, "segments": [], "text": ""}
+
+
+def test_render_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        render("txt", SEGMENTS)
@@ -0,0 +1,55 @@
+import os
+import time
+import asyncio
+
+from backend.utils.janitor import PCM_GRACE_SECONDS, StorageJanitor
+
+
+def make_pcm(file_handler, key, age):
+    path = file_handler.pcm_paths(key, {"content_hash": key})[0]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * 10)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def make_janitor(file_handler):
+    return StorageJanitor(file_handler, lambda file_id: False, interval=0, upload_ttl=60, result_ttl=0, quota_bytes=0, session_ttl=0)
+
+
+def test_sweep_removes_only_old_unreferenced_pcm(file_handler):
+    orphan = make_pcm(file_handler, "aaaa", PCM_GRACE_SECONDS + 10)
+    fresh = make_pcm(file_handler, "bbbb", 0)
+
+    report = asyncio.run(make_janitor(file_handler).run_once())
+
+    assert report["removed_files"] == 1
+    assert not os.path.exists(orphan)
+    assert os.path.exists(fresh)
+
+
+def test_pcm_for_upload_during_sweep_is_kept(file_handler):
+    janitor = make_janitor(file_handler)
+    reused = make_pcm(file_handler, "cccc", PCM_GRACE_SECONDS + 10)
+    sweep = janitor._sweep
+
+    async def run():
+        loop = asyncio.get_running_loop()
+
+        def sweep_then_upload(*args):
+            # 列出工作之後、刪除之前，有相同內容的新上傳
+            result = sweep(*args)
+            asyncio.run_coroutine_threadsafe(file_handler.store.put_metadata(
+                "late", {"stored_filename": "late.wav", "content_hash": "cccc", "created_at": time.time()}
+            ), loop).result()
+            return result
+
+        janitor._sweep = sweep_then_upload
+        return await janitor.run_once()
+
+    report = asyncio.run(run())
+
+    assert report["removed_files"] == 0
+    assert os.path.exists(reused)
@@ -0,0 +1,193 @@
+import time
+import asyncio
+
+import pytest
+
+from backend.utils.job_queue import QueueFullError, TranscriptionJob, TranscriptionScheduler
+
+
+class Recorder:
+    """記錄執行順序的 runner；blocker 工作在 release() 之前不結束，讓其他工作留在佇列中"""
+
+    def __init__(self):
+        self.order = []
+        self.models = {}
+        self._released = None
+
+    async def __call__(self, file_id, model_size, **kwargs):
+        if self._released is None:
+            self._released = asyncio.Event()
+        if file_id == "blocker":
+            await self._released.wait()
+            return
+        self.order.append(file_id)
+        self.models[file_id] = model_size
+
+    def release(self):
+        self._released.set()
+
+
+def make_job(file_id, estimated=None, waited=0.0, **kwargs):
+    return TranscriptionJob(
+        file_id=file_id, model_size="base", language="en", include_timestamps=False,
+        estimated_seconds=estimated, enqueued_at=time.monotonic() - waited, **kwargs
+    )
+
+
+async def run_queued(scheduler, recorder, jobs):
+    """讓 blocker 佔住唯一的工作者，加入 jobs 後返回排隊位置與實際執行順序"""
+    await scheduler.start()
+    try:
+        await scheduler.submit(make_job("blocker"))
+        await asyncio.sleep(0)
+        for job in jobs:
+            await scheduler.submit(job)
+        positions = {job.file_id: scheduler.get_position(job.file_id) for job in jobs}
+        recorder.release()
+        while scheduler.queue_depth or len(recorder.order) < len(jobs):
+            await asyncio.sleep(0.01)
+        return positions, recorder.order
+    finally:
+        await scheduler.stop()
+
+
+def make_scheduler(recorder, **kwargs):
+    options = {"num_workers": 1, "max_queue_size": 10, "model_limits": {}, "short_job_slots": 0, "max_wait": 300, "aging_seconds": 60}
+    return TranscriptionScheduler(runner=recorder, **{**options, **kwargs})
+
+
+def test_shortest_job_first():
+    recorder = Recorder()
+    jobs = [make_job("long", 30), make_job("short", 5), make_job("unknown"), make_job("medium", 10)]
+
+    positions, order = asyncio.run(run_queued(make_scheduler(recorder), recorder, jobs))
+
+    assert order == ["short", "medium", "long", "unknown"]
+    assert positions == {"short": 1, "medium": 2, "long": 3, "unknown": 4}
+
+
+def test_jobs_waiting_past_max_wait_run_in_arrival_order():
+    recorder = Recorder()
+    jobs = [make_job("short", 1), make_job("old", 100, waited=400), make_job("older", 500, waited=500)]
+
+    _, order = asyncio.run(run_queued(make_scheduler(recorder), recorder, jobs))
+
+    assert order == ["older", "old", "short"]
+
+
+def test_submit_rejects_full_queue_and_duplicates():
+    async def run():
+        scheduler = make_scheduler(Recorder(), max_queue_size=1)
+        await scheduler.start()
+        try:
+            await scheduler.submit(make_job("blocker"))
+            await asyncio.sleep(0)
+            assert await scheduler.submit(make_job("a")) == 1
+            with pytest.raises(ValueError):
+                await scheduler.submit(make_job("a"))
+            with pytest.raises(QueueFullError):
+                await scheduler.submit(make_job("b"))
+            assert scheduler.get_position("blocker") == 0
+            assert scheduler.get_position("b") is None
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(run())
+
+
+def test_estimate_wait_sums_jobs_ahead():
+    async def run():
+        scheduler = make_scheduler(Recorder())
+        await scheduler.start()
+        try:
+            await scheduler.submit(make_job("blocker", 10))
+            await asyncio.sleep(0)
+            await scheduler.submit(make_job("a", 5))
+            await scheduler.submit(make_job("b", 20))
+            return scheduler.estimate_wait("a"), scheduler.estimate_wait("b"), scheduler.estimate_wait()
+        finally:
+            await scheduler.stop()
+
+    wait_a, wait_b, wait_new = asyncio.run(run())
+    assert wait_a == pytest.approx(10, abs=0.5)
+    assert wait_b == pytest.approx(15, abs=0.5)
+    assert wait_new == pytest.approx(35, abs=0.5)
+
+
+def test_interactive_jobs_run_before_batch_until_batch_jobs_age():
+    recorder = Recorder()
+    jobs = [
+        make_job("batch", 1, priority="batch"),
+        make_job("interactive", 50),
+        # 等待超過一個 aging 週期，與互動工作同級，依預估時間排序
+        make_job("aged-batch", 2, waited=61, priority="batch"),
+    ]
+
+    _, order = asyncio.run(run_queued(make_scheduler(recorder), recorder, jobs))
+
+    assert order == ["aged-batch", "interactive", "batch"]
+
+
+def test_cancel_removes_queued_job():
+    async def run():
+        recorder = Recorder()
+        scheduler = make_scheduler(recorder)
+        await scheduler.start()
+        try:
+            await scheduler.submit(make_job("blocker"))
+            await asyncio.sleep(0)
+            await scheduler.submit(make_job("a", 1))
+            await scheduler.submit(make_job("b", 2))
+            states = await scheduler.cancel("a"), await scheduler.cancel("blocker"), await scheduler.cancel("missing")
+            position = scheduler.get_position("b")
+            recorder.release()
+            while scheduler.queue_depth or not recorder.order:
+                await asyncio.sleep(0.01)
+            return states, position, recorder.order
+        finally:
+            await scheduler.stop()
+
+    states, position, order = asyncio.run(run())
+    assert states == ("queued", "running", None)
+    assert position == 1
+    assert order == ["b"]
+
+
+def test_drop_deadline_expires_queued_job():
+    async def run():
+        expired = []
+
+        async def on_expired(job):
+            expired.append(job.file_id)
+
+        recorder = Recorder()
+        scheduler = make_scheduler(recorder, on_expired=on_expired)
+        await scheduler.start()
+        try:
+            await scheduler.submit(make_job("blocker"))
+            await asyncio.sleep(0)
+            await scheduler.submit(make_job("late", 1, deadline=time.monotonic() + 0.1, deadline_action="drop"))
+            await scheduler.submit(make_job("no-deadline", 1))
+            await asyncio.sleep(1.2)
+            return expired, scheduler.get_position("late"), scheduler.get_position("no-deadline")
+        finally:
+            await scheduler.stop()
+
+    assert asyncio.run(run()) == (["late"], None, 1)
+
+
+def test_downgrade_deadline_switches_model_before_start():
+    def fit_deadline(job, remaining):
+        assert remaining <= 10
+        return "tiny", 1.0
+
+    recorder = Recorder()
+    jobs = [
+        make_job("tight", 100, deadline=time.monotonic() + 10, deadline_action="downgrade"),
+        make_job("loose", 100, deadline=time.monotonic() + 1000, deadline_action="downgrade"),
+    ]
+
+    _, order = asyncio.run(run_queued(make_scheduler(recorder, fit_deadline=fit_deadline), recorder, jobs))
+
+    assert recorder.models == {"tight": "tiny", "loose": "base"}
+    assert order == ["tight", "loose"]
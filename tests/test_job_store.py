@@ -0,0 +1,48 @@
+import asyncio
+
+from backend.utils.job_store import SQLiteJobStore
+
+
+def run_with_store(tmp_path, scenario, **kwargs):
+    async def run():
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"), **kwargs)
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+
+    return asyncio.run(run())
+
+
+def test_finished_jobs_are_evicted_and_read_back_from_sqlite(tmp_path):
+    async def scenario(store):
+        await store.put_metadata("a", {"stored_filename": "a.wav"})
+        await store.put_metadata("a", {"segment_count": 1}, kind="result")
+        await store.put_status("a", {"status": "processing", "timestamp": 1})
+        assert store.list_jobs("processing") == ["a"]
+
+        await store.put_status("a", {"status": "completed", "timestamp": 2})
+        cached = dict(store._status), dict(store._metadata)
+        status = await store.get_status("a")
+        return cached, status, await store.get_metadata("a"), dict(store._status), store.list_jobs("completed")
+
+    cached, status, metadata, after_read, completed = run_with_store(tmp_path, scenario)
+    assert cached == ({}, {})
+    assert status["status"] == "completed"
+    assert metadata == {"stored_filename": "a.wav"}
+    # 終止狀態讀取後不留在快取中
+    assert after_read == {}
+    assert completed == ["a"]
+
+
+def test_metadata_cache_is_bounded(tmp_path):
+    async def scenario(store):
+        for key in "abcd":
+            await store.put_metadata(key, {"key": key})
+        await store.get_metadata("b")
+        await store.put_metadata("e", {"key": "e"})
+        return [key for _, key in store._metadata], await store.get_metadata("a")
+
+    cached, evicted = run_with_store(tmp_path, scenario, cache_entries=3)
+    assert cached == ["d", "b", "e"]
+    assert evicted == {"key": "a"}
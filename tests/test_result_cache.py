@@ -0,0 +1,80 @@
+import os
+import time
+import hashlib
+
+import pytest
+
+from backend.utils.result_cache import TranscriptCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE_MAX_MB", "1")
+    monkeypatch.setenv("RESULT_CACHE_MAX_AGE_DAYS", "1")
+    return TranscriptCache(str(tmp_path))
+
+
+def write(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+def test_make_key_depends_on_every_option():
+    base = TranscriptCache.make_key("hash", "base", "en", False)
+    variants = [
+        TranscriptCache.make_key("other", "base", "en", False),
+        TranscriptCache.make_key("hash", "small", "en", False),
+        TranscriptCache.make_key("hash", "base", "zh", False),
+        TranscriptCache.make_key("hash", "base", "en", True),
+        TranscriptCache.make_key("hash", "base", "en", False, engine="ctranslate2"),
+        TranscriptCache.make_key("hash", "base", "en", False, vad=True),
+        TranscriptCache.make_key("hash", "base", "en", False, word_timestamps=True),
+    ]
+    assert len({base, *variants}) == len(variants) + 1
+
+
+def test_default_engine_keeps_the_original_key():
+    # 加入引擎選項之前寫入的快取仍可命中
+    assert TranscriptCache.make_key("hash", "base", "en", True) == hashlib.sha256(b"hash:base:en:1").hexdigest()
+
+
+def test_store_and_lookup_with_segments(cache, tmp_path):
+    result = write(tmp_path / "result.txt", "hello")
+    segments = write(tmp_path / "segments.jsonl", '{"start":0,"end":1,"text":"hello"}\n')
+    key = TranscriptCache.make_key("hash", "base", "en", False)
+
+    assert cache.lookup(key) is None
+    cache.store(key, str(result), str(segments))
+    path = cache.lookup(key)
+
+    assert open(path, encoding="utf-8").read() == "hello"
+    assert os.path.exists(TranscriptCache.segments_path(path))
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_lookup_drops_expired_entries(cache, tmp_path):
+    key = TranscriptCache.make_key("hash", "base", "en", False)
+    cache.store(key, str(write(tmp_path / "result.txt", "old")))
+    path = cache._entry_path(key)
+    stale = time.time() - 2 * 24 * 3600
+    os.utime(path, (stale, stale))
+
+    assert cache.lookup(key) is None
+    assert not os.path.exists(path)
+    assert cache.evictions == 1
+
+
+def test_evict_removes_least_recently_used_until_under_limit(cache, tmp_path):
+    keys = [TranscriptCache.make_key(f"hash{i}", "base", "en", False) for i in range(3)]
+    for i, key in enumerate(keys):
+        result = write(tmp_path / f"result{i}.txt", "x" * (400 * 1024))
+        cache.store(key, str(result))
+        used = time.time() - 100 + i
+        os.utime(cache._entry_path(key), (used, used))
+    # 最舊的項目剛被讀取，改為淘汰第二舊的
+    assert cache.lookup(keys[0]) is not None
+
+    cache.evict()
+
+    assert [cache.lookup(key) is not None for key in keys] == [True, False, True]
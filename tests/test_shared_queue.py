@@ -0,0 +1,118 @@
+import time
+import asyncio
+
+import pytest
+
+from backend.utils.job_queue import QueueFullError, TranscriptionJob
+from backend.utils.shared_queue import SQLiteJobQueue
+
+
+def make_job(file_id, estimated=None, model_size="base", **kwargs):
+    return TranscriptionJob(
+        file_id=file_id, model_size=model_size, language="en", include_timestamps=False, estimated_seconds=estimated, **kwargs
+    )
+
+
+def run_with_queue(tmp_path, scenario, **kwargs):
+    async def run():
+        queue = SQLiteJobQueue(str(tmp_path / "queue.db"), **kwargs)
+        try:
+            return await scenario(queue)
+        finally:
+            await queue.close()
+
+    return asyncio.run(run())
+
+
+def test_claim_order_and_excluded_models(tmp_path):
+    async def scenario(queue):
+        await queue.enqueue(make_job("long", 30))
+        await queue.enqueue(make_job("large", 1, model_size="large"))
+        await queue.enqueue(make_job("short", 5))
+        await queue.enqueue(make_job("batch", 1, priority="batch"))
+        claimed = [(await queue.claim("w1", exclude_models=["large"])).file_id for _ in range(3)]
+        return claimed, await queue.claim("w1", exclude_models=["large"]), (await queue.claim("w1")).file_id
+
+    claimed, nothing, large = run_with_queue(tmp_path, scenario)
+    assert claimed == ["short", "long", "batch"]
+    assert nothing is None
+    assert large == "large"
+
+
+def test_enqueue_rejects_duplicates_and_full_queue(tmp_path):
+    async def scenario(queue):
+        await queue.enqueue(make_job("a"), max_pending=1)
+        with pytest.raises(ValueError):
+            await queue.enqueue(make_job("a"))
+        with pytest.raises(QueueFullError):
+            await queue.enqueue(make_job("b"), max_pending=1)
+
+    run_with_queue(tmp_path, scenario)
+
+
+def test_expired_lease_is_requeued_then_abandoned(tmp_path):
+    async def scenario(queue):
+        await queue.enqueue(make_job("a"))
+        assert (await queue.claim("w1")).file_id == "a"
+        await asyncio.sleep(0.1)
+        first = await queue.requeue_expired()
+        # 重新排隊後由其他節點領取，原節點的 complete 不影響
+        assert (await queue.claim("w2")).file_id == "a"
+        await queue.complete("w1", "a")
+        await asyncio.sleep(0.1)
+        second = await queue.requeue_expired()
+        return first, second, await queue.snapshot()
+
+    first, second, snapshot = run_with_queue(tmp_path, scenario, lease_seconds=0.05, max_attempts=2)
+    assert first == (["a"], [])
+    assert second == ([], ["a"])
+    assert snapshot["pending"] == [] and snapshot["running"] == []
+
+
+def test_heartbeat_extends_lease_and_reports_cancel_requests(tmp_path):
+    async def scenario(queue):
+        await queue.enqueue(make_job("a"))
+        await queue.enqueue(make_job("b"))
+        await queue.claim("w1")
+        state = await queue.cancel("b", "使用者取消"), await queue.cancel("a", "使用者取消"), await queue.cancel("missing")
+        for _ in range(3):
+            await asyncio.sleep(0.1)
+            held, cancels = await queue.heartbeat("w1", ["a"], {"slots": 1})
+        requeued = await queue.requeue_expired()
+        snapshot = await queue.snapshot()
+        return state, held, cancels, requeued, snapshot
+
+    state, held, cancels, requeued, snapshot = run_with_queue(tmp_path, scenario, lease_seconds=0.3)
+    assert state == ("queued", "running", None)
+    assert held == {"a"}
+    assert cancels == {"a": "使用者取消"}
+    assert requeued == ([], [])
+    assert [job.file_id for job, _ in snapshot["running"]] == ["a"]
+    assert snapshot["workers"] == [{"worker_id": "w1", "slots": 1}]
+
+
+def test_release_requeues_without_counting_an_attempt(tmp_path):
+    async def scenario(queue):
+        await queue.enqueue(make_job("a"))
+        await queue.claim("w1")
+        released = await queue.release("w1")
+        await queue.claim("w2")
+        await asyncio.sleep(0.1)
+        return released, await queue.requeue_expired()
+
+    released, requeued = run_with_queue(tmp_path, scenario, lease_seconds=0.05, max_attempts=2)
+    assert released == ["a"]
+    # 正常關閉歸還的那次不計入，第二次領取後租約到期仍可重新排隊
+    assert requeued == (["a"], [])
+
+
+def test_expire_pending_drops_only_expired_drop_jobs(tmp_path):
+    async def scenario(queue):
+        past = time.monotonic() - 1
+        await queue.enqueue(make_job("drop", deadline=past, deadline_action="drop"))
+        await queue.enqueue(make_job("downgrade", deadline=past, deadline_action="downgrade"))
+        await queue.enqueue(make_job("future", deadline=time.monotonic() + 60, deadline_action="drop"))
+        expired = await queue.expire_pending()
+        return expired, sorted(job.file_id for job in (await queue.snapshot())["pending"])
+
+    assert run_with_queue(tmp_path, scenario) == (["drop"], ["downgrade", "future"])
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from backend.models.whisper_service import TranscriptionCancelled, WhisperService
+
+
+@pytest.fixture
+def service(file_handler, monkeypatch):
+    monkeypatch.setenv("WHISPER_PRELOAD_MODELS", "")
+    service = WhisperService(file_handler)
+    transcribed = []
+
+    async def transcribe(file_id, model_size, language, include_timestamps, **kwargs):
+        # 取代實際推論：記錄呼叫時是否已被要求取消
+        cancelled = False
+        try:
+            service._raise_if_cancelled(file_id)
+        except TranscriptionCancelled:
+            cancelled = True
+        transcribed.append((file_id, model_size, cancelled))
+
+    monkeypatch.setattr(service, "transcribe", transcribe)
+    service.transcribed = transcribed
+    yield service
+    service.shutdown()
+
+
+def test_cancel_without_running_job_is_not_recorded(service):
+    async def run():
+        assert service.cancel("f1", "使用者取消") is False
+        await service.run_job("f1", "base", "en", False)
+
+    asyncio.run(run())
+    assert service.transcribed == [("f1", "base", False)]
+    assert service._cancel_requests == {}
+
+
+def test_cancel_after_finish_does_not_cancel_next_run(service):
+    async def run():
+        await service.run_job("f1", "base", "en", False)
+        # 轉換結束後才送達的取消
+        assert service.cancel("f1") is False
+        await service.run_job("f1", "base", "en", False)
+
+    asyncio.run(run())
+    assert service.transcribed == [("f1", "base", False), ("f1", "base", False)]
+    assert service._job_tokens == {} and service._cancel_requests == {}
+
+
+def test_stale_cancel_request_is_cleared_when_job_starts(service):
+    async def run():
+        service._cancel_requests["f1"] = "遺留的取消"
+        await service.run_job("f1", "base", "en", False)
+
+    asyncio.run(run())
+    assert service.transcribed == [("f1", "base", False)]
+
+
+def test_cancel_during_language_detection(service, monkeypatch):
+    async def resolve_language(file_id, language, engine=None):
+        assert service.cancel(file_id, "使用者取消") is True
+        return "en"
+
+    monkeypatch.setattr(service, "resolve_language", resolve_language)
+
+    async def run():
+        await service.file_handler.update_processing_status("f1", "queued", 5, "排隊中")
+        await service.run_job("f1", "auto", "auto", False)
+        return await service.file_handler.get_processing_status("f1")
+
+    status = asyncio.run(run())
+    assert status["status"] == "cancelled"
+    assert status["message"] == "使用者取消"
+    assert service.transcribed == []
+    assert service._job_tokens == {} and service._cancel_requests == {}
@@ -1,10 +1,14 @@
 import streamlit as st
-import whisper
 import tempfile
 import os
 import time
 from pathlib import Path
 import traceback
+from backend.models.model_registry import ModelRegistry
+from backend.models.engines import MODEL_INFO, available_engines, default_engine, get_engine, model_key
+from backend.models.audio import SAMPLE_RATE, decode_to_pcm, load_pcm, probe_duration
+from backend.utils.estimator import ProcessingTimeEstimator
+from backend.utils.formats import render
 
 # 設定頁面配置
 st.set_page_config(
@@ -16,21 +20,40 @@ st.set_page_config(
 # ===== 所有函數定義 =====
 
 @st.cache_resource
-def load_whisper_model(model_size):
-    """載入並快取 Whisper 模型"""
+def get_model_registry():
+    """所有工作階段共用的模型登錄表，依記憶體預算（WHISPER_MODEL_MEMORY_MB）淘汰最久未使用的模型"""
+    return ModelRegistry()
+
+def load_whisper_model(model_size, engine):
+    """從登錄表取得 Whisper 模型"""
     try:
-        model = whisper.load_model(model_size)
-        return model
+        return get_model_registry().get(model_key(engine, model_size))
     except Exception as e:
         st.error(f"模型載入失敗: {str(e)}")
         if "Connection" in str(e) or "URLError" in str(e):
             st.warning("網路連線問題，請檢查網路後重試")
         return None
 
-def estimate_processing_time(file_size_mb):
-    """估算處理時間（分鐘）"""
-    # 簡單估算：每 10MB 約 1 分鐘
-    return max(0.5, file_size_mb / 10)
+@st.cache_resource
+def get_estimator():
+    """所有工作階段共用的處理時間估算，依完成的轉換更新即時率"""
+    return ProcessingTimeEstimator()
+
+def probe_uploaded_duration(uploaded_file):
+    """以 ffprobe 讀取上傳檔案的音訊長度（同一檔案只讀取一次）"""
+    probed = st.session_state.setdefault('probed_durations', {})
+    key = (uploaded_file.name, uploaded_file.size)
+    if key not in probed:
+        with tempfile.NamedTemporaryFile(suffix=Path(uploaded_file.name).suffix) as tmp_file:
+            tmp_file.write(uploaded_file.getvalue())
+            tmp_file.flush()
+            probed[key] = probe_duration(tmp_file.name)
+    return probed[key]
+
+def estimate_processing_time(uploaded_file, model_size="base", engine=None):
+    """依音訊長度與即時率估算處理時間（分鐘）"""
+    duration = probe_uploaded_duration(uploaded_file)
+    return get_estimator().estimate(duration, model_size, engine or default_engine(), uploaded_file.size) / 60
 
 def format_time(seconds):
     """格式化時間"""
@@ -47,7 +70,7 @@ def format_timestamp(seconds):
     seconds = int(seconds % 60)
     return f"{minutes:02d}:{seconds:02d}"
 
-def process_audio(uploaded_file, model_size, language, include_timestamps):
+def process_audio(uploaded_file, model_size, language, include_timestamps, engine):
     """處理音頻檔案"""
     # 顯示進度
     progress_bar = st.progress(0)
@@ -66,22 +89,19 @@ def process_audio(uploaded_file, model_size, language, include_timestamps):
         status_text.text(f"正在載入 {model_size} 模型...")
         progress_bar.progress(30)
         
-        # 檢查是否需要重新載入模型
-        if (st.session_state.loaded_model is None or 
-            st.session_state.loaded_model_size != model_size):
-            
+        # 工作階段不保留模型參考，讓登錄表淘汰的模型可以被釋放
+        if get_model_registry().is_loaded(model_key(engine, model_size)):
+            model = load_whisper_model(model_size, engine)
+        else:
             with st.spinner(f"首次載入 {model_size} 模型，請稍候..."):
-                model = load_whisper_model(model_size)
-                
-            if model is not None:
-                st.session_state.loaded_model = model
-                st.session_state.loaded_model_size = model_size
-                st.session_state.model_loaded = True
-            else:
-                st.error("模型載入失敗")
-                return
+                model = load_whisper_model(model_size, engine)
+        
+        if model is not None:
+            st.session_state.loaded_model_size = model_size
+            st.session_state.model_loaded = True
         else:
-            model = st.session_state.loaded_model
+            st.error("模型載入失敗")
+            return
         
         # 步驟3: 轉換音頻
         status_text.text("正在進行語音識別...")
@@ -91,10 +111,18 @@ def process_audio(uploaded_file, model_size, language, include_timestamps):
         
         # 執行轉換
         language_param = None if language == "auto" else language
-        result = model.transcribe(tmp_file_path, language=language_param)
+        pcm_path = f"{tmp_file_path}.pcm"
+        try:
+            decode_to_pcm(tmp_file_path, pcm_path)
+            audio = load_pcm(pcm_path)
+            result = get_engine(engine).transcribe(model, audio, language_param)
+        finally:
+            if os.path.exists(pcm_path):
+                os.remove(pcm_path)
         
         # 步驟4: 完成
         processing_time = time.time() - start_time
+        get_estimator().record(len(audio) / SAMPLE_RATE, model_size, engine, processing_time)
         progress_bar.progress(100)
         status_text.text(f"轉換完成！耗時 {format_time(processing_time)}")
         
@@ -124,21 +152,36 @@ def process_audio(uploaded_file, model_size, language, include_timestamps):
             # 時間戳記模式
             st.subheader("含時間戳記的內容")
             
-            timestamp_text = ""
-            for segment in result['segments']:
-                start_time = format_timestamp(segment['start'])
-                end_time = format_timestamp(segment['end'])
-                text_line = f"[{start_time} - {end_time}] {segment['text']}\n"
-                timestamp_text += text_line
-                st.text(text_line.strip())
+            # 一次組出全部內容並以單一元件顯示，長音訊的數千個句段不會逐一建立元件
+            timestamp_text = "\n".join(
+                f"[{format_timestamp(segment['start'])} - {format_timestamp(segment['end'])}] {segment['text'].strip()}"
+                for segment in result['segments']
+            )
+            st.text_area("含時間戳記的轉換結果", timestamp_text, height=300)
             
             # 下載按鈕
-            st.download_button(
-                label="📥 下載時間戳記文字檔",
-                data=timestamp_text,
-                file_name=f"{Path(uploaded_file.name).stem}_timestamps.txt",
-                mime="text/plain"
-            )
+            col_txt, col_srt, col_vtt = st.columns(3)
+            with col_txt:
+                st.download_button(
+                    label="📥 下載時間戳記文字檔",
+                    data=timestamp_text,
+                    file_name=f"{Path(uploaded_file.name).stem}_timestamps.txt",
+                    mime="text/plain"
+                )
+            with col_srt:
+                st.download_button(
+                    label="📥 下載 SRT 字幕",
+                    data="".join(render("srt", result['segments'])),
+                    file_name=f"{Path(uploaded_file.name).stem}.srt",
+                    mime="application/x-subrip"
+                )
+            with col_vtt:
+                st.download_button(
+                    label="📥 下載 VTT 字幕",
+                    data="".join(render("vtt", result['segments'])),
+                    file_name=f"{Path(uploaded_file.name).stem}.vtt",
+                    mime="text/vtt"
+                )
         else:
             # 純文字模式
             st.subheader("轉換內容")
@@ -175,7 +218,6 @@ def process_audio(uploaded_file, model_size, language, include_timestamps):
 if 'model_loaded' not in st.session_state:
     st.session_state.model_loaded = False
     st.session_state.loaded_model_size = None
-    st.session_state.loaded_model = None
     st.session_state.processing_count = 0
 
 # 標題
@@ -202,8 +244,7 @@ with col1:
         # 檔案資訊
         st.info(f"""
         📄 **檔案名稱:** {uploaded_file.name}  
-        💾 **檔案大小:** {file_size_mb:.1f} MB  
-        ⏱️ **預估處理時間:** {estimate_processing_time(file_size_mb):.1f} 分鐘
+        💾 **檔案大小:** {file_size_mb:.1f} MB
         """)
         
         # 設定選項
@@ -214,16 +255,17 @@ with col1:
         with col_setting1:
             model_size = st.selectbox(
                 "選擇 AI 模型",
-                ["tiny", "base", "small", "medium", "large"],
+                list(MODEL_INFO),
                 index=1,
-                format_func=lambda x: {
-                    "tiny": "Tiny - 最快速",
-                    "base": "Base - 平衡（推薦）",
-                    "small": "Small - 較準確",
-                    "medium": "Medium - 很準確",
-                    "large": "Large - 最準確"
-                }[x]
+                format_func=lambda x: MODEL_INFO[x]["name"]
             )
+            # 安裝了多個推論引擎時才顯示選項
+            engines = available_engines()
+            engine = default_engine()
+            if len(engines) > 1:
+                engine = st.selectbox(
+                    "推論引擎", engines, index=engines.index(engine) if engine in engines else 0
+                )
         
         with col_setting2:
             language = st.selectbox(
@@ -241,9 +283,12 @@ with col1:
         with col_setting3:
             include_timestamps = st.checkbox("包含時間戳記", value=False)
         
+        # 依所選的模型與推論引擎預估
+        st.info(f"⏱️ **預估處理時間（{model_size} 模型）:** {estimate_processing_time(uploaded_file, model_size, engine):.1f} 分鐘")
+        
         # 轉換按鈕
         if st.button("🚀 開始轉換", type="primary", use_container_width=True):
-            process_audio(uploaded_file, model_size, language, include_timestamps)
+            process_audio(uploaded_file, model_size, language, include_timestamps, engine)
 
 with col2:
     # 側邊資訊
@@ -258,6 +303,14 @@ with col2:
     # 處理統計
     st.metric("已處理檔案", f"{st.session_state.processing_count} 個")
     
+    # 模型快取
+    cache_stats = get_model_registry().stats()
+    st.caption(
+        f"常駐模型: {', '.join(cache_stats['resident']) or '無'} · "
+        f"{cache_stats['memory_used_mb']}/{cache_stats['memory_budget_mb']} MB · "
+        f"命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} / 淘汰 {cache_stats['evictions']}"
+    )
+    
     # 使用提示
     st.header("💡 使用提示")
     